@@ -1,86 +1,213 @@
-from flask import Flask, jsonify, request, send_from_directory
-from flask_cors import CORS
+from flask import Flask, Response, g, jsonify, request, send_file
 import os
-import json
-import requests
-import threading
-import paho.mqtt.client as mqtt
+import csv
 import time
-import ssl
-import shutil
-import subprocess
 import logging
+import shutil
 import random
-
-logging.basicConfig(level=logging.DEBUG)
+import atexit
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from certs import CERT_DIR, CertificateError
+from cloud_client import CloudClient, CloudUnavailable
+from coalesce import SingleFlight
+from gcode_analysis import AnalysisError, analyze_file, estimate_weight, save_upload
+from gateway_ipc import GATEWAY_SOCKET, GatewayClient, RemoteServices
+from gateway_server import GatewayServices
+from http_cache import FileCache, VersionedCache, json_payload
+from jobs import JobRejected, JobRunner
+from logqueue import setup_logging
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry
+from mqtt_gateway import CommandError, CommandTimeout
+from storage import DuplicateError, Store
+from spool_io import (
+    FORMATS as SPOOL_FORMATS, buffer_import, buffered_rows, detect_format, export_csv, export_ndjson, read_records,
+    spool_from_input, text_stream,
+)
+from state_stream import StateBroadcaster, sse_event, stream_state
+
+# Log-Ausgabe über eine Queue, Requests warten nicht auf stdout
+setup_logging()
+log = logging.getLogger("app")
 
 app = Flask(__name__)
 STATIC_FOLDER = os.path.join(os.path.dirname(__file__), "static")
 PRINTERS_FILE = os.path.join(STATIC_FOLDER, "printers.json")
-ACTIVE_PRINTER_FILE = os.path.join(STATIC_FOLDER, "active_printer.json")
+FILAMENT_FILE = os.path.join(STATIC_FOLDER, "filacore_spools.json")
+CERT_FOLDER = CERT_DIR
+MQTT_FIRST_REPORT_TIMEOUT = 5
+# Ohne neuen Report seit so vielen Sekunden wird einmal pushall angefordert
+MQTT_STALE_AFTER = 60
+# Gleichzeitige Abrufe pro Drucker teilen sich ein Ergebnis, das so lange gültig bleibt
+COALESCE_TTL = float(os.environ.get("FILACORE_COALESCE_TTL", "2"))
+# Obergrenze für parallele Statusabfragen über alle Drucker
+FLEET_WORKERS = int(os.environ.get("FILACORE_FLEET_WORKERS", "8"))
+FLEET_MAX_TIMEOUT = 10
+TELEMETRY_MAX_BUCKETS = 2000
+FILAMENT_PAGE_SIZE = 50
+FILAMENT_MAX_PAGE_SIZE = 500
+# So viele fehlerhafte Zeilen werden beim Import einzeln zurückgemeldet
+IMPORT_MAX_ERRORS = 1000
+PRINT_JOB_PAGE_SIZE = 50
+DEBUG_STREAM_SECONDS = 20
+# Felder aus dem print-Abschnitt für die kompakte Flottenübersicht
+FLEET_SUMMARY_FIELDS = [
+    "gcode_state", "job_name", "subtask_name", "progress", "mc_percent", "mc_remaining_time",
+    "estimated_time", "nozzle_temper", "bed_temper", "print_error",
+]
+
+# Spulen und Drucker liegen in SQLite, die alten JSON-Dateien werden einmalig übernommen
+store = Store(shared_versions=bool(GATEWAY_SOCKET))
+store.import_json(FILAMENT_FILE, PRINTERS_FILE)
+
+# Geparste Konfiguration und fertige Antworten (ETag + gzip) im Speicher halten
+file_cache = FileCache()
+printers_cache = VersionedCache(lambda: store.list_printers())
+
+if GATEWAY_SOCKET:
+    # Mehrere Worker-Prozesse (gunicorn.conf.py): MQTT-Verbindungen, Zustände und ihre
+    # Listener liegen im Gateway-Prozess, jeder Drucker sieht weiterhin nur einen Client
+    services = RemoteServices(GatewayClient(GATEWAY_SOCKET))
+else:
+    services = GatewayServices(store, CERT_FOLDER)
+
+gateway = services.gateway
+cert_manager = services.cert_manager
+recorder = services.recorder
+consumption = services.consumption
+tray_matcher = services.tray_matcher
+print_history = services.print_history
+captures = services.captures
+# Änderungen an alle offenen Status-Streams dieses Prozesses verteilen
+broadcaster = StateBroadcaster()
+gateway.add_listener(broadcaster.on_state_change)
+
+# Mit dem Debug-Reloader wartet der Elternprozess nur auf Dateiänderungen,
+# Snapshot und Verbindungen gehören in den Kindprozess mit dem Server
+if not GATEWAY_SOCKET and (__name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+    services.start()
+    atexit.register(services.close)
+
+mqtt_reads = SingleFlight(ttl=COALESCE_TTL)
+# Bambu-Cloud über eine gepoolte Session, mit Cache pro Drucker und Circuit Breaker
+cloud = CloudClient()
+# Lange Operationen (Zertifikate, Befehle, Mitschnitte) laufen als Jobs auf einem festen Pool;
+# mit mehreren Workern ist der Status über das JobBoard im Gateway-Prozess für alle abrufbar
+jobs = JobRunner(board=services.jobs if GATEWAY_SOCKET else None)
+fleet_pool = ThreadPoolExecutor(max_workers=FLEET_WORKERS, thread_name_prefix="fleet")
+
+REQUEST_LATENCY = registry.histogram(
+    "filacore_http_request_duration_seconds", "Bearbeitungszeit pro Route", ("route", "method"))
+REQUESTS = registry.counter(
+    "filacore_http_requests_total", "Requests pro Route und Statuscode", ("route", "method", "status"))
+CACHES = {"files": file_cache, "printers": printers_cache}
+registry.gauge("filacore_cache_hits_total", "Treffer in den Datei- und Antwort-Caches", ("cache",),
+               lambda: [((name,), cache.hits) for name, cache in CACHES.items()], kind="counter")
+registry.gauge("filacore_cache_misses_total", "Neu geladene Einträge in den Datei- und Antwort-Caches", ("cache",),
+               lambda: [((name,), cache.misses) for name, cache in CACHES.items()], kind="counter")
+registry.gauge("filacore_jobs", "Hintergrund-Jobs nach Status", ("status",), lambda: job_counts())
+registry.gauge("filacore_stream_subscribers", "Offene Status-Streams", (),
+               lambda: [((), broadcaster.subscriber_count())])
+
+
+def job_counts():
+    counts = {}
+    for job in jobs.list():
+        counts[job.status] = counts.get(job.status, 0) + 1
+    return [((status,), n) for status, n in sorted(counts.items())]
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # Routenmuster statt URL, damit /jobs/<id> nicht pro Job eine eigene Serie bekommt
+        route = request.url_rule.rule if request.url_rule is not None else "unbekannt"
+        REQUEST_LATENCY.observe(time.perf_counter() - started, route, request.method)
+        REQUESTS.inc(route, request.method, str(response.status_code))
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    if not GATEWAY_SOCKET:
+        return Response(registry.render(), mimetype=METRICS_CONTENT_TYPE)
+    # MQTT, Telemetrie usw. aus dem Gateway-Prozess, HTTP-Metriken von diesem Worker
+    shared = services.metrics
+    body = shared.render() + registry.render(skip=set(shared.names()))
+    return Response(body, mimetype=METRICS_CONTENT_TYPE)
 
-def fetch_certificate(ip: str, save_path: str) -> bool:
-    print(f"[fetch_certificate] Starte Zertifikatsabruf für IP: {ip}")
-    try:
-        cmd = [
-            "openssl", "s_client", "-showcerts", "-connect", f"{ip}:8883"
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=15)
-        print(f"[fetch_certificate] OpenSSL Rückgabe-Code: {result.returncode}")
-        if result.stderr:
-            print(f"[fetch_certificate] OpenSSL STDERR: {result.stderr.strip()}")
-        if not result.stdout:
-            print("[fetch_certificate] Keine OpenSSL STDOUT Ausgabe erhalten")
-            return False
-
-        certs = []
-        capture = False
-        for line in result.stdout.splitlines():
-            if "-----BEGIN CERTIFICATE-----" in line:
-                capture = True
-                certs.append(line)
-            elif "-----END CERTIFICATE-----" in line:
-                certs.append(line)
-                capture = False
-            elif capture:
-                certs.append(line)
-
-        if not certs:
-            print("[fetch_certificate] Keine Zertifikate im Output gefunden!")
-            return False
-
-        with open(save_path, "w") as f:
-            f.write("\n".join(certs))
-
-        print(f"[fetch_certificate] Zertifikat erfolgreich gespeichert unter: {save_path}")
-        return True
-    except subprocess.TimeoutExpired:
-        print(f"[fetch_certificate] Fehler: OpenSSL-Befehl für {ip} hat zu lange gedauert")
-        return False
-    except Exception as e:
-        print(f"[fetch_certificate] Ausnahmefehler beim Zertifikat holen für {ip}: {e}")
-        return False
 
 def load_printers():
-    if not os.path.exists(PRINTERS_FILE):
-        return []
-    with open(PRINTERS_FILE, "r") as f:
-        return json.load(f)
+    return store.list_printers()
 
-def save_printers(printers):
-    with open(PRINTERS_FILE, "w") as f:
-        json.dump(printers, f, indent=2)
+
+# Version der Druckertabelle beim letzten Abgleich des Gateways
+_synced_printers_version = None
+
+
+def sync_printers(force=False):
+    """Gleicht das Gateway mit der Druckerliste ab, aber nur, wenn sich die Tabelle seither geändert hat."""
+    global _synced_printers_version
+    # Version vor dem Lesen merken: eine Änderung dazwischen führt beim nächsten Mal erneut zum Abgleich
+    version = store.versions["printers"]
+    if force or version != _synced_printers_version:
+        gateway.sync(load_printers())
+        _synced_printers_version = version
 
 @app.route("/")
 def index():
     return "FilaCore läuft"
 @app.route("/filacore")
 def filacore_ui():
-    return send_from_directory(app.static_folder, "filacore.html")
+    return file_cache.static(os.path.join(app.static_folder, "filacore.html")).response()
 
 @app.route("/api/filamente", methods=["GET"])
 def get_filamente():
-    return jsonify([])  # später JSON-Datei einlesen
+    """Eine Seite Spulen, gefiltert und sortiert in SQLite.
+
+    Parameter: material, hersteller, druckprofil (mehrfach oder kommagetrennt),
+    temp, temp_min, temp_max, q (Suche), sort (z.B. "hersteller" oder "-preis"),
+    limit und cursor (next_cursor der vorigen Seite).
+    """
+    args = request.args
+    try:
+        filters = {
+            field: [v.strip() for value in args.getlist(field) for v in value.split(",") if v.strip()]
+            for field in ("material", "hersteller", "druckprofil")
+        }
+        sort = args.get("sort", "erstellt")
+        page = store.query_spools(
+            filters,
+            search=args.get("q"),
+            temp=number_arg("temp"),
+            temp_min=number_arg("temp_min"),
+            temp_max=number_arg("temp_max"),
+            sort=sort.lstrip("-"),
+            desc=sort.startswith("-"),
+            limit=min(max(int(args.get("limit", FILAMENT_PAGE_SIZE)), 1), FILAMENT_MAX_PAGE_SIZE),
+            cursor=args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # ETag erlaubt 304, wenn sich die Seite nicht geändert hat
+    return json_payload(page).response()
+
+
+def number_arg(name):
+    value = request.args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} muss eine Zahl sein")
 
 @app.route("/api/druckerstatus", methods=["GET"])
 def drucker_status():
@@ -94,31 +221,27 @@ def add_printer():
     access_code = data.get("access_code")
     ip = data.get("ip")
     name = data.get("name", f"Drucker {serial}")
+    port = data.get("port")
 
     if not (serial and access_code and ip):
         return jsonify({"error": "serial, access_code und ip sind erforderlich"}), 400
 
-    printers = load_printers()
-    if any(p["serial"] == serial for p in printers):
-        return jsonify({"error": "Drucker mit dieser Serial existiert bereits"}), 400
-    if any(p["name"] == name for p in printers):
-        return jsonify({"error": "Name wird bereits verwendet"}), 400
-
-    printers.append({
+    printer = {
         "serial": serial,
         "access_code": access_code,
         "ip": ip,
         "name": name
-    })
-    save_printers(printers)
-
-    # Zertifikat-Ordner anlegen
-    cert_dir = os.path.join(STATIC_FOLDER, "printers", name)
-    os.makedirs(cert_dir, exist_ok=True)
+    }
+    # Nur nötig, wenn der Drucker (z.B. ein Simulator) nicht auf 8883 lauscht
+    if port:
+        printer["port"] = int(port)
+    try:
+        store.add_printer(printer)
+    except DuplicateError as e:
+        return jsonify({"error": str(e)}), 400
 
     # Zertifikat asynchron holen
-    cert_path = os.path.join(cert_dir, "blcert.pem")
-    threading.Thread(target=fetch_certificate, args=(ip, cert_path), daemon=True).start()
+    cert_manager.fetch_async(store.get_printer(serial))
 
     return jsonify({"success": True, "message": "Drucker hinzugefügt, Zertifikat wird erstellt"})
 
@@ -131,19 +254,21 @@ def delete_printer():
         if not serial:
             return jsonify({"error": "serial ist erforderlich"}), 400
 
-        printers = load_printers()
-        printer_to_delete = next((p for p in printers if p["serial"] == serial), None)
+        printer_to_delete = store.get_printer(serial)
 
-        if not printer_to_delete:
+        if not printer_to_delete or not store.delete_printer(serial):
             return jsonify({"error": "Kein Drucker mit dieser Serial gefunden"}), 404
 
-        new_list = [p for p in printers if p["serial"] != serial]
-        save_printers(new_list)
+        sync_printers()
+        consumption.reload_assignments()
+        tray_matcher.forget(serial)
+        print_history.forget(serial)
+        cloud.forget(serial)
 
         # Ordner des Druckers löschen, wenn vorhanden
         printer_name = printer_to_delete.get("name")
         if printer_name:
-            cert_dir = os.path.join(app.static_folder, "printers", printer_name)
+            cert_dir = os.path.join(CERT_FOLDER, printer_name)
             if os.path.exists(cert_dir) and os.path.isdir(cert_dir):
                 shutil.rmtree(cert_dir)
 
@@ -154,8 +279,7 @@ def delete_printer():
 @app.route("/get_printers", methods=["GET"])
 def get_printers():
     try:
-        printers = load_printers()
-        return jsonify(printers)
+        return printers_cache.get(store.versions["printers"]).response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 @app.route("/set_active_printer", methods=["POST"])
@@ -165,67 +289,74 @@ def set_active_printer():
     if not serial:
         return jsonify({"error": "serial ist erforderlich"}), 400
 
-    printers = load_printers()
-    found = None
-
-    # Nur einer darf aktiv sein
-    for p in printers:
-        if p["serial"] == serial:
-            p["active"] = True
-            found = p
-        else:
-            p["active"] = False
+    # Nur einer darf aktiv sein – erledigt ein einzelnes UPDATE
+    found = store.set_active_printer(serial)
 
     if not found:
         return jsonify({"error": "Drucker nicht gefunden"}), 404
 
-    # Save updated printers.json
-    with open(PRINTERS_FILE, "w") as f:
-        json.dump(printers, f, indent=2)
-
     # Zertifikat wie gehabt prüfen/besorgen:
-    cert_folder = os.path.join(STATIC_FOLDER, "printers", found["name"])
-    cert_path = os.path.join(cert_folder, "blcert.pem")
-    if not os.path.exists(cert_path):
-        os.makedirs(cert_folder, exist_ok=True)
-        threading.Thread(target=fetch_certificate, args=(found["ip"], cert_path), daemon=True).start()
+    if cert_manager.ensure(found):
         return jsonify({"success": True, "message": "Aktiver Drucker gesetzt. Zertifikat wird angefordert."})
     else:
         return jsonify({"success": True, "message": "Aktiver Drucker gesetzt. Zertifikat ist vorhanden."})
+
+
+def create_cert_job(job, printer):
+    job.check_cancelled()
+    try:
+        # Über fetch(), damit parallele Abrufe desselben Druckers (Job, ensure, provision_certs)
+        # sich Handshake und Speichern teilen. Ein Abbruch währenddessen beendet nur den Job,
+        # das Zertifikat des Druckers wird trotzdem gespeichert.
+        cert = cert_manager.fetch(printer)
+    except CertificateError as e:
+        job.check_cancelled()
+        return {"error": f"Zertifikat konnte nicht erstellt werden: {e}"}, 500
+    job.check_cancelled()
+    return {"success": True, "message": "Zertifikat erfolgreich erstellt", "zertifikat": cert}, 200
+
+
 @app.route("/create_cert/<printer_name>", methods=["POST"])
 def create_cert(printer_name):
     try:
-        printers = load_printers()
-        printer = next((p for p in printers if p["name"] == printer_name), None)
+        printer = store.get_printer_by_name(printer_name)
         if not printer:
             return jsonify({"error": "Drucker nicht gefunden"}), 404
 
-        ip = printer.get("ip")
-        if not ip:
+        if not printer.get("ip"):
             return jsonify({"error": "IP-Adresse im Druckereintrag fehlt"}), 400
 
-        cert_dir = os.path.join(app.static_folder, "printers", printer_name)
-        os.makedirs(cert_dir, exist_ok=True)
-        cert_path = os.path.join(cert_dir, "blcert.pem")
+        # Handshake läuft im Job, der Request-Thread ist sofort wieder frei
+        return submit_job("create_cert", create_cert_job, printer, params={"printer": printer_name})
+    except Exception as e:
+        # Ausgabe des genauen Fehlers im Log (über die Queue wie alle anderen Meldungen)
+        log.exception("Zertifikat für %s konnte nicht angefordert werden", printer_name)
+        return jsonify({"error": f"Interner Serverfehler: {str(e)}"}), 500
+@app.route("/provision_certs", methods=["POST"])
+def provision_certs():
+    """Zertifikate für alle Drucker parallel holen (force=true holt auch vorhandene neu)."""
+    try:
+        force = bool((request.get_json(silent=True) or {}).get("force"))
+        results = cert_manager.provision_all(load_printers(), force=force)
+        return jsonify({"success": all("error" not in r for r in results.values()), "results": results})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        success = fetch_certificate(ip, cert_path)
-        if not success:
-            return jsonify({"error": "Zertifikat konnte nicht erstellt werden"}), 500
 
-        return jsonify({"success": True, "message": "Zertifikat erfolgreich erstellt"})
+@app.route("/cert_status", methods=["GET"])
+def cert_status():
+    try:
+        return jsonify({p["serial"]: dict(cert_manager.status(p), name=p["name"]) for p in load_printers()})
     except Exception as e:
-        # Ausgabe des genauen Fehlers im Log
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": f"Interner Serverfehler: {str(e)}"}), 500
+        return jsonify({"error": str(e)}), 500
 @app.route("/printer_state", methods=["GET"])
 def printer_state():
+    """Druckerzustand aus der Bambu-Cloud; ist sie langsam oder nicht erreichbar, der lokale MQTT-Zustand."""
     try:
-        active_path = os.path.join(app.static_folder, "active_printer.json")
-        if not os.path.exists(active_path):
+        serial = request.args.get("serial")
+        printer = store.get_printer(serial) if serial else store.active_printer()
+        if not printer:
             return jsonify({"error": "Kein aktiver Drucker gesetzt"}), 400
-        with open(active_path, "r") as f:
-            printer = json.load(f)
 
         serial = printer.get("serial")
         access_code = printer.get("access_code")
@@ -233,151 +364,322 @@ def printer_state():
         if not serial or not access_code:
             return jsonify({"error": "Druckerdaten unvollständig"}), 400
 
-        url = "https://api.bambulab.com/v1/printer/state"
-        payload = {
-            "serial": serial,
-            "access_code": access_code
-        }
-        headers = {"Content-Type": "application/json"}
-
-        res = requests.post(url, json=payload, headers=headers, timeout=8)
-        if res.status_code != 200:
-            return jsonify({"error": "Fehler beim Abrufen", "status": res.status_code}), 500
-
-        return jsonify(res.json())
+        try:
+            status_code, body = cloud.printer_state(serial, access_code)
+        except CloudUnavailable as e:
+            conn = gateway.get(serial)
+            if conn is None or conn.state.empty:
+                return jsonify({"error": str(e)}), 503
+            body = {
+                "quelle": "mqtt", "cloud_error": str(e), "data": conn.state.snapshot(),
+                "age": round(conn.state.age(), 3), "stale": conn.state.restored,
+            }
+            return jsonify(body)
+        if status_code != 200:
+            return jsonify({"error": "Fehler beim Abrufen", "status": status_code}), 500
+
+        return jsonify(body)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def refresh_state(conn):
+    """Wartet auf den ersten Report bzw. fordert bei veraltetem Zustand einmal pushall an."""
+    return conn.refresh(MQTT_STALE_AFTER, MQTT_FIRST_REPORT_TIMEOUT)
+
+def read_state(serial, wait_first):
+    """Gebündeltes gateway.read_state: gleichzeitige Requests teilen sich einen Abruf (COALESCE_TTL)."""
+    # Eigener Schlüssel, refresh_state() liefert unter der Serial nur True/False
+    return mqtt_reads.do(("state", serial, wait_first), lambda: gateway.read_state(
+        serial, MQTT_STALE_AFTER, MQTT_FIRST_REPORT_TIMEOUT, wait_first))
+
+def read_state_job(job, conn):
+    refreshed = mqtt_reads.do(conn.serial, lambda: refresh_state(conn))
+    job.check_cancelled()
+    if not refreshed:
+        return {"error": "Kein MQTT-Datenempfang"}, 504
+    return {"data": conn.state.snapshot(), "age": round(conn.state.age(), 3), "stale": conn.state.restored}, 200
+
+
 @app.route("/read_mqtt_state", methods=["GET"])
 def read_mqtt_state():
     try:
-        # 1. Drucker mit active:true aus printers.json suchen
-        printers_path = os.path.join(app.static_folder, "printers.json")
-        if not os.path.exists(printers_path):
-            return jsonify({"error": "Kein printers.json gefunden"}), 400
-
-        with open(printers_path, "r") as f:
-            printers = json.load(f)
-
-        printer = next((p for p in printers if p.get("active")), None)
+        # 1. Aktiven Drucker holen
+        printer = store.active_printer()
         if not printer:
             return jsonify({"error": "Kein aktiver Drucker"}), 400
 
         serial = printer.get("serial")
-        access_code = printer.get("access_code")
-        broker_ip = printer.get("ip")
-        broker_port = 8883
-        username = "bblp"
-        password = access_code
-        drucker_name = printer.get("name")
-
-        if not serial or not access_code or not broker_ip or not drucker_name:
+        if not serial or not printer.get("access_code") or not printer.get("ip") or not printer.get("name"):
             return jsonify({"error": "Fehlende Druckerdaten"}), 400
 
-        topic = f"device/{serial}/report"
-        messages = []
+        # 2. Zustand aus der dauerhaften Verbindung lesen statt pro Request neu zu verbinden;
+        # Aktualisieren und Snapshot sind ein Aufruf (mit mehreren Workern ein einziger Roundtrip)
+        sync_printers()
+        async_job = wants_async()
+        state = read_state(serial, wait_first=not async_job)
+        if state is None:
+            # Zertifikat kann inzwischen von Hand abgelegt worden sein: einmal neu abgleichen
+            sync_printers(force=True)
+            mqtt_reads.forget(("state", serial, not async_job))
+            state = read_state(serial, wait_first=not async_job)
+        if state is None:
+            return jsonify({"error": "Zertifikat für den Drucker fehlt noch"}), 503
+
+        snapshot_json, age, restored = state
+        if snapshot_json is None:
+            if async_job:
+                return submit_job("read_mqtt_state", read_state_job, gateway.get(serial), params={"serial": serial})
+            return jsonify({"error": "Kein MQTT-Datenempfang"}), 504
+        # Snapshot ist bereits serialisiert, kein erneutes json.dumps pro Request
+        body = '{"data": %s, "age": %.3f, "stale": %s}' % (snapshot_json, age, "true" if restored else "false")
+        return app.response_class(body, mimetype="application/json")
 
-        def on_connect(client, userdata, flags, rc, properties=None):
-            if rc == 0:
-                client.subscribe(topic)
-            else:
-                print(f"MQTT-Verbindungsfehler: {rc}")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+def printer_status_entry(printer, conn, full):
+    entry = {"serial": printer["serial"], "name": printer["name"], "active": printer.get("active", False)}
+    if conn is None or not conn.running:
+        entry["error"] = "Zertifikat fehlt"
+        return entry
+    entry["connected"] = conn.connected
+    if conn.state.empty:
+        entry["error"] = "Kein MQTT-Datenempfang"
+        return entry
+    entry["age"] = round(conn.state.age(), 3)
+    entry["stale"] = conn.state.restored
+    if full:
+        entry["data"] = conn.state.snapshot()
+    else:
+        print_section = conn.state.get("print", default={})
+        entry["data"] = {"print": {k: print_section[k] for k in FLEET_SUMMARY_FIELDS if k in print_section}}
+    return entry
 
-        def on_message(client, userdata, msg):
-            messages.append(msg.payload.decode())
-            client.disconnect()  # sofort nach erster Nachricht trennen
 
-        client = mqtt.Client()
-        client.username_pw_set(username, password)
-        client.on_connect = on_connect
-        client.on_message = on_message
+@app.route("/fleet_state", methods=["GET"])
+def fleet_state():
+    """Status aller Drucker parallel; wer nicht rechtzeitig antwortet, kommt mit Fehler zurück."""
+    try:
+        try:
+            timeout = min(float(request.args.get("timeout", MQTT_FIRST_REPORT_TIMEOUT)), FLEET_MAX_TIMEOUT)
+        except ValueError:
+            return jsonify({"error": "timeout muss eine Zahl sein"}), 400
+        full = request.args.get("full") in ("1", "true")
+
+        started = time.time()
+        sync_printers()
+        printers = load_printers()
 
-        # Zertifikat jetzt im jeweiligen Druckerordner unter printers/
-        cert_path = os.path.join(app.static_folder, "printers", drucker_name, "blcert.pem")
-        client.tls_set(ca_certs=cert_path)
-        client.tls_insecure_set(True)  # Nur für Test/Self-Signed
+        futures = {}
+        for printer in printers:
+            conn = gateway.get(printer["serial"])
+            if conn is not None and conn.running:
+                futures[printer["serial"]] = fleet_pool.submit(
+                    mqtt_reads.do, printer["serial"], lambda c=conn: refresh_state(c))
+        wait(futures.values(), timeout=timeout)
+
+        results = []
+        for printer in printers:
+            conn = gateway.get(printer["serial"])
+            entry = printer_status_entry(printer, conn, full)
+            future = futures.get(printer["serial"])
+            if future is not None and not future.done():
+                # Teilergebnis: ggf. vorhandener (älterer) Zustand plus Hinweis
+                entry["timeout"] = True
+            results.append(entry)
+
+        return jsonify({"printers": results, "elapsed": round(time.time() - started, 3)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        client.connect(broker_ip, broker_port, 10)
-        client.loop_start()
 
-        timeout = time.time() + 5
-        while time.time() < timeout and not messages:
-            time.sleep(0.1)
+@app.route("/telemetry/<serial>", methods=["GET"])
+def telemetry(serial):
+    """Zeitreihe eines Messwerts, serverseitig auf min/max/avg-Buckets verdichtet."""
+    try:
+        metric = request.args.get("metric")
+        available = recorder.metrics(serial)
+        if not metric:
+            return jsonify({"serial": serial, "metrics": available})
+        if metric not in available:
+            return jsonify({"error": f"Unbekannter Messwert: {metric}", "metrics": available}), 404
+
+        try:
+            end = float(request.args.get("to", time.time()))
+            start = float(request.args.get("from", end - 3600))
+            buckets = min(int(request.args.get("buckets", 200)), TELEMETRY_MAX_BUCKETS)
+        except ValueError:
+            return jsonify({"error": "from, to und buckets müssen Zahlen sein"}), 400
+        if start >= end:
+            return jsonify({"error": "from muss vor to liegen"}), 400
+
+        return jsonify({
+            "serial": serial,
+            "metric": metric,
+            "from": start,
+            "to": end,
+            "buckets": recorder.query(serial, metric, start, end, buckets),
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        client.loop_stop()
 
-        if messages:
-            return jsonify({"data": json.loads(messages[0])})
-        else:
+@app.route("/stream_printer_state", methods=["GET"])
+def stream_printer_state():
+    """Server-Sent Events: Snapshot beim Verbinden, danach nur geänderte Felder."""
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    serial = request.args.get("serial")
+    printer = store.get_printer(serial) if serial else store.active_printer()
+
+    sync_printers()
+    conn = gateway.get(printer["serial"]) if printer else None
+    if conn is None or not conn.running:
+        error = "Kein aktiver Drucker" if not printer else "Zertifikat für den Drucker fehlt noch"
+        body = "retry: 10000\n\n" + sse_event("fehler", {"error": error})
+        return Response(body, mimetype="text/event-stream", headers=headers)
+
+    return Response(stream_state(broadcaster, conn), mimetype="text/event-stream", headers=headers)
+@app.route("/tray_matches", methods=["GET"])
+def tray_matches():
+    """Pro AMS-Tray die zugeordnete Spule und die farblich nächsten Spulen gleichen Materials."""
+    try:
+        serial = request.args.get("serial")
+        printer = store.get_printer(serial) if serial else store.active_printer()
+        if not printer:
+            return jsonify({"error": "Kein aktiver Drucker" if not serial else "Drucker nicht gefunden"}), 404
+        conn = gateway.get(printer["serial"])
+        if conn is None or conn.state.empty:
             return jsonify({"error": "Kein MQTT-Datenempfang"}), 504
 
+        trays = tray_matcher.matches(conn.serial, conn.state.get("print", "ams", "ams", default=[]))
+        spools = {}
+        for tray in trays:
+            tray["fcid"] = consumption.assignment(conn.serial, tray["ams_id"], tray["tray_id"])
+            matches = []
+            for fcid, delta_e in tray["matches"]:
+                if fcid not in spools:
+                    spools[fcid] = store.get_spool(fcid) or {}
+                spool = spools[fcid]
+                matches.append({
+                    "fcid": fcid, "delta_e": delta_e, "material": spool.get("material"),
+                    "hersteller": spool.get("hersteller"), "farbe": spool.get("farbe"),
+                })
+            tray["matches"] = matches
+            del tray["version"]
+        return jsonify({"serial": conn.serial, "trays": trays})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+@app.route("/api/print_jobs", methods=["GET"])
+def get_print_jobs():
+    """Beendete Druckaufträge, neueste zuerst (serial, limit, cursor), dazu laufende Aufträge."""
+    args = request.args
+    serial = args.get("serial")
+    try:
+        page = store.list_print_jobs(
+            serial=serial,
+            limit=min(max(int(args.get("limit", PRINT_JOB_PAGE_SIZE)), 1), FILAMENT_MAX_PAGE_SIZE),
+            cursor=args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    serials = [serial] if serial else [p["serial"] for p in load_printers()]
+    page["laufend"] = []
+    for s in serials:
+        job = print_history.running(s)
+        if job:
+            page["laufend"].append({
+                "serial": s, "name": job["name"], "started": job["started"], "vollstaendig": job["complete"],
+            })
+    return jsonify(page)
+
+@app.route("/api/print_jobs/stats", methods=["GET"])
+def get_print_job_stats():
+    """Vorberechnete Summen: group=tag|serial|material, optional serial, von/bis (JJJJ-MM-TT)."""
+    args = request.args
+    try:
+        stats = store.print_job_stats(
+            group=args.get("group", "tag"), serial=args.get("serial"), since=args.get("von"), until=args.get("bis"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return json_payload({"gruppe": args.get("group", "tag"), "werte": stats}).response()
 @app.route('/api/druckprofile', methods=['GET'])
 def get_druckprofile():
     try:
         path = os.path.join(app.static_folder, 'druckprofile.json')
         if not os.path.exists(path):
             return jsonify({"error": "Druckprofile nicht gefunden"}), 404
-        with open(path, 'r') as f:
-            data = json.load(f)
-        return jsonify(data)
+        _, payload = file_cache.json(path)
+        return payload.response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-FILAMENT_FILE = os.path.join(os.path.dirname(__file__), "static", "filacore_spools.json")
-
 def load_filaments():
-    if not os.path.exists(FILAMENT_FILE):
-        return []
-    with open(FILAMENT_FILE, "r") as f:
-        return json.load(f)
-
-def save_filaments(filaments):
-    with open(FILAMENT_FILE, "w") as f:
-        json.dump(filaments, f, indent=2)
+    return store.list_spools()
 
 @app.route('/api/save_filament', methods=['POST'])
 def save_filament():
     try:
-        data = request.json
-        fcid = data.get('fcid')
-        material = data.get('material')
-        druckprofil = data.get('druckprofil')
-        farbe = data.get('farbe')
-        hersteller = data.get('hersteller')
-        preis = data.get('preis')
-        temp_min = data.get('tempMin') or data.get('temp_min') or data.get('tempMin')
-        temp_max = data.get('tempMax') or data.get('temp_max') or data.get('tempMax')
+        try:
+            new_filament = spool_from_input(request.json)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        if not all([material, druckprofil, farbe, hersteller, preis, temp_min, temp_max]):
-            return jsonify({"error": "Alle Felder sind erforderlich"}), 400
+        try:
+            store.add_spool(new_filament)
+        except DuplicateError as e:
+            return jsonify({"error": str(e)}), 409
 
-        filaments = load_filaments()
+        return jsonify({"success": True, "message": "Filament gespeichert", "fcid": new_filament["fcid"]})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Neue FCID erzeugen, falls nicht gesetzt
-        if not fcid:
-            import uuid
-            fcid = str(uuid.uuid4())
-
-        # Neues Filament-Dict mit ID an erster Stelle (OrderedDict könnte optional sein)
-        new_filament = {
-            "fcid": fcid,
-            "material": material,
-            "druckprofil": druckprofil,
-            "farbe": farbe,
-            "hersteller": hersteller,
-            "preis": preis,
-            "temp_min": temp_min,
-            "temp_max": temp_max
-        }
 
-        filaments.append(new_filament)
+@app.route('/api/filamente/import', methods=['POST'])
+def import_filamente():
+    """Spulen als NDJSON (eine Spule pro Zeile) oder CSV (Kopfzeile mit Feldnamen) importieren.
+
+    Der Body wird zuerst vollständig geprüft und gepuffert, erst dann in einer
+    kurzen Transaktion geschrieben. ?replace=1 überschreibt vorhandene FCIDs,
+    ?dry_run=1 prüft nur. Gemeldet werden die ersten IMPORT_MAX_ERRORS Fehler.
+    """
+    fmt = detect_format(request.args.get("format"), request.content_type)
+    if fmt is None:
+        return jsonify({"error": "format muss ndjson oder csv sein"}), 400
+    dry_run = request.args.get("dry_run") in ("1", "true")
+
+    errors = []
+    try:
+        stream = text_stream(request.stream, request.headers.get("Content-Encoding"))
+        buffer, failed = buffer_import(read_records(stream, fmt), errors, IMPORT_MAX_ERRORS)
+    except (UnicodeDecodeError, OSError, csv.Error) as e:
+        return jsonify({"error": f"Import abgebrochen, nichts gespeichert: {e}"}), 400
+
+    with buffer:
+        result = store.import_spools(buffered_rows(buffer), replace=request.args.get("replace") in ("1", "true"),
+                                     dry_run=dry_run, max_errors=IMPORT_MAX_ERRORS)
+
+    errors = sorted(errors + result["fehler"], key=lambda e: e["zeile"])
+    return jsonify({
+        "importiert": result["importiert"],
+        "aktualisiert": result["aktualisiert"],
+        "fehlerhaft": failed + result["fehlerhaft"],
+        "fehler": errors[:IMPORT_MAX_ERRORS],
+        "dry_run": dry_run,
+    })
+
+
+@app.route('/api/filamente/export', methods=['GET'])
+def export_filamente():
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in SPOOL_FORMATS:
+        return jsonify({"error": "format muss ndjson oder csv sein"}), 400
+    if fmt == "csv":
+        body = export_csv(store.iter_spools(), store.spool_fields())
+    else:
+        body = export_ndjson(store.iter_spools())
+    return Response(body, mimetype=SPOOL_FORMATS[fmt],
+                    headers={"Content-Disposition": f"attachment; filename=filacore_spools.{fmt}"})
 
-        save_filaments(filaments)
 
-        return jsonify({"success": True, "message": "Filament gespeichert", "fcid": fcid})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
 @app.route('/api/delete_filament', methods=['POST'])
 def delete_filament():
     try:
@@ -386,184 +688,366 @@ def delete_filament():
         if not fcid:
             return jsonify({"error": "FCID ist erforderlich"}), 400
 
-        filaments = load_filaments()
-        new_filaments = [f for f in filaments if f.get("fcid") != fcid]
-
-        if len(new_filaments) == len(filaments):
+        if not store.delete_spool(fcid):
             return jsonify({"error": "Filament mit dieser FCID nicht gefunden"}), 404
-
-        save_filaments(new_filaments)
+        consumption.reload_assignments()
         return jsonify({"success": True, "message": "Filament erfolgreich gelöscht"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+@app.route('/api/spool_usage', methods=['GET'])
+def spool_usage():
+    try:
+        fcid = request.args.get("fcid")
+        usage = consumption.usage(fcid)
+        if fcid and not usage:
+            return jsonify({"error": "Filament mit dieser FCID nicht gefunden"}), 404
+        return jsonify({
+            "spools": usage,
+            "slots": store.tray_assignments(request.args.get("serial")),
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+@app.route('/api/analyze_gcode', methods=['POST'])
+def analyze_gcode():
+    """Filamentbedarf einer .gcode/.3mf-Datei pro Tray und ob die Reste der zugeordneten Spulen reichen.
+
+    Datei als multipart-Feld "file" oder direkt als Body. Optional: serial,
+    plate (3MF), scan=1 (Extrusion zählen statt Slicer-Angaben), mapping
+    (Werkzeug -> Tray-Index, z.B. "2,0,-1"; Standard Werkzeug n -> Tray n).
+    """
+    args = request.args
+    plate = args.get("plate")
+    full_scan = args.get("scan") in ("1", "true")
+    try:
+        mapping = [int(v) for v in args["mapping"].split(",")] if args.get("mapping") else None
+    except ValueError:
+        return jsonify({"error": "mapping muss eine Liste von Tray-Indizes sein"}), 400
+    upload = request.files.get("file")
+    suffix = os.path.splitext(upload.filename or "")[1] if upload else ""
+    fd, path = tempfile.mkstemp(prefix="filacore-", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as target:
+            file_hash = save_upload(upload.stream if upload else request.stream, target)
+        key = f"{file_hash}:{plate or ''}:{'scan' if full_scan else ''}"
+        analysis = store.get_gcode_analysis(key)
+        if analysis is None:
+            analysis = analyze_file(path, plate=plate, full_scan=full_scan)
+            store.save_gcode_analysis(key, analysis)
+    except AnalysisError as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        os.remove(path)
+
+    serial = args.get("serial")
+    printer = store.get_printer(serial) if serial else store.active_printer()
+    result = dict(analysis, sha256=file_hash)
+    if printer:
+        result.update(tray_fit(printer["serial"], analysis["werkzeuge"], mapping))
+    return jsonify(result)
+
+
+def tray_fit(serial, tools, mapping=None):
+    """Bedarf pro Werkzeug gegen den Rest der Spule im zugeordneten Tray (Index = ams_id * 4 + tray_id)."""
+    entries = []
+    for entry in tools:
+        tool = entry["tool"]
+        slot = mapping[tool] if mapping and tool < len(mapping) else tool
+        fit = {"tool": tool, "material": entry["material"], "laenge_mm": entry["laenge_mm"]}
+        if slot < 0:
+            entries.append(dict(fit, bedarf_g=estimate_weight(entry), passt=None))
+            continue
+        ams_id, tray_id = divmod(slot, 4)
+        fcid = consumption.assignment(serial, ams_id, tray_id)
+        usage = consumption.usage(fcid) if fcid else []
+        spool = usage[0] if usage else None
+        need = estimate_weight(entry, spool and spool["material"])
+        fit.update(ams_id=ams_id, tray_id=tray_id, fcid=spool and fcid, bedarf_g=need)
+        if spool is None:
+            # Ohne zugeordnete Spule ist der Rest unbekannt
+            entries.append(dict(fit, rest_g=None, passt=None))
+            continue
+        rest = spool["rest_g"] if spool["rest_g"] is not None else spool["gewicht"]
+        if rest is None:
+            # Spule ohne Gewicht: Rest unbekannt
+            entries.append(dict(fit, rest_g=None, passt=None))
+            continue
+        fit.update(rest_g=rest, passt=rest >= need, fehlt_g=round(max(need - rest, 0.0), 1))
+        entries.append(fit)
+    known = [e["passt"] for e in entries if e["passt"] is not None]
+    return {
+        "serial": serial,
+        "trays": entries,
+        # None, solange nicht für jedes Werkzeug eine Spule bekannt ist
+        "passt": False if False in known else (True if len(known) == len(entries) else None),
+    }
+
+
 @app.route("/debug_mqtt_stream")
 def debug_mqtt_stream():
+    """Mitschnitt des aktiven Druckers; dauer=0 läuft bis /captures/<id>/stop."""
     try:
-        printers_path = os.path.join(app.static_folder, "printers.json")
-        if not os.path.exists(printers_path):
-            return jsonify({"error": "Kein printers.json gefunden"}), 400
+        conn, error = active_printer_connection()
+        if error:
+            return error
+
+        try:
+            duration = float(request.args.get("dauer", DEBUG_STREAM_SECONDS))
+        except ValueError:
+            return jsonify({"error": "dauer muss eine Zahl sein"}), 400
+
+        if duration > 0:
+            capture = captures.start(conn.serial, duration)
+            info = f"MQTT-Stream wird {duration:g} Sekunden mitgeschnitten"
+        else:
+            capture = captures.start(conn.serial)
+            info = f"MQTT-Stream wird bis POST /captures/{capture.id}/stop mitgeschnitten"
+        return jsonify({"ok": True, "info": info, "capture": capture.to_dict()})
 
-        with open(printers_path, "r") as f:
-            printers = json.load(f)
-        printer = next((p for p in printers if p.get("active")), None)
-        if not printer:
-            return jsonify({"error": "Kein aktiver Drucker"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        serial = printer.get("serial")
-        access_code = printer.get("access_code")
-        broker_ip = printer.get("ip")
-        broker_port = 8883
-        username = "bblp"
-        password = access_code
-        drucker_name = printer.get("name")
-        if not serial or not access_code or not broker_ip or not drucker_name:
-            return jsonify({"error": "Fehlende Druckerdaten"}), 400
 
-        topic = f"device/{serial}/report"
-        log_path = "/tmp/mqtt_debug.log"  # oder z.B. os.path.join(app.static_folder, "mqtt_debug.log")
+@app.route("/captures", methods=["GET"])
+def list_captures():
+    return jsonify([capture.to_dict() for capture in captures.list()])
 
-        def on_connect(client, userdata, flags, rc, properties=None):
-            with open(log_path, "a") as f:
-                f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] MQTT connected {rc}\n")
-            client.subscribe(topic)
 
-        def on_message(client, userdata, msg):
-            with open(log_path, "a") as f:
-                f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] MQTT [{msg.topic}] {msg.payload.decode(errors='replace')}\n")
+@app.route("/captures", methods=["POST"])
+def start_capture():
+    """Body: {"serial": "..." (ohne = alle Drucker), "dauer": Sekunden (ohne = bis stop)}"""
+    data = request.get_json(silent=True) or {}
+    serial = data.get("serial")
+    if serial and store.get_printer(serial) is None:
+        return jsonify({"error": "Drucker nicht gefunden"}), 404
+    try:
+        duration = float(data["dauer"]) if data.get("dauer") else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "dauer muss eine Zahl sein"}), 400
+    return jsonify(captures.start(serial or None, duration).to_dict())
 
-        client = mqtt.Client()
-        client.username_pw_set(username, password)
-        client.on_connect = on_connect
-        client.on_message = on_message
 
-        cert_path = os.path.join(app.static_folder, "printers", drucker_name, "blcert.pem")
-        client.tls_set(ca_certs=cert_path)
-        client.tls_insecure_set(True)
+@app.route("/captures/<capture_id>/stop", methods=["POST"])
+def stop_capture(capture_id):
+    capture = captures.stop(capture_id)
+    if capture is None:
+        return jsonify({"error": "Mitschnitt nicht gefunden"}), 404
+    return jsonify(capture.to_dict())
 
-        client.connect(broker_ip, broker_port, 10)
-        client.loop_start()
 
-        # 20 Sekunden lang alle MQTT-Nachrichten mitloggen:
-        time.sleep(20)
-        client.loop_stop()
+@app.route("/captures/<capture_id>/<segment>", methods=["GET"])
+def download_capture(capture_id, segment):
+    path = captures.segment_path(capture_id, segment)
+    if path is None:
+        return jsonify({"error": "Segment nicht gefunden"}), 404
+    return send_file(path, mimetype="application/gzip", as_attachment=True, download_name=f"{capture_id}-{segment}")
+
+
+AMS_IDS = range(4)
+AMS_SLOTS = [1, 2, 3, 4]
+
+
+def bambu_color(farbe):
+    # UI speichert "#rrggbb", der Drucker erwartet "RRGGBBAA"
+    color = (farbe or "000000FF").lstrip("#").upper()
+    return color + "FF" if len(color) == 6 else color
+
+
+def filament_setting_params(filament, ams_id, slot):
+    return {
+        "ams_id": ams_id,
+        "tray_id": slot - 1,
+        "tray_info_idx": filament.get("druckprofil"),
+        "tray_color": bambu_color(filament.get("farbe")),
+        "tray_type": filament.get("material"),
+        "nozzle_temp_min": int(filament.get("temp_min") or filament.get("tempMin") or 220),
+        "nozzle_temp_max": int(filament.get("temp_max") or filament.get("tempMax") or 240),
+    }
+
+
+def parse_assignment(entry):
+    """Prüft einen Slot-Auftrag, liefert (ams_id, slot, filament) oder wirft ValueError."""
+    try:
+        slot = int(entry.get("slot", -1))
+        ams_id = int(entry.get("ams_id", 0))
+    except (TypeError, ValueError):
+        raise ValueError("Slot und ams_id müssen Zahlen sein")
+    fcid = entry.get("fcid")
+
+    if slot not in AMS_SLOTS:
+        raise ValueError("Slot muss 1-4 sein")
+    if ams_id not in AMS_IDS:
+        raise ValueError("ams_id muss 0-3 sein")
+    if not fcid:
+        raise ValueError("FCID erforderlich")
+
+    filament = store.get_spool(fcid)
+    if not filament:
+        raise LookupError("Filament nicht gefunden")
+    return ams_id, slot, filament
+
+
+def wants_async():
+    return request.args.get("async") in ("1", "true") or "respond-async" in request.headers.get("Prefer", "")
+
+
+def submit_job(kind, fn, *args, params=None):
+    """Startet fn als Hintergrund-Job und antwortet sofort mit 202 und der Job-ID."""
+    try:
+        job = jobs.submit(kind, fn, *args, params=params)
+    except JobRejected as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify({"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"}), 202
+
+
+def active_printer_connection():
+    """Liefert (conn, None) oder (None, (fehler_response, status))."""
+    printer = store.active_printer()
+    if not printer:
+        return None, (jsonify({"error": "Kein aktiver Drucker"}), 400)
+    if not all([printer.get("serial"), printer.get("access_code"), printer.get("ip"), printer.get("name")]):
+        return None, (jsonify({"error": "Fehlende Druckerdaten"}), 500)
+
+    sync_printers()
+    conn = gateway.get(printer["serial"])
+    if conn is None or not conn.running:
+        cert_path = gateway.cert_path(printer)
+        return None, (jsonify({"error": f"Zertifikat {cert_path} nicht gefunden"}), 500)
+    return conn, None
+
+
+def assign_filaments(conn, parsed, cancel_event=None):
+    """Reiht alle Slot-Befehle ein und sammelt die Antworten (läuft ggf. als Job)."""
+    # Alle Befehle auf einmal einreihen, die Verbindung arbeitet sie nacheinander ab
+    pending = [
+        (ams_id, slot, filament, conn.submit_command("print", "ams_filament_setting",
+                                                    filament_setting_params(filament, ams_id, slot)))
+        for ams_id, slot, filament in parsed
+    ]
+    results = []
+    for ams_id, slot, filament, cmd in pending:
+        result = {"ams_id": ams_id, "slot": slot, "fcid": filament.get("fcid")}
+        try:
+            result["response"] = conn.wait_command(cmd, cancel_event)
+            # Slot merken, damit der Verbrauch dieser Spule zugeordnet werden kann
+            consumption.assign(conn.serial, ams_id, slot - 1, filament["fcid"])
+            result["ok"] = True
+        except CommandTimeout:
+            result["ok"] = False
+            result["timeout"] = True
+            result["error"] = "Keine Antwort vom Drucker"
+        except CommandError as e:
+            result["ok"] = False
+            result["error"] = str(e)
+        results.append(result)
+    return results
+
+
+def single_assignment_body(result):
+    if result["ok"]:
+        return {"ok": True, "response": {"print": result["response"]}}, 200
+    if result.get("timeout"):
+        return {"error": result["error"]}, 504
+    return {"error": f"Drucker meldet Fehler: {result['error']}"}, 502
+
+
+def batch_assignment_body(results):
+    for r in results:
+        r.pop("response", None)
+        r.pop("timeout", None)
+    return {"ok": all(r["ok"] for r in results), "results": results}, 200
 
-        return jsonify({"ok": True, "info": "MQTT-Stream für 20 Sekunden geloggt – siehe /tmp/mqtt_debug.log"})
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
 @app.route("/set_filament_mqtt", methods=["POST"])
 def set_filament_mqtt():
     try:
         data = request.json
-        slot = int(data.get("slot", -1))
-        fcid = data.get("fcid")
+        try:
+            ams_id, slot, filament = parse_assignment(data)
+        except LookupError as e:
+            return jsonify({"error": str(e)}), 404
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        conn, error = active_printer_connection()
+        if error:
+            return error
+
+        parsed = [(ams_id, slot, filament)]
+        if wants_async():
+            return submit_job(
+                "set_filament_mqtt",
+                lambda job: single_assignment_body(assign_filaments(conn, parsed, job.cancel_event)[0]),
+                params={"ams_id": ams_id, "slot": slot, "fcid": filament["fcid"]})
+
+        # Über die bestehende Verbindung, Antwort wird per sequence_id zugeordnet
+        body, status = single_assignment_body(assign_filaments(conn, parsed)[0])
+        return jsonify(body), status
 
-        if slot not in [1, 2, 3, 4]:
-            return jsonify({"error": "Slot muss 1-4 sein"}), 400
-        if not fcid:
-            return jsonify({"error": "FCID erforderlich"}), 400
-
-        # Filaments laden
-        filaments_path = os.path.join(app.static_folder, "filacore_spools.json")
-        if not os.path.exists(filaments_path):
-            return jsonify({"error": "filacore_spools.json nicht gefunden"}), 500
-        with open(filaments_path, "r", encoding="utf-8") as f:
-            filaments = json.load(f)
-
-        filament = next((f for f in filaments if f.get("fcid") == fcid), None)
-        if not filament:
-            return jsonify({"error": "Filament nicht gefunden"}), 404
-
-        material = filament.get("material")
-        druckprofil = filament.get("druckprofil")
-        temp_min = int(filament.get("tempMin", 220))
-        temp_max = int(filament.get("tempMax", 240))
-        farbe = filament.get("farbe", "000000FF")
-        ams_id = 0
-
-        # Druckerliste laden
-        printers_path = os.path.join(app.static_folder, "printers.json")
-        if not os.path.exists(printers_path):
-            return jsonify({"error": "printers.json nicht gefunden"}), 500
-
-        with open(printers_path, "r") as f:
-            printers = json.load(f)
-
-        printer = next((p for p in printers if p.get("active")), None)
-        if not printer:
-            return jsonify({"error": "Kein aktiver Drucker"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        serial = printer.get("serial")
-        access_code = printer.get("access_code")
-        broker_ip = printer.get("ip")
-        drucker_name = printer.get("name")
-        broker_port = 8883
-        username = "bblp"
-        password = access_code
-
-        if not all([serial, access_code, broker_ip, drucker_name]):
-            return jsonify({"error": "Fehlende Druckerdaten"}), 500
-
-        cert_path = os.path.join(app.static_folder, "printers", drucker_name, "blcert.pem")
-        if not os.path.exists(cert_path):
-            return jsonify({"error": f"Zertifikat {cert_path} nicht gefunden"}), 500
-
-        response_received = False
-        response_message = None
-
-        def on_connect(client, userdata, flags, rc, properties=None):
-            if rc == 0:
-                client.subscribe(f"device/{serial}/report")
-                payload = {
-                    "print": {
-                        "command": "ams_filament_setting",
-                        "ams_id": ams_id,
-                        "tray_id": slot - 1,
-                        "tray_info_idx": druckprofil,
-                        "tray_color": farbe,
-                        "tray_type": material,
-                        "nozzle_temp_min": temp_min,
-                        "nozzle_temp_max": temp_max
-                    }
-                }
-                client.publish(f"device/{serial}/request", json.dumps(payload))
-            else:
-                print(f"MQTT-Verbindung fehlgeschlagen mit Code {rc}")
-
-        def on_message(client, userdata, msg):
-            nonlocal response_received, response_message
+
+@app.route("/set_filament_mqtt_batch", methods=["POST"])
+def set_filament_mqtt_batch():
+    """Mehrere Slots (auch über mehrere AMS-Einheiten) in einem Request belegen.
+
+    Body: {"assignments": [{"ams_id": 0, "slot": 1, "fcid": "..."}, ...]}
+    """
+    try:
+        assignments = (request.json or {}).get("assignments")
+        if not isinstance(assignments, list) or not assignments:
+            return jsonify({"error": "assignments (Liste) erforderlich"}), 400
+
+        parsed = []
+        seen = set()
+        for i, entry in enumerate(assignments):
             try:
-                payload = json.loads(msg.payload.decode())
-                if payload.get("print", {}).get("command") == "ams_filament_setting":
-                    response_message = payload
-                    response_received = True
-                    client.disconnect()
-            except Exception as e:
-                print("Fehler beim Verarbeiten der MQTT-Nachricht:", e)
-
-        client = mqtt.Client()
-        client.username_pw_set(username, password)
-        client.tls_set(ca_certs=cert_path)
-        client.tls_insecure_set(True)
-        client.on_connect = on_connect
-        client.on_message = on_message
-
-        client.connect(broker_ip, broker_port, 10)
-        client.loop_start()
-
-        timeout = time.time() + 10
-        while not response_received and time.time() < timeout:
-            time.sleep(0.1)
-
-        client.loop_stop()
-
-        if response_received:
-            return jsonify({"ok": True, "response": response_message})
-        else:
-            return jsonify({"error": "Keine Antwort vom Drucker"}), 504
+                ams_id, slot, filament = parse_assignment(entry)
+            except (LookupError, ValueError) as e:
+                return jsonify({"error": f"Eintrag {i}: {e}"}), 400
+            if (ams_id, slot) in seen:
+                return jsonify({"error": f"Eintrag {i}: AMS {ams_id} Slot {slot} doppelt"}), 400
+            seen.add((ams_id, slot))
+            parsed.append((ams_id, slot, filament))
+
+        conn, error = active_printer_connection()
+        if error:
+            return error
+
+        if wants_async():
+            return submit_job(
+                "set_filament_mqtt_batch",
+                lambda job: batch_assignment_body(assign_filaments(conn, parsed, job.cancel_event)),
+                params={"slots": len(parsed)})
+
+        body, status = batch_assignment_body(assign_filaments(conn, parsed))
+        return jsonify(body), status
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify([job.to_dict() for job in jobs.list()])
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job nicht gefunden"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job nicht gefunden"}), 404
+    return jsonify(job.to_dict())
+
+
 @app.route("/generate_fcid")
 def generate_fcid():
     try:
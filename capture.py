@@ -0,0 +1,240 @@
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+CAPTURE_DIR = os.environ.get(
+    "FILACORE_CAPTURE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "captures"))
+# Neues Segment, sobald so viele (unkomprimierte) Bytes geschrieben wurden
+SEGMENT_BYTES = int(os.environ.get("FILACORE_CAPTURE_SEGMENT_MB", "16")) * 1024 * 1024
+# Ältere Segmente eines Mitschnitts werden gelöscht
+MAX_SEGMENTS = int(os.environ.get("FILACORE_CAPTURE_SEGMENTS", "20"))
+FLUSH_INTERVAL = 1.0
+# Mehr ungeschriebene Nachrichten werden verworfen statt den Speicher zu füllen
+MAX_BUFFERED = 20000
+# Zulässige Mitschnitt-IDs und Segmentnamen beim Herunterladen (kein "..", keine Pfadtrenner)
+CAPTURE_ID = re.compile(r"[A-Za-z0-9_-]+")
+SEGMENT_NAME = re.compile(r"[A-Za-z0-9_-]+\.ndjson\.gz")
+
+log = logging.getLogger("capture")
+
+
+class Capture:
+    """Ein laufender Mitschnitt: Nachrichten werden gepuffert und von einem eigenen Thread geschrieben.
+
+    Jede Zeile eines Segments ist ein JSON-Objekt mit ts, serial, topic und
+    payload (Nachricht als Text).
+    """
+
+    def __init__(self, root, serial=None, duration=None):
+        self.started = time.time()
+        self.id = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started)) + "-" + uuid.uuid4().hex[:6]
+        self.serial = serial
+        self.duration = duration
+        self.directory = os.path.join(root, self.id)
+        self.messages = 0
+        self.dropped = 0
+        self.stopped = None
+        self.error = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._segment = None
+        self._segment_no = 0
+        self._segment_bytes = 0
+        self._thread = threading.Thread(target=self._run, name=f"capture-{self.id}", daemon=True)
+
+    @property
+    def running(self):
+        return self.stopped is None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def on_raw(self, conn, topic, payload):
+        if self.serial is not None and conn.serial != self.serial:
+            return
+        with self._lock:
+            if len(self._buffer) >= MAX_BUFFERED:
+                self.dropped += 1
+                return
+            self._buffer.append((time.time(), conn.serial, topic, payload))
+
+    def segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".ndjson.gz"))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "serial": self.serial,
+            "status": "running" if self.running else "stopped",
+            "started": self.started,
+            "stopped": self.stopped,
+            "dauer": self.duration,
+            "nachrichten": self.messages,
+            "verworfen": self.dropped,
+            "segmente": self.segments(),
+            **({"error": self.error} if self.error else {}),
+        }
+
+    def _run(self):
+        try:
+            while not self._stop.wait(FLUSH_INTERVAL):
+                self._write_pending()
+            self._write_pending()
+        except Exception as e:
+            self.error = str(e)
+            log.error("Mitschnitt %s abgebrochen: %s", self.id, e)
+        finally:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            self.stopped = time.time()
+            log.info("Mitschnitt %s beendet, %d Nachrichten", self.id, self.messages)
+
+    def _write_pending(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        lines = []
+        for ts, serial, topic, payload in batch:
+            lines.append(json.dumps({
+                "ts": round(ts, 3), "serial": serial, "topic": topic,
+                "payload": payload.decode("utf-8", errors="replace"),
+            }, ensure_ascii=False))
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        if self._segment is None or self._segment_bytes >= SEGMENT_BYTES:
+            self._rotate()
+        self._segment.write(data)
+        # Sync-Flush: nach einem Absturz bleibt alles bis hierher lesbar
+        self._segment.flush()
+        self._segment_bytes += len(data)
+        self.messages += len(batch)
+
+    def _rotate(self):
+        if self._segment is not None:
+            self._segment.close()
+        self._segment_no += 1
+        name = f"{self._segment_no:04d}-{time.strftime('%Y%m%d-%H%M%S')}.ndjson.gz"
+        self._segment = gzip.open(os.path.join(self.directory, name), "wb", compresslevel=6)
+        self._segment_bytes = 0
+        for old in self.segments()[:-MAX_SEGMENTS]:
+            os.remove(os.path.join(self.directory, old))
+
+
+class CaptureManager:
+    """Startet und verwaltet Mitschnitte über den Raw-Listener des Gateways."""
+
+    def __init__(self, gateway, root=CAPTURE_DIR):
+        self.gateway = gateway
+        self.root = root
+        self._lock = threading.Lock()
+        self._captures = {}
+
+    def start(self, serial=None, duration=None):
+        """Mitschnitt für einen Drucker (oder alle, serial=None); ohne duration bis stop()."""
+        capture = Capture(self.root, serial, duration)
+        capture.start()
+        self.gateway.add_raw_listener(capture.on_raw)
+        with self._lock:
+            self._captures[capture.id] = capture
+        if duration:
+            timer = threading.Timer(duration, self.stop, args=(capture.id,))
+            timer.daemon = True
+            timer.start()
+        return capture
+
+    def stop(self, capture_id):
+        capture = self.get(capture_id)
+        if capture is None:
+            return None
+        self.gateway.remove_raw_listener(capture.on_raw)
+        capture.stop()
+        return capture
+
+    def stop_all(self):
+        for capture in self.list():
+            if capture.running:
+                self.stop(capture.id)
+
+    def get(self, capture_id):
+        with self._lock:
+            return self._captures.get(capture_id)
+
+    def list(self):
+        with self._lock:
+            return sorted(self._captures.values(), key=lambda c: c.started, reverse=True)
+
+    def segment_path(self, capture_id, name):
+        """Pfad eines Segments oder None (auch für Mitschnitte früherer Läufe)."""
+        if not CAPTURE_ID.fullmatch(capture_id) or not SEGMENT_NAME.fullmatch(name):
+            return None
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, capture_id, name))
+        # Auch per Symlink nicht aus dem Mitschnitt-Ordner heraus
+        if os.path.commonpath([root, path]) != root:
+            return None
+        return path if os.path.isfile(path) else None
+
+
+def capture_files(path):
+    """Segmente eines Mitschnitts in Reihenfolge; path ist ein Segment oder ein Mitschnitt-Ordner."""
+    if os.path.isdir(path):
+        return [os.path.join(path, n) for n in sorted(os.listdir(path)) if n.endswith(".ndjson.gz")]
+    return [path]
+
+
+def read_capture(path, serial=None):
+    """Liefert die Datensätze (dicts) eines Mitschnitts, optional nur für eine Serial."""
+    for file_path in capture_files(path):
+        with gzip.open(file_path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # abgeschnittene letzte Zeile nach einem Absturz
+                    if serial is None or record.get("serial") == serial:
+                        yield record
+            except EOFError:
+                # Segment wurde nicht sauber geschlossen (Absturz); bis zum letzten Flush lesbar
+                continue
+
+
+def replay(records, feed, speed=1.0, cancel_event=None):
+    """Spielt Datensätze mit den aufgezeichneten Abständen ab, ``speed`` > 1 beschleunigt.
+
+    speed <= 0 spielt ohne Pausen ab. feed(record) wird für jeden Datensatz
+    aufgerufen; Rückgabe ist die Anzahl abgespielter Datensätze.
+    """
+    count = 0
+    first_ts = started = None
+    for record in records:
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        if speed > 0:
+            if first_ts is None:
+                first_ts, started = record["ts"], time.monotonic()
+            delay = started + (record["ts"] - first_ts) / speed - time.monotonic()
+            if delay > 0:
+                if cancel_event is not None:
+                    if cancel_event.wait(delay):
+                        break
+                else:
+                    time.sleep(delay)
+        feed(record)
+        count += 1
+    return count
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from coalesce import SingleFlight
+
+CERT_PORT = 8883
+CERT_TIMEOUT = 10
+PROVISION_WORKERS = int(os.environ.get("FILACORE_CERT_WORKERS", "8"))
+CERT_DIR = os.environ.get(
+    "FILACORE_CERT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "printers"))
+
+log = logging.getLogger("certs")
+
+
+class CertificateError(Exception):
+    pass
+
+
+def fetch_peer_chain(ip, port=CERT_PORT, timeout=CERT_TIMEOUT):
+    """TLS-Handshake im Prozess, liefert die Zertifikatskette des Druckers als DER-Liste."""
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    try:
+        with socket.create_connection((ip, port), timeout=timeout) as sock:
+            with ctx.wrap_socket(sock) as tls:
+                chain = _unverified_chain(tls)
+    except (OSError, ssl.SSLError) as e:
+        raise CertificateError(f"TLS-Verbindung zu {ip}:{port} fehlgeschlagen: {e}")
+    if not chain:
+        raise CertificateError(f"{ip}:{port} hat kein Zertifikat geliefert")
+    return chain
+
+
+def _unverified_chain(tls):
+    # Ab Python 3.13 öffentlich, davor nur am internen _sslobj verfügbar
+    getter = getattr(tls, "get_unverified_chain", None) or getattr(tls._sslobj, "get_unverified_chain", None)
+    if getter is not None:
+        chain = getter() or []
+        return [c if isinstance(c, bytes) else c.public_bytes(ssl._ssl.ENCODING_DER) for c in chain]
+    leaf = tls.getpeercert(binary_form=True)
+    return [leaf] if leaf else []
+
+
+def client_context(cert_path):
+    """SSL-Kontext für die MQTT-Verbindung, der dem gespeicherten Zertifikat direkt vertraut."""
+    ctx = ssl.create_default_context(cafile=cert_path)
+    ctx.check_hostname = False  # Drucker melden sich mit ihrer Serial, nicht mit der IP
+    # Auch ein einzelnes (nicht selbst signiertes) Druckerzertifikat als Vertrauensanker zulassen
+    ctx.verify_flags |= ssl.VERIFY_X509_PARTIAL_CHAIN
+    return ctx
+
+
+def cert_info(der):
+    info = {"fingerprint": hashlib.sha256(der).hexdigest()}
+    try:
+        not_before, not_after = _validity(der)
+        info["not_before"] = not_before
+        info["not_after"] = not_after
+    except (IndexError, ValueError):
+        info["not_before"] = info["not_after"] = None
+    return info
+
+
+def _der_item(data, pos):
+    """(tag, inhalt_start, inhalt_ende) des DER-Elements an pos."""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        length = int.from_bytes(data[pos:pos + n], "big")
+        pos += n
+    return tag, pos, pos + length
+
+
+def _validity(der):
+    # Certificate -> tbsCertificate -> [version], serial, signature, issuer, validity
+    _, start, _ = _der_item(der, 0)
+    _, pos, _ = _der_item(der, start)
+    tag, _, end = _der_item(der, pos)
+    if tag == 0xA0:
+        pos = end
+    for _ in range(3):
+        _, _, pos = _der_item(der, pos)
+    _, pos, _ = _der_item(der, pos)
+    times = []
+    for _ in range(2):
+        tag, s, e = _der_item(der, pos)
+        times.append(_der_time(tag, der[s:e].decode("ascii")))
+        pos = e
+    return times[0], times[1]
+
+
+def _der_time(tag, value):
+    fmt = "%y%m%d%H%M%SZ" if tag == 0x17 else "%Y%m%d%H%M%SZ"
+    return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _pem_to_der(pem):
+    start = pem.find("-----BEGIN CERTIFICATE-----")
+    end = pem.find("-----END CERTIFICATE-----", start)
+    if start < 0 or end < 0:
+        raise ValueError("Kein Zertifikat in der PEM-Datei")
+    return ssl.PEM_cert_to_DER_cert(pem[start:end + len("-----END CERTIFICATE-----")])
+
+
+class CertificateManager:
+    """Holt, speichert und überwacht die Druckerzertifikate.
+
+    Pro Drucker läuft höchstens ein Abruf gleichzeitig; Ergebnisse (Fingerprint,
+    Ablaufdatum) werden pro Serial zwischengespeichert und bei geänderter Datei
+    neu gelesen.
+    """
+
+    def __init__(self, cert_root, on_fetched=None):
+        self.cert_root = cert_root
+        self.on_fetched = on_fetched
+        self._flight = SingleFlight(ttl=0)
+        self._pool = ThreadPoolExecutor(max_workers=PROVISION_WORKERS, thread_name_prefix="certs")
+        self._lock = threading.Lock()
+        self._info = {}
+
+    def cert_path(self, printer):
+        return os.path.join(self.cert_root, printer["name"], "blcert.pem")
+
+    def status(self, printer):
+        path = self.cert_path(printer)
+        with self._lock:
+            cached = self._info.get(printer["serial"])
+        if not os.path.exists(path):
+            return dict(cached or {}, vorhanden=False)
+        mtime = os.stat(path).st_mtime_ns
+        if cached is None or cached.get("mtime") != mtime:
+            try:
+                with open(path, "r") as f:
+                    info = cert_info(_pem_to_der(f.read()))
+            except (OSError, ValueError) as e:
+                info = {"error": f"Zertifikat unlesbar: {e}"}
+            cached = dict(info, mtime=mtime)
+            with self._lock:
+                self._info[printer["serial"]] = cached
+        status = {k: v for k, v in cached.items() if k != "mtime"}
+        status["vorhanden"] = True
+        if status.get("not_after"):
+            status["abgelaufen"] = status["not_after"] < time.time()
+        return status
+
+    def saved_info(self):
+        with self._lock:
+            return {serial: dict(info) for serial, info in self._info.items()}
+
+    def restore_info(self, info):
+        """Zwischengespeicherte Zertifikatsdaten übernehmen; status() prüft sie weiter gegen die Datei (mtime)."""
+        with self._lock:
+            for serial, entry in info.items():
+                self._info.setdefault(serial, entry)
+
+    def fetch(self, printer):
+        """Holt das Zertifikat synchron; parallele Aufrufe für denselben Drucker teilen sich den Abruf."""
+        return self._flight.do(printer["serial"], lambda: self._fetch(printer))
+
+    def fetch_async(self, printer):
+        return self._pool.submit(self.fetch, printer)
+
+    def ensure(self, printer):
+        """Startet einen Abruf im Hintergrund, falls noch kein Zertifikat vorhanden ist."""
+        if os.path.exists(self.cert_path(printer)):
+            return False
+        self.fetch_async(printer)
+        return True
+
+    def provision_all(self, printers, force=False):
+        """Alle Drucker parallel versorgen, liefert ein Ergebnis pro Serial."""
+        futures = {}
+        for printer in printers:
+            if not force and os.path.exists(self.cert_path(printer)):
+                continue
+            futures[printer["serial"]] = self.fetch_async(printer)
+
+        results = {}
+        for printer in printers:
+            future = futures.get(printer["serial"])
+            if future is None:
+                results[printer["serial"]] = dict(self.status(printer), abgerufen=False)
+                continue
+            try:
+                results[printer["serial"]] = dict(future.result(), abgerufen=True)
+            except CertificateError as e:
+                results[printer["serial"]] = {"error": str(e), "abgerufen": False}
+        return results
+
+    def download(self, printer):
+        """Nur die Zertifikatskette (DER) vom Drucker lesen, ohne sie zu speichern."""
+        ip = printer.get("ip")
+        if not ip:
+            raise CertificateError("IP-Adresse im Druckereintrag fehlt")
+        return fetch_peer_chain(ip, printer.get("port", CERT_PORT))
+
+    def save(self, printer, chain):
+        """Eine mit download() gelesene Kette als Zertifikat des Druckers speichern."""
+        path = self.cert_path(printer)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(ssl.DER_cert_to_PEM_cert(der) for der in chain))
+        os.replace(tmp_path, path)
+
+        info = dict(cert_info(chain[0]), mtime=os.stat(path).st_mtime_ns, abgerufen_am=time.time())
+        with self._lock:
+            self._info[printer["serial"]] = info
+        log.info("Zertifikat für %s (%s) gespeichert", printer["name"], printer.get("ip"))
+
+        if self.on_fetched:
+            self.on_fetched(printer)
+        return {k: v for k, v in info.items() if k != "mtime"}
+
+    def _fetch(self, printer):
+        return self.save(printer, self.download(printer))
@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+
+from coalesce import SingleFlight
+from metrics import registry
+
+CLOUD_BASE_URL = os.environ.get("FILACORE_CLOUD_URL", "https://api.bambulab.com").rstrip("/")
+# (Verbindungsaufbau, Antwort) in Sekunden; danach wird auf den MQTT-Zustand ausgewichen
+CLOUD_TIMEOUT = (2.0, float(os.environ.get("FILACORE_CLOUD_TIMEOUT", "3")))
+# Antworten pro Drucker so lange wiederverwenden
+CLOUD_CACHE_TTL = float(os.environ.get("FILACORE_CLOUD_CACHE_TTL", "10"))
+CLOUD_POOL_SIZE = 8
+# Nach so vielen Fehlern in Folge wird die Cloud eine Zeit lang nicht mehr gefragt
+BREAKER_FAILURES = 3
+BREAKER_BACKOFF = 5.0
+BREAKER_MAX_BACKOFF = 300.0
+
+log = logging.getLogger("cloud_client")
+
+CLOUD_REQUESTS = registry.counter(
+    "filacore_cloud_requests_total", "Abrufe der Bambu-Cloud nach Ergebnis", ("result",))
+CLOUD_LATENCY = registry.histogram(
+    "filacore_cloud_request_duration_seconds", "Dauer eines Cloud-Abrufs", ())
+
+
+class CloudUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Öffnet nach BREAKER_FAILURES Fehlern in Folge; die Sperrzeit verdoppelt sich bei jedem erneuten Öffnen.
+
+    Nach Ablauf der Sperrzeit darf genau ein Probeaufruf durch (half-open);
+    gelingt er, ist der Breaker wieder geschlossen.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, backoff=BREAKER_BACKOFF, max_backoff=BREAKER_MAX_BACKOFF,
+                 clock=time.monotonic):
+        self.failures = failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._errors = 0
+        self._opened = 0
+        self._open_until = 0.0
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._errors < self.failures:
+                return "closed"
+            return "half_open" if self.clock() >= self._open_until else "open"
+
+    def retry_in(self):
+        with self._lock:
+            return max(0.0, self._open_until - self.clock()) if self._errors >= self.failures else 0.0
+
+    def allow(self):
+        with self._lock:
+            if self._errors < self.failures:
+                return True
+            if self.clock() < self._open_until or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._errors = 0
+            self._opened = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._errors += 1
+            self._probing = False
+            if self._errors >= self.failures:
+                self._opened += 1
+                delay = min(self.backoff * 2 ** (self._opened - 1), self.max_backoff)
+                self._open_until = self.clock() + delay
+                return delay
+        return 0.0
+
+
+class CloudClient:
+    """Abrufe gegen die Bambu-Cloud über eine gemeinsame Session mit Keep-Alive.
+
+    Gleichzeitige Abrufe pro Drucker werden gebündelt und CLOUD_CACHE_TTL
+    Sekunden wiederverwendet; bei Zeitüberschreitungen, Verbindungs- und
+    Serverfehlern öffnet der Circuit Breaker und Aufrufer bekommen sofort
+    CloudUnavailable statt auf den Timeout zu warten.
+    """
+
+    def __init__(self, base_url=CLOUD_BASE_URL, timeout=CLOUD_TIMEOUT, ttl=CLOUD_CACHE_TTL, breaker=None,
+                 session=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._flight = SingleFlight(ttl=ttl)
+        # session: fertige requests.Session (oder Ersatz), sonst beim ersten Abruf angelegt
+        self._session = session
+        self._session_lock = threading.Lock()
+        registry.gauge("filacore_cloud_breaker_open", "1, solange die Cloud gesperrt ist", (),
+                       lambda: [((), 0 if self.breaker.state == "closed" else 1)])
+
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                # Erst beim ersten Abruf laden, requests kostet beim Start spürbar Zeit
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CLOUD_POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["Content-Type"] = "application/json"
+                self._session = session
+            return self._session
+
+    def printer_state(self, serial, access_code):
+        """Liefert (status_code, json_oder_None) oder wirft CloudUnavailable."""
+        def fetch():
+            # Zwischengespeicherte Antworten gibt es auch bei offenem Breaker
+            if not self.breaker.allow():
+                CLOUD_REQUESTS.inc("breaker_open")
+                raise CloudUnavailable(f"Cloud gesperrt, nächster Versuch in {self.breaker.retry_in():.0f}s")
+            try:
+                return self._fetch_state(serial, access_code)
+            except CloudUnavailable:
+                # Erfolg bzw. Fehler hat _fetch_state schon verbucht
+                raise
+            except Exception:
+                # Sonst bliebe ein Probeaufruf (half-open) für immer offen
+                self._failed("error")
+                raise
+
+        return self._flight.do(serial, fetch)
+
+    def forget(self, serial):
+        self._flight.forget(serial)
+
+    def _fetch_state(self, serial, access_code):
+        import requests
+
+        started = time.monotonic()
+        try:
+            res = self.session().post(
+                f"{self.base_url}/v1/printer/state",
+                json={"serial": serial, "access_code": access_code},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            self._failed("error")
+            raise CloudUnavailable(f"Cloud nicht erreichbar: {e}")
+        finally:
+            CLOUD_LATENCY.observe(time.monotonic() - started)
+
+        if res.status_code >= 500 or res.status_code == 429:
+            self._failed(str(res.status_code))
+            raise CloudUnavailable(f"Cloud antwortet mit {res.status_code}")
+        self.breaker.success()
+        CLOUD_REQUESTS.inc(str(res.status_code))
+        if res.status_code != 200:
+            return res.status_code, None
+        try:
+            return 200, res.json()
+        except ValueError:
+            raise CloudUnavailable("Cloud-Antwort ist kein JSON")
+
+    def _failed(self, result):
+        CLOUD_REQUESTS.inc(result)
+        delay = self.breaker.failure()
+        if delay:
+            log.warning("Bambu-Cloud gesperrt für %.0fs nach wiederholten Fehlern", delay)
@@ -0,0 +1,61 @@
+import threading
+import time
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Bündelt gleichzeitige Abrufe pro Schlüssel (z.B. Drucker-Serial).
+
+    Nur der erste Aufrufer führt fn() aus, alle anderen warten auf dessen
+    Ergebnis. Das Ergebnis bleibt danach noch ``ttl`` Sekunden gültig, so dass
+    pro Drucker und Zeitfenster höchstens ein Upstream-Abruf stattfindet.
+    Fehler werden nicht zwischengespeichert.
+    """
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._results = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._inflight[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if call.error is None and self.ttl > 0:
+                    self._results[key] = (time.monotonic() + self.ttl, call.result)
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def forget(self, key):
+        with self._lock:
+            self._results.pop(key, None)
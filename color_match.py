@@ -0,0 +1,240 @@
+import heapq
+import os
+import threading
+from array import array
+
+# numpy ist optional und wird erst geladen, wenn ein Index groß genug dafür ist
+_NOT_LOADED = object()
+np = _NOT_LOADED
+
+# Vorschläge pro Tray
+MATCH_LIMIT = 3
+# Größere Farbabstände (Delta E 76) gelten nicht mehr als passend
+MAX_DELTA_E = 30.0
+# Darunter rechnet reines Python schneller als Import und Aufruf-Overhead von numpy
+NUMPY_MIN_SPOOLS = int(os.environ.get("FILACORE_NUMPY_MIN_SPOOLS", "100"))
+
+# sRGB (D65) -> XYZ
+_M = (
+    (0.4124564, 0.3575761, 0.1804375),
+    (0.2126729, 0.7151522, 0.0721750),
+    (0.0193339, 0.1191920, 0.9503041),
+)
+_WHITE = (0.95047, 1.0, 1.08883)
+
+
+def parse_hex(value):
+    """(r, g, b) 0-255 aus "#rrggbb", "rrggbb" oder "RRGGBBAA" (AMS), sonst None."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lstrip("#")
+    if len(value) not in (6, 8):
+        return None
+    try:
+        return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return None
+
+
+def rgb_to_lab(rgb):
+    linear = []
+    for c in rgb:
+        c /= 255.0
+        linear.append(c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4)
+    xyz = [sum(m * c for m, c in zip(row, linear)) / w for row, w in zip(_M, _WHITE)]
+    fx, fy, fz = (t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116 for t in xyz)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def normalize_material(value):
+    return str(value or "").strip().upper()
+
+
+def _numpy():
+    """numpy beim ersten Bedarf importieren; None, wenn nicht installiert."""
+    global np
+    if np is _NOT_LOADED:
+        try:
+            import numpy as np
+        except ImportError:  # reines Python reicht für übliche Lagergrößen
+            np = None
+    return np
+
+
+class SpoolColorIndex:
+    """Lab-Farben aller Spulen in einem gepackten float-Array, neu aufgebaut nur bei Änderungen im Store."""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._version = None
+        self._lab = array("f")
+        self._materials = array("H")
+        self._material_codes = {}
+        self._fcids = []
+        self._np_lab = None
+        self._np_materials = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def refresh(self):
+        version = self.store.versions["spools"]
+        with self._lock:
+            if version == self._version:
+                return
+            lab, materials, codes, fcids = array("f"), array("H"), {}, []
+            for spool in self.store.iter_spools():
+                rgb = parse_hex(spool.get("farbe"))
+                if rgb is None:
+                    continue
+                lab.extend(rgb_to_lab(rgb))
+                material = normalize_material(spool.get("material"))
+                materials.append(codes.setdefault(material, len(codes)))
+                fcids.append(spool["fcid"])
+            self._lab, self._materials, self._material_codes, self._fcids = lab, materials, codes, fcids
+            if len(fcids) >= max(NUMPY_MIN_SPOOLS, 1) and _numpy() is not None:
+                # Sicht auf dieselben Bytes, kein Kopieren
+                self._np_lab = np.frombuffer(lab, dtype=np.float32).reshape(-1, 3)
+                self._np_materials = np.frombuffer(materials, dtype=np.uint16)
+            else:
+                self._np_lab = self._np_materials = None
+            self._version = version
+
+    def match_many(self, queries, limit=MATCH_LIMIT, max_delta=MAX_DELTA_E):
+        """queries: [(farbe, material oder None)] -> pro Anfrage [(fcid, delta_e), ...], bester zuerst."""
+        self.refresh()
+        with self._lock:
+            fcids = self._fcids
+            codes = self._material_codes
+            lab, materials = self._lab, self._materials
+            np_lab, np_materials = self._np_lab, self._np_materials
+
+        parsed = []
+        for color, material in queries:
+            rgb = parse_hex(color)
+            code = codes.get(normalize_material(material)) if material else None
+            # Unbekanntes Material: keine Spule kann passen
+            parsed.append(None if rgb is None or (material and code is None) else (rgb_to_lab(rgb), code))
+
+        if not fcids:
+            return [[] for _ in queries]
+        if np_lab is not None:
+            return self._match_numpy(parsed, fcids, np_lab, np_materials, limit, max_delta)
+        return [self._match_python(p, fcids, lab, materials, limit, max_delta) for p in parsed]
+
+    def _match_numpy(self, parsed, fcids, np_lab, np_materials, limit, max_delta):
+        valid = [p for p in parsed if p is not None]
+        if not valid:
+            return [[] for _ in parsed]
+        targets = np.array([p[0] for p in valid], dtype=np.float32)
+        # Eine Distanzmatrix für alle Trays des Reports auf einmal
+        distances = np.sqrt(((np_lab[None, :, :] - targets[:, None, :]) ** 2).sum(axis=2))
+        results = []
+        row = 0
+        for p in parsed:
+            if p is None:
+                results.append([])
+                continue
+            d = distances[row]
+            row += 1
+            if p[1] is not None:
+                d = np.where(np_materials == p[1], d, np.inf)
+            k = min(limit, len(d))
+            best = np.argpartition(d, k - 1)[:k]
+            best = best[np.argsort(d[best])]
+            results.append([(fcids[i], round(float(d[i]), 1)) for i in best if d[i] <= max_delta])
+        return results
+
+    def _match_python(self, p, fcids, lab, materials, limit, max_delta):
+        if p is None:
+            return []
+        (tl, ta, tb), code = p
+        limit_sq = max_delta * max_delta
+        candidates = []
+        for i in range(len(fcids)):
+            if code is not None and materials[i] != code:
+                continue
+            j = 3 * i
+            d = (lab[j] - tl) ** 2 + (lab[j + 1] - ta) ** 2 + (lab[j + 2] - tb) ** 2
+            if d <= limit_sq:
+                candidates.append((d, i))
+        return [(fcids[i], round(d ** 0.5, 1)) for d, i in heapq.nsmallest(limit, candidates)]
+
+
+class TrayMatcher:
+    """Ordnet AMS-Trays die farblich nächsten Spulen gleichen Materials zu.
+
+    Läuft als Gateway-Listener; gerechnet wird nur, wenn ein Report Farbe
+    oder Material eines Trays ändert, dann für alle Trays des Reports in
+    einem Durchgang.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._lock = threading.Lock()
+        self._trays = {}
+
+    def on_state_change(self, conn, delta):
+        changed = set()
+        for unit in _ams_units(delta):
+            for tray in unit.get("tray") or []:
+                if "tray_color" in tray or "tray_type" in tray:
+                    changed.add((_int(unit.get("id")), _int(tray.get("id"))))
+        if changed:
+            self.update(conn.serial, conn.state.get("print", "ams", "ams", default=[]), changed)
+
+    def update(self, serial, units, only=None):
+        """Berechnet die Vorschläge für die Trays aus units (vollständiger AMS-Zustand)."""
+        trays = []
+        for unit in units or []:
+            for tray in unit.get("tray") or []:
+                key = (_int(unit.get("id")), _int(tray.get("id")))
+                if only is None or key in only:
+                    trays.append((key, tray.get("tray_color"), tray.get("tray_type")))
+        if not trays:
+            return
+        # Leerer Slot (ohne Material): keine Vorschläge
+        results = self.index.match_many([(color if material else None, material) for _, color, material in trays])
+        with self._lock:
+            for (key, color, material), matches in zip(trays, results):
+                self._trays[(serial,) + key] = {
+                    "tray_color": color, "tray_type": material, "matches": matches, "version": self.index.version,
+                }
+
+    def matches(self, serial, units=None):
+        """Vorschläge pro Tray eines Druckers; veraltete (Lager geändert) werden neu berechnet."""
+        self.index.refresh()
+        if units is not None:
+            with self._lock:
+                stale = any(
+                    entry["version"] != self.index.version
+                    for key, entry in self._trays.items() if key[0] == serial
+                ) or not any(key[0] == serial for key in self._trays)
+            if stale:
+                self.update(serial, units)
+        with self._lock:
+            return [
+                dict(entry, ams_id=key[1], tray_id=key[2])
+                for key, entry in sorted(self._trays.items()) if key[0] == serial
+            ]
+
+    def forget(self, serial):
+        with self._lock:
+            for key in [k for k in self._trays if k[0] == serial]:
+                del self._trays[key]
+
+
+def _ams_units(delta):
+    ams = delta.get("print", {}).get("ams")
+    if isinstance(ams, dict) and isinstance(ams.get("ams"), list):
+        return [u for u in ams["ams"] if isinstance(u, dict)]
+    return []
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+
+# Änderungen sammeln und höchstens so oft in die Datenbank schreiben
+FLUSH_INTERVAL = 30
+
+log = logging.getLogger("consumption")
+
+
+class ConsumptionTracker:
+    """Verbucht Filamentverbrauch aus den AMS-"remain"-Werten auf die zugeordneten Spulen.
+
+    Gramm ergeben sich aus dem Netto-Gewicht der Spule (``gewicht``), Kosten
+    aus ``preis`` in € pro kg. Ohne Gewicht bleiben Rest und Verbrauch
+    unbekannt (None). Jeder Report ändert nur den Zustand im Speicher;
+    geschrieben wird gesammelt alle FLUSH_INTERVAL Sekunden in einer Transaktion.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._assignments = {}
+        self._last_remain = {}
+        self._pending = {}
+        self._flusher = None
+        self.reload_assignments()
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def reload_assignments(self):
+        with self._lock:
+            self._assignments = {
+                (a["serial"], a["ams_id"], a["tray_id"]): a["fcid"] for a in self.store.tray_assignments()
+            }
+
+    def assign(self, serial, ams_id, tray_id, fcid):
+        self.store.assign_tray(serial, ams_id, tray_id, fcid)
+        with self._lock:
+            self._assignments[(serial, ams_id, tray_id)] = fcid
+            # Neue Spule im Slot: ab dem nächsten Report neu messen
+            self._last_remain.pop((serial, ams_id, tray_id), None)
+
+    def assignment(self, serial, ams_id, tray_id):
+        with self._lock:
+            return self._assignments.get((serial, ams_id, tray_id))
+
+    def on_state_change(self, conn, delta):
+        for ams_id, tray_id, remain in _tray_remains(delta):
+            self.observe(conn.serial, ams_id, tray_id, remain)
+
+    def observe(self, serial, ams_id, tray_id, remain):
+        key = (serial, ams_id, tray_id)
+        with self._lock:
+            fcid = self._assignments.get(key)
+            if fcid is None or remain < 0:
+                return
+            previous = self._last_remain.get(key)
+            self._last_remain[key] = remain
+            usage = self._pending.get(fcid)
+        if usage is None:
+            spool = self.store.get_spool(fcid)
+            if spool is None:
+                return
+            usage = _usage_fields(spool)
+
+        weight = usage["gewicht"]
+        if weight is None:
+            # Prozent ohne Spulengewicht ergeben keine Gramm; nichts schätzen
+            return
+        fields = dict(usage, rest_g=round(weight * remain / 100, 1))
+        # Verbrauch nur für fallende Werte verbuchen; steigt remain, wurde nachgefüllt
+        if previous is not None and remain < previous:
+            used = weight * (previous - remain) / 100
+            fields["verbrauch_g"] = round(usage["verbrauch_g"] + used, 1)
+            # preis ist pro kg
+            fields["kosten_verbraucht"] = round(fields["verbrauch_g"] / 1000 * usage["preis_kg"], 2)
+        fields["aktualisiert"] = time.time()
+
+        with self._lock:
+            self._pending[fcid] = fields
+
+    def usage(self, fcid=None):
+        """Verbrauch pro Spule inkl. noch nicht geschriebener Änderungen."""
+        spools = [self.store.get_spool(fcid)] if fcid else self.store.list_spools()
+        with self._lock:
+            pending = dict(self._pending)
+        result = []
+        for spool in spools:
+            if spool is None:
+                continue
+            fields = pending.get(spool["fcid"]) or _usage_fields(spool)
+            result.append({
+                "fcid": spool["fcid"],
+                "material": spool.get("material"),
+                "farbe": spool.get("farbe"),
+                "hersteller": spool.get("hersteller"),
+                "gewicht": fields["gewicht"],
+                "rest_g": fields.get("rest_g"),
+                "verbrauch_g": fields["verbrauch_g"],
+                "kosten_verbraucht": fields["kosten_verbraucht"],
+            })
+        return result
+
+    def flush(self):
+        # Einträge bleiben bis nach dem Commit stehen, sonst läse observe() dazwischen
+        # den alten Stand aus der Datenbank; schlägt das Schreiben fehl, bleiben sie
+        # für den nächsten Versuch liegen
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return
+        updates = {
+            fcid: {k: fields[k] for k in ("gewicht", "rest_g", "verbrauch_g", "kosten_verbraucht") if k in fields}
+            for fcid, fields in pending.items()
+        }
+        self.store.update_spools(updates)
+        with self._lock:
+            for fcid, fields in pending.items():
+                # Inzwischen neu verbuchte Spulen gehen erst mit dem nächsten Flush raus
+                if self._pending.get(fcid) is fields:
+                    del self._pending[fcid]
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                log.error("Fehler beim Speichern: %s", e)
+
+
+def spool_weight(spool):
+    """Netto-Gewicht der Spule in g, None wenn nicht (sinnvoll) angegeben."""
+    try:
+        weight = float(spool.get("gewicht"))
+    except (TypeError, ValueError):
+        return None
+    return weight if weight > 0 else None
+
+
+def _usage_fields(spool):
+    try:
+        preis = float(spool.get("preis") or 0)
+    except (TypeError, ValueError):
+        preis = 0.0
+    return {
+        "gewicht": spool_weight(spool),
+        "rest_g": spool.get("rest_g"),
+        "verbrauch_g": float(spool.get("verbrauch_g") or 0),
+        "kosten_verbraucht": float(spool.get("kosten_verbraucht") or 0),
+        "preis_kg": preis,
+    }
+
+
+def _tray_remains(delta):
+    """(ams_id, tray_id, remain) für jedes Tray im Delta, das einen neuen remain-Wert hat."""
+    ams = delta.get("print", {}).get("ams")
+    if not isinstance(ams, dict) or not isinstance(ams.get("ams"), list):
+        return
+    for unit in ams["ams"]:
+        for tray in unit.get("tray") or []:
+            if "remain" not in tray:
+                continue
+            try:
+                yield int(unit["id"]), int(tray["id"]), int(tray["remain"])
+            except (KeyError, TypeError, ValueError):
+                continue
@@ -0,0 +1,448 @@
+import itertools
+import logging
+import os
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from mqtt_gateway import CommandError
+
+# Gesetzt, wenn FilaCore als mehrere Worker-Prozesse mit gemeinsamem Gateway-Prozess läuft
+GATEWAY_SOCKET = os.environ.get("FILACORE_GATEWAY_SOCKET")
+GATEWAY_KEY = os.environ.get("FILACORE_GATEWAY_KEY", "").encode() or None
+# Zustandsänderungen pro Worker, falls er kurz nicht liest; darüber hinaus wird verworfen
+EVENT_QUEUE_SIZE = 10000
+# So oft prüft ein Worker beim Warten auf eine Befehlsantwort, ob der Job abgebrochen wurde
+COMMAND_POLL = 0.2
+COMMAND_WAIT = 30
+# Erledigte Befehle, die nie abgeholt wurden, so lange aufheben
+COMMAND_RETENTION = 60
+RECONNECT_DELAY = 1.0
+
+# Was Worker an einer Verbindung bzw. ihrem Zustand lesen oder aufrufen dürfen
+GATEWAY_METHODS = {"sync", "cert_path", "read_state"}
+CONNECTION_ATTRS = {
+    "running", "connected", "reports_received", "request_pushall", "wait_for_state", "wait_for_update", "refresh",
+}
+STATE_ATTRS = {"empty", "restored", "version", "updated_at", "age", "snapshot", "snapshot_json", "get"}
+COMMAND_OPS = {"submit", "wait", "cancel"}
+
+log = logging.getLogger("gateway_ipc")
+
+
+class GatewayUnavailable(Exception):
+    pass
+
+
+class Record:
+    """Daten eines Objekts, das nicht über den Socket geht (z.B. ein Mitschnitt), mit Attributzugriff."""
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class RemoteCommand:
+    def __init__(self, key, command):
+        self.key = key
+        self.command = command
+
+
+class GatewayServer:
+    """Stellt Gateway und Dienste des Gateway-Prozesses über einen Unix-Socket bereit.
+
+    Jeder Worker-Thread hält eine eigene Verbindung. Anfragen sind
+    (ziel, name, args, kwargs), Antworten ("ok", wert) oder ("error", exception),
+    beides per pickle; der Socket ist nur für den eigenen Benutzer zugänglich
+    und mit FILACORE_GATEWAY_KEY authentifiziert. Eine Verbindung, die
+    ("subscribe",) schickt, bekommt danach jede Zustandsänderung als
+    (serial, version, delta).
+    """
+
+    def __init__(self, path, gateway, services, authkey=GATEWAY_KEY):
+        self.path = path
+        self.gateway = gateway
+        self.services = services
+        self.authkey = authkey
+        self.dropped_events = 0
+        self._listener = None
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._commands = {}
+        self._command_ids = itertools.count(1)
+        gateway.add_listener(self._on_state_change)
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        umask = os.umask(0o177)
+        try:
+            self._listener = Listener(self.path, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        threading.Thread(target=self._accept_loop, name="gateway-ipc", daemon=True).start()
+        log.info("Gateway wartet auf Worker unter %s", self.path)
+
+    def close(self):
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.close()
+
+    def _accept_loop(self):
+        while self._listener is not None:
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError as e:
+                log.warning("Verbindung ohne gültigen Schlüssel abgewiesen: %s", e)
+                continue
+            except (OSError, EOFError):
+                if self._listener is None:
+                    return
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="gateway-ipc-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            while True:
+                request = conn.recv()
+                if request[0] == "subscribe":
+                    self._stream(conn)
+                    return
+                self._reply(conn, self._handle(*request))
+        except (OSError, EOFError):
+            pass
+        finally:
+            conn.close()
+
+    def _handle(self, target, name, args, kwargs):
+        try:
+            return "ok", _portable(self._call(target, name, args, kwargs))
+        except Exception as e:
+            return "error", e
+
+    @staticmethod
+    def _reply(conn, reply):
+        try:
+            conn.send(reply)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            # Ergebnis oder Exception nicht übertragbar: als Fehlermeldung weitergeben
+            conn.send(("error", RuntimeError(f"{reply[1]!r} nicht übertragbar: {e}")))
+
+    def _call(self, target, name, args, kwargs):
+        if target == "gateway":
+            if name == "exists":
+                return self.gateway.get(args[0]) is not None
+            if name not in GATEWAY_METHODS:
+                raise AttributeError(f"gateway.{name}")
+            return getattr(self.gateway, name)(*args, **kwargs)
+        if target in ("conn", "state"):
+            if name not in (CONNECTION_ATTRS if target == "conn" else STATE_ATTRS):
+                raise AttributeError(f"{target}.{name}")
+            conn = self._connection(args[0])
+            return _attr(conn if target == "conn" else conn.state, name, args[1:], kwargs)
+        if target == "command":
+            if name not in COMMAND_OPS:
+                raise AttributeError(f"command.{name}")
+            return getattr(self, f"_command_{name}")(*args, **kwargs)
+        service = self.services.get(target)
+        if service is None or name.startswith("_"):
+            raise AttributeError(f"{target}.{name}")
+        return _attr(service, name, args, kwargs)
+
+    def _connection(self, serial):
+        conn = self.gateway.get(serial)
+        if conn is None:
+            raise CommandError(f"Keine Verbindung zu {serial}")
+        return conn
+
+    # --- Befehle: PendingCommand bleibt im Gateway, der Worker bekommt einen Schlüssel ---
+
+    def _command_submit(self, serial, *args, **kwargs):
+        conn = self._connection(serial)
+        cmd = conn.submit_command(*args, **kwargs)
+        with self._lock:
+            now = time.monotonic()
+            for key in [k for k, (_, c) in self._commands.items()
+                        if c.done.is_set() and now - c.deadline > COMMAND_RETENTION]:
+                del self._commands[key]
+            key = next(self._command_ids)
+            self._commands[key] = (conn, cmd)
+        return RemoteCommand(key, cmd.command)
+
+    def _command_wait(self, key, timeout):
+        """Wartet höchstens timeout Sekunden; (False, None), solange der Befehl noch läuft."""
+        with self._lock:
+            entry = self._commands.get(key)
+        if entry is None:
+            raise CommandError("Befehl unbekannt oder bereits abgeholt")
+        conn, cmd = entry
+        cmd.done.wait(max(0.0, min(timeout, cmd.deadline - time.monotonic())))
+        if not cmd.done.is_set() and time.monotonic() < cmd.deadline:
+            return False, None
+        with self._lock:
+            self._commands.pop(key, None)
+        return True, conn.wait_command(cmd)
+
+    def _command_cancel(self, key):
+        with self._lock:
+            entry = self._commands.pop(key, None)
+        if entry is not None:
+            entry[1].cancelled = True
+
+    # --- Zustandsänderungen an die Worker verteilen ---
+
+    def _on_state_change(self, conn, delta):
+        event = (conn.serial, conn.state.version, delta)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                self.dropped_events += 1
+
+    def _stream(self, conn):
+        events = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.append(events)
+        try:
+            while True:
+                conn.send(events.get())
+        finally:
+            with self._lock:
+                self._subscribers.remove(events)
+
+
+class GatewayClient:
+    """Verbindung(en) eines Worker-Prozesses zum Gateway, eine pro Thread."""
+
+    def __init__(self, path=GATEWAY_SOCKET, authkey=GATEWAY_KEY):
+        self.path = path
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def connect(self):
+        try:
+            return Client(self.path, family="AF_UNIX", authkey=self.authkey)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise GatewayUnavailable(f"Gateway-Prozess nicht erreichbar ({self.path}): {e}")
+
+    def call(self, target, name, *args, **kwargs):
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = self.connect()
+            try:
+                conn.send((target, name, args, kwargs))
+                status, value = conn.recv()
+                break
+            except (OSError, EOFError) as e:
+                # Gateway wurde neu gestartet: einmal mit frischer Verbindung wiederholen
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise GatewayUnavailable(f"Verbindung zum Gateway-Prozess verloren: {e}")
+            except pickle.UnpicklingError as e:
+                # Worker ohne Schlüssel bekommt die Challenge des Servers statt einer Antwort
+                conn.close()
+                self._local.conn = None
+                raise GatewayUnavailable(f"Antwort des Gateway-Prozesses unlesbar (FILACORE_GATEWAY_KEY?): {e}")
+        if status == "error":
+            raise value
+        return value
+
+    def subscribe(self, callback):
+        """callback(serial, version, delta) für jede Zustandsänderung, aus einem eigenen Thread."""
+        def run():
+            while True:
+                try:
+                    conn = self.connect()
+                    conn.send(("subscribe",))
+                    while True:
+                        callback(*conn.recv())
+                except (GatewayUnavailable, OSError, EOFError) as e:
+                    log.warning("Zustandsänderungen vom Gateway unterbrochen: %s", e)
+                    time.sleep(RECONNECT_DELAY)
+
+        threading.Thread(target=run, name="gateway-events", daemon=True).start()
+
+
+class RemoteService:
+    """Proxy auf einen Dienst im Gateway-Prozess: service.methode(...) läuft dort."""
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            return self._client.call(self._name, name, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+class RemoteState:
+    """Lesezugriff auf den PrinterState im Gateway, gleiche Schnittstelle."""
+
+    def __init__(self, client, serial, version=None):
+        self._client = client
+        self._serial = serial
+        # Bei Zustandsänderungen liefert das Gateway die Version gleich mit
+        self._version = version
+
+    def _call(self, name, *args, **kwargs):
+        return self._client.call("state", name, self._serial, *args, **kwargs)
+
+    @property
+    def empty(self):
+        return self._call("empty")
+
+    @property
+    def restored(self):
+        return self._call("restored")
+
+    @property
+    def updated_at(self):
+        return self._call("updated_at")
+
+    @property
+    def version(self):
+        return self._version if self._version is not None else self._call("version")
+
+    def age(self):
+        return self._call("age")
+
+    def snapshot(self):
+        return self._call("snapshot")
+
+    def snapshot_json(self):
+        return self._call("snapshot_json")
+
+    def get(self, *path, default=None):
+        return self._call("get", *path, default=default)
+
+
+class RemoteConnection:
+    """Stellvertreter einer PrinterConnection im Gateway-Prozess."""
+
+    def __init__(self, client, serial, version=None):
+        self._client = client
+        self.serial = serial
+        self.state = RemoteState(client, serial, version)
+
+    def _call(self, name, *args, **kwargs):
+        return self._client.call("conn", name, self.serial, *args, **kwargs)
+
+    @property
+    def running(self):
+        return self._call("running")
+
+    @property
+    def connected(self):
+        return self._call("connected")
+
+    @property
+    def reports_received(self):
+        return self._call("reports_received")
+
+    def request_pushall(self):
+        return self._call("request_pushall")
+
+    def wait_for_state(self, timeout):
+        return self._call("wait_for_state", timeout)
+
+    def refresh(self, stale_after, timeout, wait_first=True):
+        return self._call("refresh", stale_after, timeout, wait_first)
+
+    def wait_for_update(self, after, timeout):
+        return self._call("wait_for_update", after, timeout)
+
+    def submit_command(self, *args, **kwargs):
+        return self._client.call("command", "submit", self.serial, *args, **kwargs)
+
+    def wait_command(self, cmd, cancel_event=None):
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                self._client.call("command", "cancel", cmd.key)
+                raise CommandError("Abgebrochen")
+            done, reply = self._client.call(
+                "command", "wait", cmd.key, COMMAND_POLL if cancel_event is not None else COMMAND_WAIT)
+            if done:
+                return reply
+
+    def send_command(self, *args, **kwargs):
+        return self.wait_command(self.submit_command(*args, **kwargs))
+
+
+class RemoteGateway:
+    """MqttGateway-Schnittstelle für Worker-Prozesse; die Verbindungen hält der Gateway-Prozess."""
+
+    def __init__(self, client):
+        self._client = client
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, fn):
+        """fn(conn, delta) wie beim MqttGateway, aufgerufen aus dem Event-Thread dieses Workers."""
+        with self._lock:
+            self._listeners.append(fn)
+            if len(self._listeners) == 1:
+                self._client.subscribe(self._notify)
+
+    def _notify(self, serial, version, delta):
+        conn = RemoteConnection(self._client, serial, version)
+        for fn in list(self._listeners):
+            try:
+                fn(conn, delta)
+            except Exception as e:
+                log.error("Listener-Fehler für %s: %s", serial, e)
+
+    def sync(self, printers):
+        self._client.call("gateway", "sync", printers)
+
+    def get(self, serial):
+        return RemoteConnection(self._client, serial) if self._client.call("gateway", "exists", serial) else None
+
+    def read_state(self, serial, stale_after, timeout, wait_first=True):
+        # Aktualisieren und Snapshot in einem Aufruf statt einzeln über RemoteState
+        return self._client.call("gateway", "read_state", serial, stale_after, timeout, wait_first)
+
+    def cert_path(self, printer):
+        return self._client.call("gateway", "cert_path", printer)
+
+
+class RemoteServices:
+    """Gegenstück zu GatewayServices im Worker: gleiche Attribute, alles läuft im Gateway-Prozess."""
+
+    def __init__(self, client):
+        self.client = client
+        self.gateway = RemoteGateway(client)
+        for name in ("cert_manager", "recorder", "consumption", "tray_matcher", "print_history", "captures",
+                     "jobs", "metrics"):
+            setattr(self, name, RemoteService(client, name))
+
+
+def _attr(obj, name, args, kwargs):
+    value = getattr(obj, name)
+    return value(*args, **kwargs) if callable(value) else value
+
+
+def _portable(value):
+    if isinstance(value, Future):
+        # fetch_async: das Ergebnis gibt es nur im Gateway-Prozess
+        return None
+    if isinstance(value, list):
+        return [_portable(v) for v in value]
+    if not isinstance(value, dict) and hasattr(value, "to_dict"):
+        return Record(value.to_dict())
+    return value
@@ -0,0 +1,166 @@
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from capture import CaptureManager
+from certs import CERT_DIR, CertificateManager
+from color_match import SpoolColorIndex, TrayMatcher
+from consumption import ConsumptionTracker
+from gateway_ipc import GATEWAY_SOCKET, GatewayServer
+from jobs import JobBoard
+from logqueue import setup_logging
+from metrics import registry
+from mqtt_gateway import MqttGateway
+from print_history import PrintHistory
+from storage import Store
+from telemetry import TelemetryRecorder
+from warm_start import StateSnapshot
+
+# So lange wartet der Start auf den Socket des Gateway-Prozesses
+STARTUP_TIMEOUT = 30
+# Pause vor dem Neustart eines abgestürzten Gateway-Prozesses
+RESTART_DELAY = 2
+
+log = logging.getLogger("gateway_server")
+
+
+class GatewayServices:
+    """Alles, was genau einmal laufen muss: die MQTT-Verbindungen und die Listener auf ihren Reports.
+
+    Im Einzelprozess-Betrieb legt app.py das direkt an, mit mehreren Workern
+    der Gateway-Prozess (main), und die Worker sprechen über gateway_ipc mit ihm.
+    """
+
+    def __init__(self, store, cert_folder=CERT_DIR):
+        self.store = store
+        # Eine dauerhafte MQTT-Verbindung pro Drucker, Reports landen im Speicher
+        self.gateway = MqttGateway(cert_folder)
+        # Sobald ein Zertifikat da ist, baut das Gateway die Verbindung auf
+        self.cert_manager = CertificateManager(
+            self.gateway.cert_root, on_fetched=lambda printer: self.gateway.sync(store.list_printers()))
+
+        # Temperaturen, Fortschritt und AMS-Feuchte aus dem Report-Stream mitschreiben
+        self.recorder = TelemetryRecorder()
+        self.gateway.add_listener(self.recorder.on_state_change)
+        # AMS-Restmengen auf die zugeordneten Spulen verbuchen (gesammelt geschrieben)
+        self.consumption = ConsumptionTracker(store)
+        self.gateway.add_listener(self.consumption.on_state_change)
+        # Passende Spulen (Farbe + Material) für jedes AMS-Tray, neu berechnet wenn ein Report Trays ändert
+        self.tray_matcher = TrayMatcher(SpoolColorIndex(store))
+        self.gateway.add_listener(self.tray_matcher.on_state_change)
+        # Druckaufträge mit Dauer, Spulen und Kosten speichern, Tagessummen laufend fortschreiben
+        self.print_history = PrintHistory(store, self.consumption)
+        self.gateway.add_listener(self.print_history.on_state_change)
+
+        # Warmstart: zuletzt bekannte Zustände sofort (als veraltet markiert) ausliefern
+        self.snapshot = StateSnapshot(self.gateway, self.cert_manager, self.print_history)
+        # Rohnachrichten gepuffert in rotierende, komprimierte NDJSON-Segmente schreiben
+        self.captures = CaptureManager(self.gateway)
+        # Job-Übersicht für mehrere Worker
+        self.jobs = JobBoard()
+
+    def start(self):
+        """Schreib-Threads starten, Snapshot laden und die Verbindungen im Hintergrund aufbauen."""
+        self.recorder.start()
+        self.consumption.start()
+        self.snapshot.load()
+        self.snapshot.start()
+        threading.Thread(target=lambda: self.gateway.sync(self.store.list_printers()),
+                         name="gateway-start", daemon=True).start()
+
+    def close(self):
+        self.captures.stop_all()
+        self.snapshot.close()
+        self.consumption.flush()
+        self.recorder.close()
+
+    def exports(self):
+        """Dienste, die Worker über den Socket aufrufen dürfen."""
+        return {
+            "cert_manager": self.cert_manager,
+            "recorder": self.recorder,
+            "consumption": self.consumption,
+            "tray_matcher": self.tray_matcher,
+            "print_history": self.print_history,
+            "captures": self.captures,
+            "jobs": self.jobs,
+            "metrics": registry,
+        }
+
+
+class GatewayProcess:
+    """Startet den Gateway-Prozess (für gunicorn.conf.py) und startet ihn nach einem Absturz neu."""
+
+    def __init__(self, path):
+        self.path = path
+        self._proc = None
+        self._stopping = False
+
+    def start(self):
+        self._spawn()
+        threading.Thread(target=self._supervise, name="gateway-supervisor", daemon=True).start()
+
+    def stop(self, timeout=10):
+        self._stopping = True
+        proc = self._proc
+        if proc is None or proc.poll() is not None:
+            return
+        proc.terminate()
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    def _spawn(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        env = dict(os.environ, FILACORE_GATEWAY_SOCKET=self.path)
+        self._proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not os.path.exists(self.path):
+            if self._proc.poll() is not None:
+                raise RuntimeError(f"Gateway-Prozess beim Start beendet (Code {self._proc.returncode})")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Gateway-Prozess nicht rechtzeitig bereit ({self.path})")
+            time.sleep(0.05)
+
+    def _supervise(self):
+        while not self._stopping:
+            code = self._proc.wait()
+            if self._stopping:
+                return
+            log.error("Gateway-Prozess beendet (Code %s), Neustart in %ds", code, RESTART_DELAY)
+            time.sleep(RESTART_DELAY)
+            try:
+                self._spawn()
+            except RuntimeError as e:
+                log.error("%s", e)
+
+
+def main():
+    setup_logging()
+    if not GATEWAY_SOCKET:
+        sys.exit("FILACORE_GATEWAY_SOCKET ist nicht gesetzt")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    services = GatewayServices(Store(shared_versions=True))
+    services.start()
+    server = GatewayServer(GATEWAY_SOCKET, services.gateway, services.exports())
+    server.start()
+    while not stop.wait(1):
+        pass
+    log.info("Gateway-Prozess wird beendet")
+    server.close()
+    services.close()
+    services.gateway.stop_all()
+
+
+if __name__ == "__main__":
+    main()
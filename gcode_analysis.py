@@ -0,0 +1,241 @@
+import hashlib
+import math
+import mmap
+import os
+import re
+import zipfile
+
+FILAMENT_DIAMETER = 1.75
+# g/cm³, falls weder G-Code noch Spule eine Dichte angeben
+DEFAULT_DENSITY = 1.24
+MATERIAL_DENSITY = {
+    "PLA": 1.24, "PETG": 1.27, "ABS": 1.04, "ASA": 1.07, "TPU": 1.21, "PA": 1.14, "PC": 1.20, "PVA": 1.23,
+}
+# Slicer-Angaben stehen am Anfang (Bambu/Orca) oder am Ende (Prusa) der Datei
+HEADER_BYTES = 1024 * 1024
+# Auf einmal durchsuchter Bereich bzw. entpackte Blockgröße bei 3MF
+WINDOW_BYTES = 8 * 1024 * 1024
+# Werkzeuge ab hier sind keine AMS-Trays (Bambu: 254 externe Spule, 255 entladen, 1000 Wechsel-Makro)
+MAX_TOOL = 254
+
+# Das führende \n gibt der Regex-Engine ein festes Präfix, nach dem sie schnell sucht (statt ^ mit re.M)
+EXTRUDE_RE = re.compile(rb"\nG[0-3][ \t][^\nE;]*E([-+]?[\d.]+)")
+CONTROL_RE = re.compile(
+    rb"\n(?:T(?P<tool>\d+)[ \t\r]*(?=;|\n|\Z)"
+    rb"|M8(?P<mode>[23])\b"
+    rb"|G92[ \t][^\n;]*E(?P<reset>[-+]?[\d.]+))"
+)
+HEADER_RE = re.compile(
+    rb"^;[ \t]*(filament_density|filament_diameter|filament_type|total filament length \[mm\]"
+    rb"|total filament weight \[g\]|filament used \[mm\]|filament used \[g\])[ \t]*[:=][ \t]*([^\n\r]*)",
+    re.M,
+)
+HEADER_KEYS = {
+    "total filament length [mm]": "laenge_mm", "filament used [mm]": "laenge_mm",
+    "total filament weight [g]": "gewicht_g", "filament used [g]": "gewicht_g",
+}
+
+
+class AnalysisError(Exception):
+    pass
+
+
+class _Scanner:
+    """Summiert die Extrusion (E) pro Werkzeug über Blöcke ganzer Zeilen.
+
+    Pro Block werden erst die seltenen Steuerzeilen (Werkzeugwechsel, M82/M83,
+    G92) gesucht; dazwischen reicht im relativen Modus die Summe aller E-Werte,
+    im absoluten der letzte Wert.
+    """
+
+    def __init__(self):
+        self.relative = False
+        self.tool = 0
+        self.last_e = 0.0
+        self.extruded = {}
+        # Angefangene Zeile aus dem vorigen Block, beginnt immer mit \n
+        self._rest = b"\n"
+
+    def feed(self, chunk):
+        """Nimmt den nächsten Block eines Stroms (z.B. entpackt aus einem 3MF-Archiv)."""
+        data = self._rest + chunk
+        cut = data.rfind(b"\n")
+        if cut <= 0:
+            self._rest = data
+            return
+        self._scan_range(data, 0, cut)
+        self._rest = data[cut:]
+
+    def finish(self):
+        if len(self._rest) > 1:
+            self._scan_range(self._rest, 0, len(self._rest))
+        self._rest = b"\n"
+
+    def scan(self, buf, start=0, end=None):
+        """Durchsucht buf[start:end]; buf[start - 1] muss ein Zeilenende sein (oder start == 0)."""
+        end = len(buf) if end is None else end
+        if start == 0:
+            # Erste Zeile hat kein vorangehendes \n
+            first_end = buf.find(b"\n", 0, end)
+            first_end = end if first_end < 0 else first_end
+            self._scan_range(b"\n" + buf[:first_end], 0, first_end + 1)
+            start = first_end + 1
+        while start < end:
+            stop = buf.find(b"\n", min(start + WINDOW_BYTES, end - 1), end)
+            stop = end if stop < 0 else stop + 1
+            self._scan_range(buf, start - 1, stop)
+            start = stop
+
+    def _scan_range(self, buf, start, end):
+        pos = start
+        for control in CONTROL_RE.finditer(buf, start, end):
+            self._extrude(buf, pos, control.start())
+            pos = control.end()
+            if control.group("tool") is not None:
+                tool = int(control.group("tool"))
+                if tool < MAX_TOOL:
+                    self.tool = tool
+            elif control.group("mode") is not None:
+                self.relative = control.group("mode") == b"3"
+            else:
+                self.last_e = _float(control.group("reset"), self.last_e)
+        self._extrude(buf, pos, end)
+
+    def _extrude(self, buf, start, end):
+        values = EXTRUDE_RE.findall(buf, start, end)
+        if not values:
+            return
+        try:
+            if self.relative:
+                amount = sum(map(float, values))
+            else:
+                # Absolut: die Differenzen summieren sich zu letzter minus vorheriger Wert
+                last = float(values[-1])
+                amount, self.last_e = last - self.last_e, last
+        except ValueError:
+            amount = sum(_float(v, 0.0) for v in values) if self.relative else 0.0
+        self.extruded[self.tool] = self.extruded.get(self.tool, 0.0) + amount
+
+
+def save_upload(stream, target, chunk_size=1024 * 1024):
+    """Kopiert einen Upload blockweise in die Datei target und liefert dabei gleich den SHA-256."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+        target.write(chunk)
+    return digest.hexdigest()
+
+
+def analyze_file(path, plate=None, full_scan=False):
+    """Verbrauch pro Werkzeug aus einer .gcode- oder .3mf-Datei (bei 3MF: plate, Standard die erste Platte).
+
+    Stehen Länge/Gewicht pro Filament schon in den Slicer-Kommentaren, werden
+    diese übernommen; sonst (oder mit full_scan) wird die Extrusion gezählt.
+    """
+    if zipfile.is_zipfile(path):
+        return _analyze_3mf(path, plate, full_scan)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise AnalysisError("Datei ist leer")
+        # Die Datei wird vom Kernel seitenweise eingeblendet, nie komplett in den Speicher gelesen
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header = _header(mm[:HEADER_BYTES], mm[-HEADER_BYTES:])
+            if not full_scan and "laenge_mm" in header:
+                return _result(header, None)
+            scanner = _Scanner()
+            scanner.scan(mm)
+            return _result(header, scanner)
+
+
+def _analyze_3mf(path, plate, full_scan):
+    with zipfile.ZipFile(path) as archive:
+        names = sorted(n for n in archive.namelist() if n.lower().endswith(".gcode"))
+        if plate is not None:
+            names = [n for n in names if n.lower().endswith(f"plate_{plate}.gcode")]
+        if not names:
+            raise AnalysisError("Kein G-Code im 3MF-Archiv (nur gesliced exportierte Dateien enthalten G-Code)")
+        with archive.open(names[0]) as member:
+            # Entpackt wird blockweise; reichen die Slicer-Angaben im Kopf, wird der Rest nicht gelesen
+            head = member.read(HEADER_BYTES)
+            header = _header(head, b"")
+            if not full_scan and "laenge_mm" in header:
+                return _result(header, None)
+            scanner = _Scanner()
+            tail = chunk = head
+            while chunk:
+                scanner.feed(chunk)
+                tail = chunk
+                chunk = member.read(WINDOW_BYTES)
+            scanner.finish()
+    header = dict(_header(b"", tail[-HEADER_BYTES:]), **header)
+    return _result(header, scanner)
+
+
+def _header(head, tail):
+    """Slicer-Kommentare: Dichte, Durchmesser, Typ und ggf. Länge/Gewicht pro Filament."""
+    values = {}
+    for part in (head, tail):
+        for key, value in HEADER_RE.findall(part):
+            key = key.decode()
+            values.setdefault(HEADER_KEYS.get(key, key), value.decode("utf-8", "replace").strip())
+    return values
+
+
+def _result(header, scanner):
+    diameters = _floats(header.get("filament_diameter"))
+    densities = _floats(header.get("filament_density"))
+    types = [t.strip() for t in re.split(r"[,;]", header.get("filament_type", "")) if t.strip()]
+    if scanner is None:
+        lengths = dict(enumerate(_floats(header["laenge_mm"])))
+        weights = _floats(header.get("gewicht_g"))
+    else:
+        lengths, weights = scanner.extruded, []
+    tools = []
+    for tool, length in sorted(lengths.items()):
+        if not length or length <= 0:
+            continue
+        diameter = _pick(diameters, tool) or FILAMENT_DIAMETER
+        density = _pick(densities, tool)
+        volume = length * math.pi * (diameter / 2) ** 2 / 1000  # cm³
+        weight = _pick(weights, tool) if weights else None
+        if weight is None and density:
+            weight = volume * density
+        tools.append({
+            "tool": tool,
+            "material": types[tool] if tool < len(types) else None,
+            "laenge_mm": round(length, 1),
+            "volumen_cm3": round(volume, 3),
+            "dichte": density,
+            "gewicht_g": round(weight, 2) if weight is not None else None,
+        })
+    return {"quelle": "slicer" if scanner is None else "scan", "werkzeuge": tools}
+
+
+def estimate_weight(entry, material=None):
+    """Gewicht eines Werkzeugs; ohne Angabe im G-Code über die Dichte des Materials geschätzt."""
+    if entry.get("gewicht_g") is not None:
+        return entry["gewicht_g"]
+    name = str(material or entry.get("material") or "").upper()
+    # "PLA-CF", "PETG HF", "PLA+" -> Grundmaterial
+    density = MATERIAL_DENSITY.get(re.split(r"[\s+\-]", name)[0], DEFAULT_DENSITY)
+    return round(entry["volumen_cm3"] * density, 2)
+
+
+def _float(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _floats(value):
+    if not value:
+        return []
+    return [_float(part, None) for part in re.split(r"[,;]", value)]
+
+
+def _pick(values, index):
+    if not values:
+        return None
+    # Eine einzelne Angabe gilt für alle Werkzeuge
+    return values[index] if index < len(values) else (values[0] if len(values) == 1 else None)
@@ -0,0 +1,42 @@
+"""Produktivbetrieb mit mehreren HTTP-Workern und einem gemeinsamen Gateway-Prozess.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Der Gateway-Prozess hält die MQTT-Verbindungen und Druckerzustände, die
+Worker erreichen ihn über einen Unix-Socket (gateway_ipc).
+"""
+import os
+import secrets
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+bind = os.environ.get("FILACORE_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("FILACORE_WORKERS", str(min(os.cpu_count() or 1, 4))))
+worker_class = "gthread"
+# Jeder offene Status-Stream (SSE) belegt einen Thread seines Workers
+threads = int(os.environ.get("FILACORE_THREADS", "16"))
+# Bei gthread gilt das nur für hängende Worker, nicht für lange Streams
+timeout = 60
+graceful_timeout = 10
+# Jeder Worker lädt app.py selbst, erst nach dem fork entstehen seine Verbindungen zum Gateway
+preload_app = False
+
+
+def on_starting(server):
+    # Socket und Schlüssel erben die Worker über die Umgebung; vor dem Import setzen,
+    # gateway_ipc liest sie beim Laden und die Worker übernehmen die Module per fork
+    os.environ.setdefault(
+        "FILACORE_GATEWAY_SOCKET", os.path.join(tempfile.gettempdir(), f"filacore-gateway-{os.getpid()}.sock"))
+    os.environ.setdefault("FILACORE_GATEWAY_KEY", secrets.token_hex(32))
+    from gateway_server import GatewayProcess
+
+    server.filacore_gateway = GatewayProcess(os.environ["FILACORE_GATEWAY_SOCKET"])
+    server.filacore_gateway.start()
+
+
+def on_exit(server):
+    gateway = getattr(server, "filacore_gateway", None)
+    if gateway is not None:
+        gateway.stop()
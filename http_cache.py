@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # optional, gzip reicht als Fallback
+    brotli = None
+
+# Kleine Antworten lohnen die Kompression nicht
+MIN_COMPRESS_SIZE = 512
+
+
+class CachedPayload:
+    """Fertig serialisierter Antwort-Body mit ETag und vorberechneten komprimierten Varianten."""
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        with self._lock:
+            data = self._encoded.get(encoding)
+            if data is None:
+                if encoding == "br":
+                    data = brotli.compress(self.body)
+                else:
+                    data = gzip.compress(self.body, compresslevel=6)
+                self._encoded[encoding] = data
+            return data
+
+    def response(self):
+        """Antwort für den aktuellen Request: 304, komprimiert oder unverändert."""
+        headers = {"ETag": f'"{self.etag}"', "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if self.etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+
+        body = self.body
+        if len(body) >= MIN_COMPRESS_SIZE:
+            accepted = request.accept_encodings
+            if brotli is not None and accepted["br"]:
+                body = self.encoded("br")
+                headers["Content-Encoding"] = "br"
+            elif accepted["gzip"]:
+                body = self.encoded("gzip")
+                headers["Content-Encoding"] = "gzip"
+        return Response(body, mimetype=self.mimetype, headers=headers)
+
+
+def json_payload(data):
+    return CachedPayload(json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+
+class FileCache:
+    """Liest Dateien nur neu ein, wenn sich mtime oder Größe geändert haben."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, path, parse):
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+        with open(path, "rb") as f:
+            raw = f.read()
+        value = parse(raw)
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = (key, value)
+        return value
+
+    def json(self, path):
+        """(geparste Daten, CachedPayload) einer JSON-Datei."""
+        def parse(raw):
+            data = json.loads(raw)
+            return data, json_payload(data)
+        return self._load(path, parse)
+
+    def static(self, path):
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if mimetype.startswith("text/"):
+            mimetype += "; charset=utf-8"
+        return self._load(path, lambda raw: CachedPayload(raw, mimetype))
+
+
+class VersionedCache:
+    """Cache für Daten aus dem Store, invalidiert über dessen Schreibzähler."""
+
+    def __init__(self, build):
+        self._build = build
+        self._lock = threading.Lock()
+        self._version = None
+        self._payload = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version):
+        with self._lock:
+            if self._version == version:
+                self.hits += 1
+                return self._payload
+        payload = json_payload(self._build())
+        with self._lock:
+            self.misses += 1
+            self._version = version
+            self._payload = payload
+        return payload
@@ -0,0 +1,253 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("FILACORE_JOB_WORKERS", "4"))
+# Mehr wartende Jobs werden abgelehnt, statt unbegrenzt Arbeit anzunehmen
+MAX_QUEUED_JOBS = int(os.environ.get("FILACORE_MAX_JOBS", "64"))
+# Abgeschlossene Jobs bleiben so lange abrufbar
+JOB_RETENTION = 600
+# So oft fragt ein Worker, ob einer seiner Jobs über einen anderen Worker abgebrochen wurde
+CANCEL_POLL_INTERVAL = 0.5
+
+log = logging.getLogger("jobs")
+
+
+class JobRejected(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, params=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.status = "queued"
+        self.result = None
+        self.status_code = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.params:
+            data["params"] = self.params
+        if self.status == "running" and self.cancelled:
+            # Der laufende Schritt lässt sich nicht unterbrechen, der Job endet danach als cancelled
+            data["cancel_requested"] = True
+        if self.status == "done":
+            data["result"] = self.result
+            data["status_code"] = self.status_code
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class JobRecord:
+    """Job eines anderen Worker-Prozesses, so wie er am JobBoard veröffentlicht wurde."""
+
+    def __init__(self, data):
+        self.data = data
+        self.id = data["job_id"]
+        self.status = data["status"]
+        self.created = data["created"]
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class JobBoard:
+    """Gemeinsame Job-Übersicht mehrerer Worker (liegt im Gateway-Prozess).
+
+    Ausgeführt wird ein Job im Worker, der ihn angenommen hat; Status und
+    Ergebnis werden hier veröffentlicht, damit jeder Worker /jobs/<id>
+    beantworten kann. Abbrüche werden vorgemerkt und vom ausführenden Worker
+    abgeholt.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._cancel = set()
+
+    def publish(self, data):
+        with self._lock:
+            self._prune()
+            current = self._jobs.get(data["job_id"])
+            if current is not None and current.get("finished") and not data.get("finished"):
+                # Veröffentlichungen aus verschiedenen Threads können sich überholen
+                return
+            self._jobs[data["job_id"]] = data
+            if data.get("finished"):
+                self._cancel.discard(data["job_id"])
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda d: d["created"], reverse=True)
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            data = self._jobs.get(job_id)
+            if data is not None and not data.get("finished"):
+                self._cancel.add(job_id)
+            return data
+
+    def cancel_requests(self, job_ids):
+        with self._lock:
+            return [job_id for job_id in job_ids if job_id in self._cancel]
+
+    def _prune(self):
+        limit = time.time() - JOB_RETENTION
+        for job_id in [i for i, d in self._jobs.items() if d.get("finished") and d["finished"] < limit]:
+            del self._jobs[job_id]
+
+
+class JobRunner:
+    """Führt lange Operationen auf einem begrenzten Worker-Pool aus.
+
+    Job-Funktionen bekommen den Job als erstes Argument, prüfen bei Bedarf
+    ``job.cancelled`` und liefern ``(body, status_code)`` zurück.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, board=None):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jobs")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        # Mit mehreren Worker-Prozessen: JobBoard (bzw. Proxy darauf) für die gemeinsame Übersicht
+        self.board = board
+        self._watcher = None
+
+    def submit(self, kind, fn, *args, params=None):
+        with self._lock:
+            self._prune()
+            queued = sum(1 for j in self._jobs.values() if j.status == "queued")
+            if queued >= MAX_QUEUED_JOBS:
+                raise JobRejected("Zu viele wartende Jobs")
+            job = Job(kind, params)
+            self._jobs[job.id] = job
+        if self.board is not None:
+            self._publish(job)
+            self._watch_cancels()
+        self._pool.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.board is not None:
+            data = self.board.get(job_id)
+            return JobRecord(data) if data is not None else None
+        return job
+
+    def list(self):
+        if self.board is not None:
+            return [JobRecord(data) for data in self.board.list()]
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created, reverse=True)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                # Unter demselben Lock wie der Start in _run: entweder startet der Job gar nicht
+                # oder er läuft schon und sieht den Abbruch bei check_cancelled()
+                job.cancel_event.set()
+                queued = job.status == "queued"
+        if job is None:
+            if self.board is None:
+                return None
+            # Läuft in einem anderen Worker, der holt den Abbruch beim nächsten Abfragen ab
+            data = self.board.request_cancel(job_id)
+            return JobRecord(data) if data is not None else None
+        if queued:
+            self._finish(job, "cancelled")
+        elif self.board is not None:
+            self._publish(job)
+        return job
+
+    def _run(self, job, fn, args):
+        with self._lock:
+            if job.cancelled:
+                return
+            job.status = "running"
+            job.started = time.time()
+        if self.board is not None:
+            self._publish(job)
+        try:
+            body, status_code = fn(job, *args)
+            job.result = body
+            job.status_code = status_code
+            self._finish(job, "done")
+        except JobCancelled:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, "failed")
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        job.done.set()
+        if self.board is not None:
+            self._publish(job)
+
+    def _publish(self, job):
+        try:
+            self.board.publish(job.to_dict())
+        except Exception as e:
+            log.warning("Job %s nicht veröffentlicht: %s", job.id, e)
+
+    def _watch_cancels(self):
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._cancel_loop, name="job-cancel", daemon=True)
+        self._watcher.start()
+
+    def _cancel_loop(self):
+        while True:
+            time.sleep(CANCEL_POLL_INTERVAL)
+            with self._lock:
+                active = [j.id for j in self._jobs.values() if not j.done.is_set()]
+            if not active:
+                continue
+            try:
+                for job_id in self.board.cancel_requests(active):
+                    self.cancel(job_id)
+            except Exception as e:
+                log.warning("Abbrüche nicht abgefragt: %s", e)
+
+    def _prune(self):
+        limit = time.time() - JOB_RETENTION
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < limit]:
+            del self._jobs[job_id]
@@ -0,0 +1,36 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_LEVEL = os.environ.get("FILACORE_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s [%(name)s] %(message)s"
+
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL):
+    """Leitet alle Log-Ausgaben über eine Queue an einen eigenen Schreib-Thread.
+
+    Request- und MQTT-Threads legen Records nur in die Queue; das Formatieren
+    und Schreiben nach stderr passiert im QueueListener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,451 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from certs import client_context
+from metrics import registry
+from printer_state import PrinterState
+
+MQTT_PORT = 8883
+MQTT_USER = "bblp"
+COMMAND_TIMEOUT = 10
+COMMAND_RETRIES = 1
+
+log = logging.getLogger("mqtt_gateway")
+
+MQTT_HANDSHAKE = registry.histogram(
+    "filacore_mqtt_handshake_seconds", "TCP- und TLS-Aufbau zum Drucker", ("printer",))
+MQTT_CONNECT = registry.histogram(
+    "filacore_mqtt_connect_seconds", "Verbindungsaufbau bis zur CONNACK-Antwort", ("printer",))
+MQTT_CONNECTS = registry.counter(
+    "filacore_mqtt_connects_total", "Verbindungsversuche nach Ergebnis", ("printer", "result"))
+MQTT_MESSAGES = registry.counter(
+    "filacore_mqtt_messages_received_total", "Empfangene MQTT-Nachrichten", ("printer",))
+MQTT_BYTES = registry.counter(
+    "filacore_mqtt_received_bytes_total", "Empfangene MQTT-Nutzdaten in Byte", ("printer",))
+COMMAND_RTT = registry.histogram(
+    "filacore_mqtt_command_rtt_seconds", "Zeit vom Senden eines Befehls bis zur Antwort", ("command",))
+COMMANDS = registry.counter(
+    "filacore_mqtt_commands_total", "Abgeschlossene Befehle nach Ergebnis", ("command", "result"))
+
+# Gemeinsamer Zähler, damit sich sequence_ids auch über Reconnects nicht wiederholen
+_sequence = itertools.count(int(time.time()) % 1000000)
+
+
+class CommandError(Exception):
+    pass
+
+
+class CommandTimeout(CommandError):
+    pass
+
+
+class PendingCommand:
+    def __init__(self, section, command, payload, timeout, retries):
+        self.section = section
+        self.command = command
+        self.sequence_id = str(next(_sequence))
+        payload[section]["sequence_id"] = self.sequence_id
+        self.payload = json.dumps(payload)
+        self.timeout = timeout
+        self.retries = retries
+        self.reply = None
+        self.error = None
+        self.cancelled = False
+        self.deadline = None
+        self.answered = threading.Event()
+        self.done = threading.Event()
+
+    @property
+    def key(self):
+        return (self.command, self.sequence_id)
+
+
+class PrinterConnection:
+    """Dauerhafte MQTT-Verbindung zu einem Drucker, hält den Druckerzustand im Speicher."""
+
+    def __init__(self, printer, cert_path, on_change=None, on_raw=None):
+        self.serial = printer["serial"]
+        self.name = printer["name"]
+        self.ip = printer["ip"]
+        self.port = int(printer.get("port") or MQTT_PORT)
+        self.access_code = printer["access_code"]
+        self.cert_path = cert_path
+        self.on_change = on_change
+        self.on_raw = on_raw
+        self.report_topic = f"device/{self.serial}/report"
+        self.request_topic = f"device/{self.serial}/request"
+
+        self.connected = False
+        self._client = None
+        self.state = PrinterState()
+        self.reports_received = 0
+        self._state_cond = threading.Condition()
+        # Gleichzeitige Abrufe warten aufeinander statt jeweils pushall zu schicken
+        self._refresh_lock = threading.Lock()
+
+        # Befehle laufen seriell über die eine Verbindung, Antworten per sequence_id
+        self._commands = queue.Queue()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._connected_event = threading.Event()
+        self._worker = None
+        self._connect_started = None
+
+    def config_key(self):
+        return (self.ip, self.port, self.access_code, self.name, self.cert_path)
+
+    @property
+    def running(self):
+        return self._client is not None
+
+    def start(self):
+        if self._client is not None:
+            return True
+        # Ohne Zertifikat keine Verbindung – wird beim nächsten sync() erneut versucht
+        if not os.path.exists(self.cert_path):
+            return False
+
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        client.username_pw_set(MQTT_USER, self.access_code)
+        client.tls_set_context(client_context(self.cert_path))
+        client.on_pre_connect = self._on_pre_connect
+        client.on_socket_open = self._on_socket_open
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+
+        client.connect_async(self.ip, self.port, 60)
+        client.loop_start()
+        self._client = client
+        self._worker = threading.Thread(target=self._command_worker, daemon=True)
+        self._worker.start()
+        log.info("Verbindung zu %s (%s:%s) gestartet", self.name, self.ip, self.port)
+        return True
+
+    def stop(self):
+        client, self._client = self._client, None
+        if client is None:
+            return
+        self._commands.put(None)
+        try:
+            client.disconnect()
+        finally:
+            client.loop_stop()
+        self.connected = False
+        self._connected_event.clear()
+        log.info("Verbindung zu %s beendet", self.name)
+
+    def request_pushall(self):
+        if self._client is None:
+            return
+        payload = {"pushing": {"sequence_id": "0", "command": "pushall"}}
+        self._client.publish(self.request_topic, json.dumps(payload))
+
+    def send_command(self, section, command, params=None, timeout=COMMAND_TIMEOUT, retries=COMMAND_RETRIES):
+        """Stellt einen Befehl in die Warteschlange und wartet auf die passende Antwort.
+
+        Gibt den Antwort-Abschnitt zurück (z.B. payload["print"]) oder wirft
+        CommandTimeout/CommandError.
+        """
+        return self.wait_command(self.submit_command(section, command, params, timeout, retries))
+
+    def submit_command(self, section, command, params=None, timeout=COMMAND_TIMEOUT, retries=COMMAND_RETRIES):
+        if self._client is None:
+            raise CommandError(f"Keine Verbindung zu {self.name}")
+        payload = {section: {"command": command, **(params or {})}}
+        cmd = PendingCommand(section, command, payload, timeout, retries)
+        # Obergrenze inkl. Wartezeit in der Queue; danach überspringt der Worker den Befehl
+        cmd.deadline = time.monotonic() + (self._commands.qsize() + retries + 1) * timeout
+        self._commands.put(cmd)
+        return cmd
+
+    def wait_command(self, cmd, cancel_event=None):
+        while not cmd.done.is_set():
+            remaining = cmd.deadline - time.monotonic()
+            if remaining <= 0:
+                cmd.cancelled = True
+                raise CommandTimeout(f"Keine Antwort von {self.name} auf {cmd.command}")
+            if cancel_event is not None and cancel_event.is_set():
+                cmd.cancelled = True
+                raise CommandError("Abgebrochen")
+            cmd.done.wait(min(remaining, 0.2) if cancel_event is not None else remaining)
+        if cmd.error is not None:
+            raise cmd.error
+        return cmd.reply
+
+    def _command_worker(self):
+        while True:
+            cmd = self._commands.get()
+            if cmd is None:
+                break
+            if cmd.cancelled:
+                continue
+            with self._pending_lock:
+                self._pending[cmd.key] = cmd
+            try:
+                for attempt in range(cmd.retries + 1):
+                    if not self._connected_event.wait(cmd.timeout):
+                        continue
+                    sent = time.monotonic()
+                    self._client.publish(self.request_topic, cmd.payload)
+                    if cmd.answered.wait(cmd.timeout):
+                        COMMAND_RTT.observe(time.monotonic() - sent, cmd.command)
+                        break
+                    if cmd.cancelled:
+                        break
+                    log.warning("%s #%s an %s ohne Antwort (Versuch %d)",
+                                cmd.command, cmd.sequence_id, self.name, attempt + 1)
+                if not cmd.answered.is_set():
+                    cmd.error = CommandTimeout(f"Keine Antwort von {self.name} auf {cmd.command}")
+            except Exception as e:
+                cmd.error = CommandError(str(e))
+            finally:
+                with self._pending_lock:
+                    self._pending.pop(cmd.key, None)
+                cmd.done.set()
+                if isinstance(cmd.error, CommandTimeout):
+                    COMMANDS.inc(cmd.command, "timeout")
+                else:
+                    COMMANDS.inc(cmd.command, "error" if cmd.error is not None else "ok")
+
+    def _resolve_replies(self, payload):
+        """Ordnet Antworten anhand von command + sequence_id zu, gibt die übrigen Abschnitte zurück."""
+        state_sections = {}
+        for section, body in payload.items():
+            command = body.get("command") if isinstance(body, dict) else None
+            if command is None or command == "push_status":
+                state_sections[section] = body
+                continue
+            with self._pending_lock:
+                cmd = self._pending.get((command, str(body.get("sequence_id"))))
+            if cmd is not None and not cmd.answered.is_set():
+                cmd.reply = body
+                if body.get("result") not in (None, "success", "SUCCESS"):
+                    cmd.error = CommandError(body.get("reason") or body.get("result"))
+                cmd.answered.set()
+        return state_sections
+
+    def get_state(self):
+        """Liefert (zustand, alter_in_sekunden) oder (None, None)."""
+        if self.state.empty:
+            return None, None
+        return self.state.snapshot(), self.state.age()
+
+    def refresh(self, stale_after, timeout, wait_first=True):
+        """Wartet auf den ersten Report bzw. fordert bei veraltetem Zustand einmal pushall an.
+
+        Mit wait_first=False kehrt ein noch leerer Zustand sofort zurück. Liefert
+        True, sobald ein Zustand vorliegt.
+        """
+        with self._refresh_lock:
+            if self.state.restored and not self.connected:
+                # Warmstart: gespeicherten Zustand sofort liefern statt auf die Verbindung zu warten
+                return True
+            if self.state.empty:
+                # Direkt nach dem Start: auf den ersten Report warten
+                if wait_first:
+                    self.wait_for_state(timeout)
+            elif self.state.age() > stale_after:
+                seen = self.reports_received
+                self.request_pushall()
+                self.wait_for_update(seen, timeout)
+            return not self.state.empty
+
+    def read_state(self, stale_after, timeout, wait_first=True):
+        """refresh() plus Snapshot in einem Aufruf: (snapshot_json, alter, wiederhergestellt).
+
+        Ohne Zustand sind snapshot_json und alter None.
+        """
+        if not self.refresh(stale_after, timeout, wait_first):
+            return None, None, self.state.restored
+        return self.state.snapshot_json(), self.state.age(), self.state.restored
+
+    def wait_for_state(self, timeout):
+        return self.wait_for_update(0, timeout)
+
+    def wait_for_update(self, after, timeout):
+        """Wartet, bis mehr als ``after`` Reports empfangen wurden."""
+        with self._state_cond:
+            return self._state_cond.wait_for(lambda: self.reports_received > after, timeout)
+
+    def _on_pre_connect(self, client, userdata):
+        self._connect_started = time.monotonic()
+
+    def _on_socket_open(self, client, userdata, sock):
+        # Socket ist offen und der TLS-Handshake abgeschlossen, CONNECT folgt
+        if self._connect_started is not None:
+            MQTT_HANDSHAKE.observe(time.monotonic() - self._connect_started, self.serial)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if self._connect_started is not None:
+            MQTT_CONNECT.observe(time.monotonic() - self._connect_started, self.serial)
+            self._connect_started = None
+        MQTT_CONNECTS.inc(self.serial, "error" if reason_code.is_failure else "ok")
+        if not reason_code.is_failure:
+            self.connected = True
+            self._connected_event.set()
+            client.subscribe(self.report_topic)
+            # Einmal vollständigen Zustand anfordern, danach kommen die Reports von selbst
+            self.request_pushall()
+        else:
+            log.error("MQTT-Verbindungsfehler %s: %s", self.name, reason_code)
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        self.connected = False
+        self._connected_event.clear()
+        if reason_code != 0:
+            log.warning("Verbindung zu %s verloren (%s), reconnect läuft", self.name, reason_code)
+
+    def _on_message(self, client, userdata, msg):
+        MQTT_MESSAGES.inc(self.serial)
+        MQTT_BYTES.inc(self.serial, amount=len(msg.payload))
+        if self.on_raw:
+            self.on_raw(self, msg.topic, msg.payload)
+        self.feed(msg.payload)
+
+    def feed(self, raw):
+        """Verarbeitet eine Report-Nachricht (bytes) wie vom Drucker empfangen, auch für Replays."""
+        try:
+            payload = json.loads(raw)
+        except Exception as e:
+            log.warning("Ungültige Nachricht von %s: %s", self.name, e)
+            return
+        if not isinstance(payload, dict):
+            return
+        # Befehlsantworten gehören nicht in den Druckerzustand
+        payload = self._resolve_replies(payload)
+        if not payload:
+            return
+        # Reports sind meist Deltas – in den Gesamtzustand einarbeiten statt ersetzen
+        changed = self.state.apply(payload)
+        with self._state_cond:
+            self.reports_received += 1
+            self._state_cond.notify_all()
+        if changed and self.on_change:
+            self.on_change(self, changed)
+
+
+class MqttGateway:
+    """Verwaltet eine PrinterConnection pro konfiguriertem Drucker."""
+
+    def __init__(self, cert_root):
+        self.cert_root = cert_root
+        self._connections = {}
+        self._listeners = []
+        self._raw_listeners = []
+        self._lock = threading.Lock()
+        # Gespeicherte Zustände aus dem Warmstart, bis die Verbindung angelegt wird
+        self._restored = {}
+        registry.gauge("filacore_mqtt_connected", "1, wenn die MQTT-Verbindung zum Drucker steht", ("printer",),
+                       lambda: [((c.serial,), int(c.connected)) for c in self.connections()])
+        registry.gauge("filacore_printer_state_age_seconds", "Sekunden seit dem letzten Report", ("printer",),
+                       lambda: [((c.serial,), round(c.state.age(), 3)) for c in self.connections()
+                                if not c.state.empty])
+
+    def add_listener(self, fn):
+        """fn(conn, delta) wird bei jeder Zustandsänderung aus dem MQTT-Thread aufgerufen."""
+        self._listeners.append(fn)
+
+    def add_raw_listener(self, fn):
+        """fn(conn, topic, payload_bytes) für jede empfangene Nachricht, vor dem Parsen."""
+        self._raw_listeners.append(fn)
+
+    def remove_raw_listener(self, fn):
+        try:
+            self._raw_listeners.remove(fn)
+        except ValueError:
+            pass
+
+    def _notify_raw(self, conn, topic, payload):
+        for fn in list(self._raw_listeners):
+            try:
+                fn(conn, topic, payload)
+            except Exception as e:
+                log.error("Raw-Listener-Fehler für %s: %s", conn.name, e)
+
+    def _notify(self, conn, delta):
+        for fn in self._listeners:
+            try:
+                fn(conn, delta)
+            except Exception as e:
+                log.error("Listener-Fehler für %s: %s", conn.name, e)
+
+    def cert_path(self, printer):
+        return os.path.join(self.cert_root, printer["name"], "blcert.pem")
+
+    def sync(self, printers):
+        """Gleicht die Verbindungen mit der Druckerliste ab (idempotent, billig bei unveränderter Liste)."""
+        wanted = {}
+        for p in printers:
+            if all(p.get(k) for k in ("serial", "name", "ip", "access_code")):
+                wanted[p["serial"]] = p
+
+        with self._lock:
+            for serial in list(self._connections):
+                if serial not in wanted:
+                    self._connections.pop(serial).stop()
+
+            for serial, printer in wanted.items():
+                conn = self._connections.get(serial)
+                candidate = PrinterConnection(printer, self.cert_path(printer), self._notify, self._notify_raw)
+                if conn is not None and conn.config_key() != candidate.config_key():
+                    conn.stop()
+                    conn = None
+                if conn is None:
+                    conn = candidate
+                    self._connections[serial] = conn
+                    saved = self._restored.pop(serial, None)
+                    if saved is not None:
+                        conn.state.restore(saved["state"], saved["updated_at"])
+                if not conn.running:
+                    conn.start()
+
+    def get(self, serial):
+        with self._lock:
+            return self._connections.get(serial)
+
+    def read_state(self, serial, stale_after, timeout, wait_first=True):
+        """PrinterConnection.read_state für serial, None ohne laufende Verbindung."""
+        conn = self.get(serial)
+        if conn is None or not conn.running:
+            return None
+        return conn.read_state(stale_after, timeout, wait_first)
+
+    def restore_states(self, states):
+        """Zuletzt bekannte Zustände ({serial: {"state", "updated_at"}}) vor dem ersten Report bereitstellen."""
+        with self._lock:
+            for serial, saved in states.items():
+                conn = self._connections.get(serial)
+                if conn is not None:
+                    conn.state.restore(saved["state"], saved["updated_at"])
+                else:
+                    self._restored[serial] = saved
+
+    def saved_states(self):
+        """Zustände für den Warmstart-Snapshot, inkl. noch nicht verbundener Drucker."""
+        with self._lock:
+            states = dict(self._restored)
+            conns = list(self._connections.values())
+        for conn in conns:
+            if not conn.state.empty:
+                states[conn.serial] = {"state": conn.state.snapshot(), "updated_at": conn.state.updated_at}
+        return states
+
+    def connections(self):
+        with self._lock:
+            return list(self._connections.values())
+
+    def stop_all(self):
+        with self._lock:
+            conns = list(self._connections.values())
+            self._connections.clear()
+        for conn in conns:
+            conn.stop()
@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+
+from consumption import spool_weight
+
+# gcode_state-Werte, in denen ein Druckauftrag läuft
+ACTIVE_STATES = {"PREPARE", "SLICING", "RUNNING", "PAUSE"}
+# Endzustände -> gespeicherter Status; IDLE während eines Auftrags heißt abgebrochen
+FINAL_STATES = {"FINISH": "finish", "FAILED": "failed", "IDLE": "cancelled"}
+# tray_now-Werte ohne AMS-Tray (externe Spule / nichts geladen)
+NO_TRAY = {254, 255}
+
+log = logging.getLogger("print_history")
+
+
+class PrintHistory:
+    """Erkennt Start und Ende von Druckaufträgen im Report-Stream und speichert sie.
+
+    Beim Start werden die remain-Werte und Spulen-Zuordnungen aller Trays
+    festgehalten; beim Ende ergibt die Differenz Gewicht und Kosten pro
+    benutzter Spule. Läuft beim ersten Report bereits ein Auftrag, wird er ab
+    da mitgeschrieben und als unvollständig markiert.
+    """
+
+    def __init__(self, store, consumption):
+        self.store = store
+        self.consumption = consumption
+        self._lock = threading.Lock()
+        self._running = {}
+        self._seen = set()
+
+    def running(self, serial):
+        with self._lock:
+            job = self._running.get(serial)
+            return _copy_job(job) if job else None
+
+    def on_state_change(self, conn, delta):
+        print_delta = delta.get("print", {})
+        serial = conn.serial
+        with self._lock:
+            job = self._running.get(serial)
+            first = serial not in self._seen
+            self._seen.add(serial)
+            if job is not None:
+                self._observe(job, print_delta)
+
+        if "gcode_state" not in print_delta:
+            return
+        state = str(print_delta["gcode_state"]).upper()
+        if job is None and state in ACTIVE_STATES:
+            self._start(conn, complete=not first)
+        elif job is not None and state in FINAL_STATES:
+            self._finish(conn, job, FINAL_STATES[state])
+
+    def saved_jobs(self):
+        """Laufende Aufträge als JSON-taugliche Dicts für den Warmstart-Snapshot."""
+        with self._lock:
+            jobs = [_copy_job(job) for job in self._running.values()]
+        return {
+            job["serial"]: dict(job, start_trays=[[a, t, entry] for (a, t), entry in job["start_trays"].items()])
+            for job in jobs
+        }
+
+    def restore_jobs(self, jobs):
+        """Nach einem Neustart weiterlaufende Aufträge übernehmen, damit ihr Ende erkannt wird."""
+        with self._lock:
+            for serial, job in jobs.items():
+                if serial in self._running:
+                    continue
+                self._running[serial] = dict(
+                    job,
+                    start_trays={(a, t): entry for a, t, entry in job["start_trays"]},
+                    trays={tuple(key) for key in job["trays"]},
+                )
+
+    def forget(self, serial):
+        with self._lock:
+            self._running.pop(serial, None)
+            self._seen.discard(serial)
+
+    def _start(self, conn, complete):
+        printed = conn.state.get("print", default={})
+        trays = {}
+        for key, tray in _trays(printed):
+            remain = _int(tray.get("remain"))
+            trays[key] = {
+                "remain": remain if remain is not None and remain >= 0 else None,
+                "fcid": self.consumption.assignment(conn.serial, *key),
+                "tray_type": tray.get("tray_type"),
+            }
+        job = {
+            "serial": conn.serial,
+            "name": printed.get("subtask_name") or printed.get("gcode_file") or "",
+            "task_id": printed.get("task_id") or printed.get("job_id"),
+            "started": time.time(),
+            "complete": complete,
+            "start_trays": trays,
+            "trays": set(),
+        }
+        with self._lock:
+            self._observe(job, printed)
+            self._running[conn.serial] = job
+        log.info("Druck auf %s gestartet: %s", conn.serial, job["name"] or "?")
+
+    def _observe(self, job, print_delta):
+        # Nur mit self._lock aufrufen: running() und saved_jobs() lesen dieselben Dicts
+        if print_delta.get("subtask_name"):
+            job["name"] = print_delta["subtask_name"]
+        ams = print_delta.get("ams")
+        if not isinstance(ams, dict):
+            return
+        tray_now = _int(ams.get("tray_now"))
+        if tray_now is not None and tray_now not in NO_TRAY:
+            job["trays"].add((tray_now // 4, tray_now % 4))
+        for key, tray in _trays(print_delta):
+            # Erst später eingelegtes Tray: ab dem ersten bekannten Wert messen
+            start = job["start_trays"].setdefault(key, {"remain": None, "fcid": None, "tray_type": None})
+            remain = _int(tray.get("remain"))
+            if start["remain"] is None and remain is not None and remain >= 0:
+                start["remain"] = remain
+
+    def _finish(self, conn, job, status):
+        with self._lock:
+            self._running.pop(conn.serial, None)
+            job = _copy_job(job)
+        finished = time.time()
+        current = dict(_trays(conn.state.get("print", default={})))
+        spools = []
+        for key, start in job["start_trays"].items():
+            end = _int(current.get(key, {}).get("remain"))
+            used_percent = start["remain"] - end if start["remain"] is not None and end is not None else 0
+            if key not in job["trays"] and used_percent <= 0:
+                continue
+            # Erst während des Drucks zugeordnet: aktuelle Zuordnung verwenden
+            fcid = start["fcid"] or self.consumption.assignment(conn.serial, *key)
+            spools.append(self._spool_usage(key, fcid, start, current.get(key, {}), max(used_percent, 0)))
+
+        record = {
+            "serial": job["serial"],
+            "name": job["name"],
+            "task_id": job["task_id"],
+            "status": status,
+            "started": round(job["started"], 3),
+            "finished": round(finished, 3),
+            "dauer": round(finished - job["started"], 1),
+            "vollstaendig": job["complete"],
+            # Spulen ohne Gewicht (None) zählen nicht mit
+            "gewicht_g": round(sum(s["gewicht_g"] or 0 for s in spools), 1),
+            "kosten": round(sum(s["kosten"] or 0 for s in spools), 2),
+            "spulen": spools,
+        }
+        try:
+            record["id"] = self.store.add_print_job(record)
+        except Exception as e:
+            log.error("Druckauftrag auf %s nicht gespeichert: %s", conn.serial, e)
+            return None
+        log.info("Druck auf %s beendet (%s): %.1f g, %.2f", conn.serial, status, record["gewicht_g"], record["kosten"])
+        return record
+
+    def _spool_usage(self, key, fcid, start, tray, used_percent):
+        spool = self.store.get_spool(fcid) if fcid else None
+        weight = spool_weight(spool or {})
+        # Ohne Spulengewicht sind Gramm und Kosten unbekannt
+        grams = weight * used_percent / 100 if weight is not None else None
+        return {
+            "ams_id": key[0],
+            "tray_id": key[1],
+            "fcid": fcid if spool else None,
+            "material": (spool or {}).get("material") or start["tray_type"] or tray.get("tray_type") or "",
+            "farbe": (spool or {}).get("farbe") or tray.get("tray_color"),
+            "gewicht_g": round(grams, 1) if grams is not None else None,
+            # preis ist pro kg
+            "kosten": round(grams / 1000 * _float((spool or {}).get("preis")), 2) if grams is not None else None,
+        }
+
+
+def _copy_job(job):
+    """Kopie eines laufenden Auftrags, die ohne self._lock gelesen werden kann."""
+    return dict(
+        job,
+        start_trays={key: dict(entry) for key, entry in sorted(job["start_trays"].items())},
+        trays=sorted(job["trays"]),
+    )
+
+
+def _trays(print_section):
+    ams = print_section.get("ams")
+    if not isinstance(ams, dict) or not isinstance(ams.get("ams"), list):
+        return
+    for unit in ams["ams"]:
+        for tray in unit.get("tray") or []:
+            ams_id, tray_id = _int(unit.get("id")), _int(tray.get("id"))
+            if ams_id is not None and tray_id is not None:
+                yield (ams_id, tray_id), tray
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
@@ -0,0 +1,124 @@
+import copy
+import json
+import threading
+import time
+
+
+def _is_keyed_list(value):
+    # Listen wie ams.ams oder ams.ams[].tray: Einträge sind Dicts mit "id"
+    return (
+        isinstance(value, list)
+        and len(value) > 0
+        and all(isinstance(item, dict) and "id" in item for item in value)
+    )
+
+
+def _merge_keyed_list(target, delta):
+    index = {item["id"]: item for item in target}
+    changed = []
+    for item in delta:
+        old = index.get(item["id"])
+        if old is None:
+            new_item = copy.deepcopy(item)
+            target.append(new_item)
+            index[item["id"]] = new_item
+            changed.append(item)
+        elif len(item) == 1:
+            # Nur "id" ohne weitere Felder = Slot ist leer, alte Werte verwerfen
+            if len(old) > 1:
+                old.clear()
+                old["id"] = item["id"]
+                changed.append(item)
+        else:
+            sub = merge_report(old, item)
+            if sub:
+                sub["id"] = item["id"]
+                changed.append(sub)
+    return changed
+
+
+def merge_report(target, delta):
+    """Merged einen (Teil-)Report rekursiv in target.
+
+    Gibt nur die Felder zurück, die sich tatsächlich geändert haben (gleiche
+    Struktur wie der Report, leeres Dict wenn nichts neu war).
+    """
+    changed = {}
+    for key, value in delta.items():
+        old = target.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            sub = merge_report(old, value)
+            if sub:
+                changed[key] = sub
+        elif _is_keyed_list(value) and _is_keyed_list(old):
+            sub = _merge_keyed_list(old, value)
+            if sub:
+                changed[key] = sub
+        elif key not in target or old != value:
+            target[key] = copy.deepcopy(value)
+            changed[key] = value
+    return changed
+
+
+class PrinterState:
+    """Vollständiger Druckerzustand, zusammengesetzt aus pushall + Delta-Reports."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._json = None
+        self.version = 0
+        self.updated_at = None
+        # True, solange der Inhalt nur aus dem Warmstart-Snapshot stammt
+        self.restored = False
+
+    @property
+    def empty(self):
+        return self.updated_at is None
+
+    def apply(self, report):
+        with self._lock:
+            changed = merge_report(self._data, report)
+            self.updated_at = time.time()
+            self.restored = False
+            if changed:
+                self.version += 1
+                self._json = None
+        return changed
+
+    def restore(self, data, updated_at):
+        """Übernimmt einen gespeicherten Zustand, falls noch kein Report da ist; veraltet bis zum ersten Report."""
+        with self._lock:
+            if self.updated_at is not None:
+                return False
+            self._data = copy.deepcopy(data)
+            self.updated_at = updated_at
+            self.restored = True
+            self.version += 1
+            self._json = None
+        return True
+
+    def age(self):
+        if self.updated_at is None:
+            return None
+        return time.time() - self.updated_at
+
+    def snapshot(self):
+        with self._lock:
+            return copy.deepcopy(self._data)
+
+    def snapshot_json(self):
+        # Serialisierung nur einmal pro Version, Lesezugriffe sind dann nur noch ein Lookup
+        with self._lock:
+            if self._json is None:
+                self._json = json.dumps(self._data, ensure_ascii=False)
+            return self._json
+
+    def get(self, *path, default=None):
+        with self._lock:
+            node = self._data
+            for key in path:
+                if not isinstance(node, dict) or key not in node:
+                    return default
+                node = node[key]
+            return copy.deepcopy(node)
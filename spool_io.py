@@ -0,0 +1,142 @@
+import csv
+import gzip
+import io
+import json
+import tempfile
+import uuid
+
+# Pflichtfelder einer Spule (wie im Formular)
+REQUIRED_FIELDS = ["material", "druckprofil", "farbe", "hersteller", "preis", "temp_min", "temp_max"]
+# Feste Spaltenreihenfolge im CSV-Export, weitere Felder folgen alphabetisch
+CSV_FIELDS = [
+    "fcid", "material", "druckprofil", "farbe", "hersteller", "preis", "temp_min", "temp_max",
+    "gewicht", "rest_g", "verbrauch_g", "kosten_verbraucht",
+]
+# Werden für die Verbrauchsrechnung als Zahl gebraucht
+NUMERIC_FIELDS = ["gewicht", "rest_g", "verbrauch_g", "kosten_verbraucht"]
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Geprüfte Import-Zeilen bis zu dieser Größe im Speicher, darüber in einer temporären Datei
+IMPORT_BUFFER_MEMORY = 8 * 1024 * 1024
+
+
+def spool_from_input(data, new=True):
+    """Prüft eine Spule aus Formular/Import und bringt sie in die gespeicherte Form.
+
+    Wirft ValueError mit deutscher Meldung. Ohne fcid wird (bei new=True)
+    eine neue vergeben.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Eintrag muss ein Objekt sein")
+    spool = {k: v for k, v in data.items() if v not in (None, "")}
+    # Formular schickt tempMin/tempMax
+    for alias, field in (("tempMin", "temp_min"), ("tempMax", "temp_max")):
+        if alias in spool:
+            spool.setdefault(field, spool[alias])
+            del spool[alias]
+
+    missing = [f for f in REQUIRED_FIELDS if not spool.get(f)]
+    if missing:
+        raise ValueError(f"Fehlende Felder: {', '.join(missing)}")
+
+    for field in NUMERIC_FIELDS:
+        if field in spool:
+            try:
+                spool[field] = float(spool[field])
+            except (TypeError, ValueError):
+                raise ValueError(f"{field} muss eine Zahl sein")
+    if "gewicht" in spool and "rest_g" not in spool and new:
+        spool["rest_g"] = spool["gewicht"]
+
+    fcid = spool.get("fcid")
+    if not fcid:
+        if not new:
+            raise ValueError("FCID erforderlich")
+        fcid = str(uuid.uuid4())
+    # FCID an erster Stelle
+    return {"fcid": str(fcid), **{k: v for k, v in spool.items() if k != "fcid"}}
+
+
+def detect_format(requested, content_type):
+    if requested:
+        return requested if requested in FORMATS else None
+    if content_type and "csv" in content_type:
+        return "csv"
+    return "ndjson"
+
+
+def text_stream(raw, content_encoding=None):
+    """Binärer Request-Body als Textstrom, gzip-komprimierte Uploads werden beim Lesen entpackt."""
+    if content_encoding == "gzip":
+        raw = gzip.GzipFile(fileobj=raw)
+    return io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+
+def read_records(stream, fmt):
+    """Liest Datensätze einzeln: liefert (zeile, dict) oder (zeile, ValueError)."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f"Ungültiges JSON: {e}")
+
+
+def buffer_import(records, errors, max_errors):
+    """Prüft (zeile, datensatz)-Paare aus read_records und puffert die gültigen Spulen.
+
+    So ist der Request-Body vollständig gelesen, bevor die Schreibtransaktion
+    beginnt. Die ersten max_errors Fehler landen in errors; liefert
+    (puffer, fehlerzahl), den Puffer liest buffered_rows.
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=IMPORT_BUFFER_MEMORY, mode="w+", encoding="utf-8")
+    failed = 0
+    try:
+        for line_no, record in records:
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                spool = spool_from_input(record)
+            except ValueError as e:
+                failed += 1
+                if len(errors) < max_errors:
+                    errors.append({"zeile": line_no, "fcid": record.get("fcid") if isinstance(record, dict) else None,
+                                   "error": str(e)})
+                continue
+            buffer.write(json.dumps([line_no, spool], ensure_ascii=False) + "\n")
+    except BaseException:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer, failed
+
+
+def buffered_rows(buffer):
+    for line in buffer:
+        line_no, spool = json.loads(line)
+        yield line_no, spool
+
+
+def export_ndjson(spools):
+    for spool in spools:
+        yield json.dumps(spool, ensure_ascii=False) + "\n"
+
+
+def export_csv(spools, extra_fields=()):
+    fields = CSV_FIELDS + sorted(f for f in extra_fields if f not in CSV_FIELDS)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    for spool in spools:
+        writer.writerow(spool)
+        # Puffer nach jeder Zeile leeren, der Speicherbedarf bleibt konstant
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
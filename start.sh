@@ -1,5 +1,15 @@
 #!/bin/bash
-python3 -m venv venv
+# venv nur beim ersten Start anlegen, Pakete nur nach einer Änderung der requirements.txt installieren
+if [ ! -x venv/bin/python ]; then
+    python3 -m venv venv
+fi
 source venv/bin/activate
-pip install -r requirements.txt
-python app.py
+REQUIREMENTS_HASH=$(sha256sum requirements.txt | cut -d' ' -f1)
+if [ "$(cat venv/.requirements.sha256 2>/dev/null)" != "$REQUIREMENTS_HASH" ]; then
+    pip install -r requirements.txt && echo "$REQUIREMENTS_HASH" > venv/.requirements.sha256
+fi
+# FILACORE_WORKERS > 1: mehrere Worker mit gemeinsamem Gateway-Prozess statt Entwicklungsserver
+if [ "${FILACORE_WORKERS:-1}" -gt 1 ]; then
+    exec gunicorn -c gunicorn.conf.py app:app
+fi
+exec python app.py
@@ -0,0 +1,89 @@
+import json
+import queue
+import threading
+
+SSE_KEEPALIVE = 15
+SUBSCRIBER_QUEUE_SIZE = 200
+
+
+class Subscriber:
+    def __init__(self, serial):
+        self.serial = serial
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Wird gesetzt, wenn der Client zu langsam war und Deltas verworfen wurden
+        self.resync = False
+
+
+class StateBroadcaster:
+    """Verteilt Zustandsänderungen aus dem MQTT-Gateway an alle offenen Streams.
+
+    Pro Drucker gibt es nur die eine Gateway-Verbindung, egal wie viele
+    Browser-Tabs zuschauen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self, serial):
+        sub = Subscriber(serial)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, serial, delta, version):
+        event = {"serial": serial, "version": version, "delta": delta}
+        with self._lock:
+            subs = [s for s in self._subscribers if s.serial == serial]
+        for sub in subs:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                # Rückstau verwerfen, der Client bekommt stattdessen einen frischen Snapshot
+                with sub.queue.mutex:
+                    sub.queue.queue.clear()
+                sub.resync = True
+                sub.queue.put_nowait(None)
+
+    def on_state_change(self, conn, delta):
+        self.publish(conn.serial, delta, conn.state.version)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_state(broadcaster, conn):
+    """Generator für text/event-stream: erst ein Snapshot, danach nur noch Deltas."""
+    sub = broadcaster.subscribe(conn.serial)
+    try:
+        yield "retry: 5000\n\n"
+        if not conn.state.empty:
+            yield _snapshot_event(conn)
+        while True:
+            try:
+                event = sub.queue.get(timeout=SSE_KEEPALIVE)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if sub.resync or event is None:
+                sub.resync = False
+                yield _snapshot_event(conn)
+                continue
+            yield sse_event("delta", event)
+    finally:
+        broadcaster.unsubscribe(sub)
+
+
+def _snapshot_event(conn):
+    return "event: snapshot\ndata: {\"serial\": %s, \"version\": %d, \"stale\": %s, \"data\": %s}\n\n" % (
+        json.dumps(conn.serial), conn.state.version, "true" if conn.state.restored else "false",
+        conn.state.snapshot_json())
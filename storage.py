@@ -0,0 +1,676 @@
+import base64
+import json
+import logging
+import fcntl
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+DB_FILE = os.environ.get("FILACORE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "filacore.db"))
+
+SCHEMA_VERSION = 5
+# Datensätze pro executemany beim Import bzw. pro fetchmany beim Export
+BATCH_SIZE = 500
+
+# Tabellen mit Schreibzähler (store.versions), an denen Caches ihre Gültigkeit prüfen
+VERSIONED_TABLES = ("spools", "printers", "print_jobs")
+
+log = logging.getLogger("storage")
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS spools (
+        fcid TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS printers (
+        serial TEXT PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        active INTEGER NOT NULL DEFAULT 0,
+        data TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_printers_active ON printers(active) WHERE active = 1",
+    """CREATE TABLE IF NOT EXISTS tray_assignments (
+        serial TEXT NOT NULL,
+        ams_id INTEGER NOT NULL,
+        tray_id INTEGER NOT NULL,
+        fcid TEXT NOT NULL,
+        assigned_at REAL NOT NULL,
+        PRIMARY KEY (serial, ams_id, tray_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_tray_assignments_fcid ON tray_assignments(fcid)",
+    """CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS print_jobs (
+        id INTEGER PRIMARY KEY,
+        serial TEXT NOT NULL,
+        finished REAL NOT NULL,
+        data TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_print_jobs_serial ON print_jobs(serial, id)",
+    # Laufende Summen pro Tag (lokales Datum des Endes) und Drucker bzw. zusätzlich pro Material,
+    # beim Speichern eines Auftrags in derselben Transaktion fortgeschrieben
+    """CREATE TABLE IF NOT EXISTS print_job_totals (
+        tag TEXT NOT NULL,
+        serial TEXT NOT NULL,
+        auftraege INTEGER NOT NULL DEFAULT 0,
+        erfolgreich INTEGER NOT NULL DEFAULT 0,
+        dauer REAL NOT NULL DEFAULT 0,
+        gewicht_g REAL NOT NULL DEFAULT 0,
+        kosten REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (tag, serial)
+    )""",
+    """CREATE TABLE IF NOT EXISTS print_job_material_totals (
+        tag TEXT NOT NULL,
+        serial TEXT NOT NULL,
+        material TEXT NOT NULL COLLATE NOCASE,
+        auftraege INTEGER NOT NULL DEFAULT 0,
+        gewicht_g REAL NOT NULL DEFAULT 0,
+        kosten REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (tag, serial, material)
+    )""",
+    # Ergebnisse der G-Code-Analyse, Schlüssel ist der SHA-256 der Datei (plus Platte bei 3MF)
+    """CREATE TABLE IF NOT EXISTS gcode_analyses (
+        key TEXT PRIMARY KEY,
+        created REAL NOT NULL,
+        data TEXT NOT NULL
+    )""",
+]
+
+
+# Aus dem JSON abgeleitete Spalten für Filter, Sortierung und Suche; bei jedem Schreiben mitgesetzt
+SPOOL_COLUMNS = {
+    "material": "TEXT NOT NULL DEFAULT '' COLLATE NOCASE",
+    "hersteller": "TEXT NOT NULL DEFAULT '' COLLATE NOCASE",
+    "druckprofil": "TEXT NOT NULL DEFAULT '' COLLATE NOCASE",
+    "temp_min": "REAL NOT NULL DEFAULT 0",
+    "temp_max": "REAL NOT NULL DEFAULT 0",
+    "preis": "REAL NOT NULL DEFAULT 0",
+    "suchtext": "TEXT NOT NULL DEFAULT ''",
+}
+SPOOL_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS idx_spools_{column} ON spools({column})"
+    for column in ("material", "hersteller", "druckprofil", "temp_min", "temp_max", "preis")
+]
+# Volltextindex über suchtext, Trigger halten ihn bei jedem Schreiben aktuell
+SPOOL_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS spools_fts USING fts5("
+    "suchtext, content='spools', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER IF NOT EXISTS spools_fts_insert AFTER INSERT ON spools BEGIN
+        INSERT INTO spools_fts(rowid, suchtext) VALUES (new.rowid, new.suchtext);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS spools_fts_delete AFTER DELETE ON spools BEGIN
+        INSERT INTO spools_fts(spools_fts, rowid, suchtext) VALUES ('delete', old.rowid, old.suchtext);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS spools_fts_update AFTER UPDATE OF suchtext ON spools BEGIN
+        INSERT INTO spools_fts(spools_fts, rowid, suchtext) VALUES ('delete', old.rowid, old.suchtext);
+        INSERT INTO spools_fts(rowid, suchtext) VALUES (new.rowid, new.suchtext);
+    END""",
+]
+SEARCH_FIELDS = ("fcid", "material", "hersteller", "druckprofil", "farbe", "name", "notiz")
+# Sortierbare Felder -> Spalte; "erstellt" ist die Einfügereihenfolge
+SPOOL_SORT = {
+    "erstellt": "rowid", "material": "material", "hersteller": "hersteller", "druckprofil": "druckprofil",
+    "temp_min": "temp_min", "temp_max": "temp_max", "preis": "preis",
+}
+
+# Gruppierungen der Auftragsstatistik -> (Tabelle, Spalte)
+PRINT_JOB_GROUPS = {
+    "tag": ("print_job_totals", "tag"),
+    "serial": ("print_job_totals", "serial"),
+    "material": ("print_job_material_totals", "material"),
+}
+PRINT_JOB_TOTALS_UPSERT = """INSERT INTO print_job_totals (tag, serial, auftraege, erfolgreich, dauer, gewicht_g, kosten)
+    VALUES (?, ?, 1, ?, ?, ?, ?)
+    ON CONFLICT (tag, serial) DO UPDATE SET
+        auftraege = auftraege + 1, erfolgreich = erfolgreich + excluded.erfolgreich,
+        dauer = dauer + excluded.dauer, gewicht_g = gewicht_g + excluded.gewicht_g, kosten = kosten + excluded.kosten"""
+PRINT_JOB_MATERIAL_UPSERT = """INSERT INTO print_job_material_totals (tag, serial, material, auftraege, gewicht_g, kosten)
+    VALUES (?, ?, ?, 1, ?, ?)
+    ON CONFLICT (tag, serial, material) DO UPDATE SET
+        auftraege = auftraege + 1, gewicht_g = gewicht_g + excluded.gewicht_g, kosten = kosten + excluded.kosten"""
+
+SPOOL_INSERT = "INSERT INTO spools (fcid, data, {}) VALUES ({})".format(
+    ", ".join(SPOOL_COLUMNS), ", ".join("?" * (len(SPOOL_COLUMNS) + 2)))
+SPOOL_UPDATE = "UPDATE spools SET data = ?, {} WHERE fcid = ?".format(
+    ", ".join(f"{c} = ?" for c in SPOOL_COLUMNS))
+
+
+class DuplicateError(Exception):
+    pass
+
+
+class TableVersions:
+    """Schreibzähler pro Tabelle, lesbar wie ein dict (versions["spools"]).
+
+    Mit path liegen die Zähler in einer per mmap eingeblendeten Datei, damit
+    Worker-Prozesse und Gateway die Schreibzugriffe der anderen sehen; Lesen
+    ist dann nur ein Speicherzugriff, Hochzählen läuft unter flock.
+    """
+
+    def __init__(self, path=None, tables=VERSIONED_TABLES):
+        self._offsets = {name: 8 * i for i, name in enumerate(tables)}
+        self._lock = threading.Lock()
+        self._file = None
+        size = 8 * len(tables)
+        if path is None:
+            self._buf = bytearray(size)
+            return
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._file = os.fdopen(fd, "r+b")
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._buf = mmap.mmap(fd, size)
+
+    def __getitem__(self, table):
+        return struct.unpack_from("<Q", self._buf, self._offsets[table])[0]
+
+    def bump(self, table):
+        offset = self._offsets[table]
+        with self._lock:
+            if self._file is None:
+                struct.pack_into("<Q", self._buf, offset, struct.unpack_from("<Q", self._buf, offset)[0] + 1)
+                return
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                struct.pack_into("<Q", self._buf, offset, struct.unpack_from("<Q", self._buf, offset)[0] + 1)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+
+class Store:
+    """SQLite-Speicher (WAL) für Spulen und Drucker.
+
+    Jeder Thread bekommt seine eigene Verbindung; Leser blockieren im WAL-Modus
+    keine Schreiber und Schreibzugriffe sind einzelne atomare Transaktionen
+    statt kompletter Datei-Rewrites.
+    """
+
+    def __init__(self, path=DB_FILE, shared_versions=False):
+        self.path = path
+        self._local = threading.local()
+        # Schreibzähler pro Tabelle, damit Caches wissen, wann sie veraltet sind;
+        # shared_versions, wenn mehrere Prozesse dieselbe Datenbank schreiben
+        self.versions = TableVersions(path + "-versions" if shared_versions else None)
+        self._migrate()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self):
+        conn = self._conn()
+        with conn:
+            for stmt in SCHEMA:
+                conn.execute(stmt)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            existing = {r["name"] for r in conn.execute("PRAGMA table_info(spools)")}
+            for column, decl in SPOOL_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE spools ADD COLUMN {column} {decl}")
+            for stmt in SPOOL_INDEXES:
+                conn.execute(stmt)
+            if version < 3:
+                # Spalten für vorhandene Spulen einmalig aus dem JSON füllen
+                rows = conn.execute("SELECT fcid, data FROM spools").fetchall()
+                conn.executemany(SPOOL_UPDATE, [_update_params(json.loads(r["data"])) for r in rows])
+            self.fts = self._create_fts(conn)
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def _create_fts(self, conn):
+        """Legt den Volltextindex an; ohne FTS5 fällt die Suche auf LIKE zurück."""
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'spools_fts'").fetchone() is not None
+        try:
+            for stmt in SPOOL_FTS:
+                conn.execute(stmt)
+        except sqlite3.OperationalError as e:
+            log.warning("Volltextsuche nicht verfügbar (%s), Suche ohne Index", e)
+            return False
+        if not exists:
+            conn.execute("INSERT INTO spools_fts(spools_fts) VALUES ('rebuild')")
+        return True
+
+    def _bump(self, table):
+        self.versions.bump(table)
+
+    def _meta(self, key):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def import_json(self, spools_file, printers_file):
+        """Einmalige Übernahme der alten JSON-Dateien (filacore_spools.json / printers.json)."""
+        conn = self._conn()
+        if self._meta("json_imported"):
+            return
+        spools = _read_json(spools_file)
+        printers = _read_json(printers_file)
+        with conn:
+            conn.executemany(
+                SPOOL_INSERT.replace("INSERT", "INSERT OR IGNORE", 1),
+                [_insert_params(s) for s in spools if s.get("fcid")],
+            )
+            for p in printers:
+                if not p.get("serial") or not p.get("name"):
+                    continue
+                conn.execute(
+                    "INSERT OR IGNORE INTO printers (serial, name, active, data) VALUES (?, ?, ?, ?)",
+                    (p["serial"], p["name"], 1 if p.get("active") else 0, _printer_data(p)),
+                )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', '1')")
+        self._bump("spools")
+        self._bump("printers")
+        log.info("%d Spulen und %d Drucker aus JSON übernommen", len(spools), len(printers))
+
+    # --- Spulen -----------------------------------------------------------
+
+    def list_spools(self):
+        rows = self._conn().execute("SELECT data FROM spools ORDER BY rowid").fetchall()
+        return [json.loads(r["data"]) for r in rows]
+
+    def get_spool(self, fcid):
+        row = self._conn().execute("SELECT data FROM spools WHERE fcid = ?", (fcid,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def add_spool(self, spool):
+        try:
+            with self._conn() as conn:
+                conn.execute(SPOOL_INSERT, _insert_params(spool))
+        except sqlite3.IntegrityError:
+            raise DuplicateError(f"FCID {spool['fcid']} existiert bereits")
+        self._bump("spools")
+
+    def update_spool(self, fcid, fields):
+        """Übernimmt einzelne Felder in eine Spule, gibt die neue Spule oder None zurück."""
+        with self._conn() as conn:
+            row = conn.execute("SELECT data FROM spools WHERE fcid = ?", (fcid,)).fetchone()
+            if row is None:
+                return None
+            spool = json.loads(row["data"])
+            spool.update(fields)
+            conn.execute(SPOOL_UPDATE, _update_params(spool))
+        self._bump("spools")
+        return spool
+
+    def update_spools(self, updates):
+        """Wie update_spool für mehrere Spulen ({fcid: felder}) in einer Transaktion."""
+        if not updates:
+            return
+        changed = 0
+        with self._conn() as conn:
+            for fcid, fields in updates.items():
+                row = conn.execute("SELECT data FROM spools WHERE fcid = ?", (fcid,)).fetchone()
+                if row is None:
+                    continue
+                spool = json.loads(row["data"])
+                spool.update(fields)
+                changed += conn.execute(SPOOL_UPDATE, _update_params(spool)).rowcount
+        # Nur bei echten Änderungen, sonst verwerfen die Caches grundlos ihren Stand
+        if changed:
+            self._bump("spools")
+
+    def query_spools(self, filters=None, search=None, temp=None, temp_min=None, temp_max=None,
+                     sort="erstellt", desc=False, limit=50, cursor=None):
+        """Gefilterte, sortierte Seite von Spulen über die indizierten Spalten.
+
+        filters: {"material"|"hersteller"|"druckprofil": [werte]} (ohne Groß-/Kleinschreibung),
+        temp: Spule muss diese Düsentemperatur abdecken, temp_min/temp_max: Grenzen
+        des Spulenbereichs, search: Wortanfänge aus FCID, Material, Hersteller, Profil, Farbe.
+        Liefert {"items", "total", "next_cursor"}; cursor ist der next_cursor der
+        vorigen Seite. Wirft ValueError bei ungültigem Sortierfeld oder Cursor.
+        """
+        column = SPOOL_SORT.get(sort)
+        if column is None:
+            raise ValueError(f"Sortierung nach {sort} nicht möglich")
+        where, params = [], []
+        for field, values in (filters or {}).items():
+            if field not in ("material", "hersteller", "druckprofil") or not values:
+                continue
+            where.append(f"{field} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        if temp is not None:
+            where.append("temp_min <= ? AND temp_max >= ?")
+            params.extend([temp, temp])
+        if temp_min is not None:
+            where.append("temp_min >= ?")
+            params.append(temp_min)
+        if temp_max is not None:
+            where.append("temp_max <= ?")
+            params.append(temp_max)
+        terms = (search or "").lower().split()
+        if terms and self.fts:
+            where.append("rowid IN (SELECT rowid FROM spools_fts WHERE spools_fts MATCH ?)")
+            params.append(" ".join('"{}"*'.format(t.replace('"', '""')) for t in terms))
+        else:
+            for term in terms:
+                where.append("suchtext LIKE ? ESCAPE '\\'")
+                params.append("%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+
+        conn = self._conn()
+        condition = " AND ".join(where) or "1"
+        total = conn.execute(f"SELECT COUNT(*) FROM spools WHERE {condition}", params).fetchone()[0]
+
+        order = "DESC" if desc else "ASC"
+        if cursor:
+            value, rowid = _decode_cursor(cursor)
+            op = "<" if desc else ">"
+            if column == "rowid":
+                condition += f" AND rowid {op} ?"
+                params = params + [rowid]
+            else:
+                # Keyset statt OFFSET: die nächste Seite beginnt direkt im Index
+                condition += f" AND ({column}, rowid) {op} (?, ?)"
+                params = params + [value, rowid]
+        rows = conn.execute(
+            f"SELECT rowid AS rid, {column} AS sortwert, data FROM spools WHERE {condition} "
+            f"ORDER BY {column} {order}{'' if column == 'rowid' else f', rowid {order}'} LIMIT ?",
+            params + [limit + 1],
+        ).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1]["sortwert"], rows[-1]["rid"])
+        return {"items": [json.loads(r["data"]) for r in rows], "total": total, "next_cursor": next_cursor}
+
+    def iter_spools(self, batch_size=BATCH_SIZE):
+        """Alle Spulen als Generator, es liegen höchstens batch_size Zeilen gleichzeitig im Speicher."""
+        cursor = self._conn().execute("SELECT data FROM spools ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for r in rows:
+                yield json.loads(r["data"])
+
+    def spool_fields(self):
+        """Alle vorkommenden Feldnamen, ermittelt in SQLite statt durch Laden aller Spulen."""
+        try:
+            rows = self._conn().execute(
+                "SELECT DISTINCT j.key FROM spools, json_each(spools.data) AS j").fetchall()
+        except sqlite3.OperationalError:  # SQLite ohne JSON1
+            return []
+        return [r[0] for r in rows]
+
+    def import_spools(self, rows, replace=False, dry_run=False, batch_size=BATCH_SIZE, max_errors=None):
+        """Schreibt (ref, spule)-Paare blockweise in einer Transaktion.
+
+        Die Schreibsperre hält, solange rows läuft: rows sollte schon vollständig
+        vorliegen (z.B. spool_io.buffer_import), nicht erst aus dem Netz kommen.
+        Vorhandene FCIDs werden mit replace=True überschrieben, sonst als Fehler
+        gemeldet. dry_run prüft nur, ohne Schreibtransaktion.
+        Liefert {"importiert", "aktualisiert", "fehlerhaft", "fehler": [{zeile, fcid, error}]}
+        mit höchstens max_errors Einträgen in fehler.
+        """
+        conn = self._conn()
+        result = {"importiert": 0, "aktualisiert": 0, "fehlerhaft": 0, "fehler": []}
+        # FCIDs aus früheren Blöcken; beim Probelauf stehen sie nicht in der Tabelle
+        seen = set()
+        batch = []
+        try:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self._import_batch(conn, batch, replace, not dry_run, seen, result, max_errors)
+                    batch = []
+            if batch:
+                self._import_batch(conn, batch, replace, not dry_run, seen, result, max_errors)
+        except BaseException:
+            conn.rollback()
+            raise
+        if not dry_run:
+            conn.commit()
+            if result["importiert"] or result["aktualisiert"]:
+                self._bump("spools")
+        return result
+
+    def _import_batch(self, conn, batch, replace, write, seen, result, max_errors):
+        fcids = [spool["fcid"] for _, spool in batch]
+        placeholders = ",".join("?" * len(fcids))
+        existing = {r[0] for r in conn.execute(f"SELECT fcid FROM spools WHERE fcid IN ({placeholders})", fcids)}
+        inserts, updates = [], []
+        for ref, spool in batch:
+            fcid = spool["fcid"]
+            if fcid in existing or fcid in seen:
+                if not replace:
+                    result["fehlerhaft"] += 1
+                    if max_errors is None or len(result["fehler"]) < max_errors:
+                        result["fehler"].append({"zeile": ref, "fcid": fcid, "error": f"FCID {fcid} existiert bereits"})
+                    continue
+                updates.append(spool)
+            else:
+                inserts.append(spool)
+            seen.add(fcid)
+        if write:
+            conn.executemany(SPOOL_INSERT, [_insert_params(spool) for spool in inserts])
+            conn.executemany(SPOOL_UPDATE, [_update_params(spool) for spool in updates])
+        result["importiert"] += len(inserts)
+        result["aktualisiert"] += len(updates)
+
+    def delete_spool(self, fcid):
+        with self._conn() as conn:
+            deleted = conn.execute("DELETE FROM spools WHERE fcid = ?", (fcid,)).rowcount > 0
+            conn.execute("DELETE FROM tray_assignments WHERE fcid = ?", (fcid,))
+        if deleted:
+            self._bump("spools")
+        return deleted
+
+    # --- Drucker ----------------------------------------------------------
+
+    def list_printers(self):
+        rows = self._conn().execute("SELECT active, data FROM printers ORDER BY rowid").fetchall()
+        return [_printer_row(r) for r in rows]
+
+    def get_printer(self, serial):
+        row = self._conn().execute("SELECT active, data FROM printers WHERE serial = ?", (serial,)).fetchone()
+        return _printer_row(row) if row else None
+
+    def get_printer_by_name(self, name):
+        row = self._conn().execute("SELECT active, data FROM printers WHERE name = ?", (name,)).fetchone()
+        return _printer_row(row) if row else None
+
+    def active_printer(self):
+        row = self._conn().execute("SELECT active, data FROM printers WHERE active = 1 LIMIT 1").fetchone()
+        return _printer_row(row) if row else None
+
+    def add_printer(self, printer):
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    "INSERT INTO printers (serial, name, active, data) VALUES (?, ?, ?, ?)",
+                    (printer["serial"], printer["name"], 1 if printer.get("active") else 0,
+                     _printer_data(printer)),
+                )
+        except sqlite3.IntegrityError as e:
+            if "name" in str(e):
+                raise DuplicateError("Name wird bereits verwendet")
+            raise DuplicateError("Drucker mit dieser Serial existiert bereits")
+        self._bump("printers")
+
+    def delete_printer(self, serial):
+        with self._conn() as conn:
+            deleted = conn.execute("DELETE FROM printers WHERE serial = ?", (serial,)).rowcount > 0
+            conn.execute("DELETE FROM tray_assignments WHERE serial = ?", (serial,))
+        if deleted:
+            self._bump("printers")
+        return deleted
+
+    def set_active_printer(self, serial):
+        """Setzt genau einen Drucker aktiv (eine Transaktion), gibt ihn zurück oder None."""
+        with self._conn() as conn:
+            if conn.execute("SELECT 1 FROM printers WHERE serial = ?", (serial,)).fetchone() is None:
+                return None
+            conn.execute("UPDATE printers SET active = (serial = ?)", (serial,))
+        self._bump("printers")
+        return self.get_printer(serial)
+
+    # --- AMS-Slot-Zuordnung ----------------------------------------------
+
+    def assign_tray(self, serial, ams_id, tray_id, fcid):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tray_assignments (serial, ams_id, tray_id, fcid, assigned_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (serial, ams_id, tray_id, fcid, time.time()),
+            )
+
+    def tray_assignments(self, serial=None):
+        sql = "SELECT serial, ams_id, tray_id, fcid, assigned_at FROM tray_assignments"
+        params = ()
+        if serial is not None:
+            sql += " WHERE serial = ?"
+            params = (serial,)
+        return [dict(r) for r in self._conn().execute(sql + " ORDER BY serial, ams_id, tray_id", params)]
+
+    # --- Druckaufträge --------------------------------------------------
+
+    def add_print_job(self, job):
+        """Speichert einen beendeten Auftrag und schreibt die Tagessummen fort; liefert die id."""
+        day = time.strftime("%Y-%m-%d", time.localtime(job["finished"]))
+        materials = {}
+        for spool in job.get("spulen", []):
+            total = materials.setdefault(spool.get("material") or "", [0.0, 0.0])
+            total[0] += spool.get("gewicht_g") or 0
+            total[1] += spool.get("kosten") or 0
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "INSERT INTO print_jobs (serial, finished, data) VALUES (?, ?, ?)",
+                (job["serial"], job["finished"], json.dumps(job, ensure_ascii=False)),
+            )
+            conn.execute(PRINT_JOB_TOTALS_UPSERT, (
+                day, job["serial"], int(job["status"] == "finish"), job.get("dauer") or 0,
+                job.get("gewicht_g") or 0, job.get("kosten") or 0,
+            ))
+            conn.executemany(PRINT_JOB_MATERIAL_UPSERT, [
+                (day, job["serial"], material, grams, cost) for material, (grams, cost) in materials.items()
+            ])
+        self._bump("print_jobs")
+        return cursor.lastrowid
+
+    def list_print_jobs(self, serial=None, limit=50, cursor=None):
+        """Neueste Aufträge zuerst; cursor ist die next_cursor-Angabe der vorigen Seite (id)."""
+        where, params = [], []
+        if serial:
+            where.append("serial = ?")
+            params.append(serial)
+        if cursor is not None:
+            try:
+                where.append("id < ?")
+                params.append(int(cursor))
+            except (TypeError, ValueError):
+                raise ValueError("Ungültiger Cursor")
+        sql = "SELECT id, data FROM print_jobs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self._conn().execute(sql + " ORDER BY id DESC LIMIT ?", params + [limit + 1]).fetchall()
+        items = [dict(json.loads(r["data"]), id=r["id"]) for r in rows[:limit]]
+        return {"items": items, "next_cursor": str(items[-1]["id"]) if len(rows) > limit else None}
+
+    def print_job_stats(self, group="tag", serial=None, since=None, until=None):
+        """Summen aus den vorberechneten Tabellen, gruppiert nach tag, serial oder material.
+
+        since/until sind Tage im Format JJJJ-MM-TT (einschließlich).
+        """
+        if group not in PRINT_JOB_GROUPS:
+            raise ValueError(f"Unbekannte Gruppierung: {group}")
+        table, column = PRINT_JOB_GROUPS[group]
+        sums = "SUM(auftraege) AS auftraege, SUM(gewicht_g) AS gewicht_g, SUM(kosten) AS kosten"
+        if table == "print_job_totals":
+            sums += ", SUM(erfolgreich) AS erfolgreich, SUM(dauer) AS dauer"
+        where, params = [], []
+        for condition, value in (("serial = ?", serial), ("tag >= ?", since), ("tag <= ?", until)):
+            if value:
+                where.append(condition)
+                params.append(value)
+        sql = f"SELECT {column} AS gruppe, {sums} FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" GROUP BY {column} ORDER BY {column}"
+        result = []
+        for row in self._conn().execute(sql, params):
+            entry = dict(row)
+            entry["gewicht_g"] = round(entry["gewicht_g"], 1)
+            entry["kosten"] = round(entry["kosten"], 2)
+            if "dauer" in entry:
+                entry["dauer"] = round(entry["dauer"], 1)
+            result.append(entry)
+        return result
+
+    # --- G-Code-Analysen ----------------------------------------------------
+
+    def get_gcode_analysis(self, key):
+        row = self._conn().execute("SELECT data FROM gcode_analyses WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def save_gcode_analysis(self, key, analysis):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO gcode_analyses (key, created, data) VALUES (?, ?, ?)",
+                (key, time.time(), json.dumps(analysis, ensure_ascii=False)),
+            )
+
+
+def _read_json(path):
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f) or []
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _spool_columns(spool):
+    return (
+        str(spool.get("material") or ""),
+        str(spool.get("hersteller") or ""),
+        str(spool.get("druckprofil") or ""),
+        _number(spool.get("temp_min", spool.get("tempMin"))),
+        _number(spool.get("temp_max", spool.get("tempMax"))),
+        _number(spool.get("preis")),
+        " ".join(str(spool[k]) for k in SEARCH_FIELDS if spool.get(k)).lower(),
+    )
+
+
+def _insert_params(spool):
+    return (spool["fcid"], json.dumps(spool, ensure_ascii=False)) + _spool_columns(spool)
+
+
+def _update_params(spool):
+    return (json.dumps(spool, ensure_ascii=False),) + _spool_columns(spool) + (spool["fcid"],)
+
+
+def _encode_cursor(value, rowid):
+    return base64.urlsafe_b64encode(json.dumps([value, rowid]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    try:
+        value, rowid = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return value, int(rowid)
+    except (ValueError, TypeError):
+        raise ValueError("Ungültiger Cursor")
+
+
+def _printer_data(printer):
+    data = {k: v for k, v in printer.items() if k != "active"}
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _printer_row(row):
+    printer = json.loads(row["data"])
+    printer["active"] = bool(row["active"])
+    return printer
@@ -0,0 +1,294 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+TELEMETRY_DIR = os.environ.get(
+    "FILACORE_TELEMETRY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "telemetry"))
+RING_SIZE = int(os.environ.get("FILACORE_TELEMETRY_RING", "3600"))
+RETENTION_DAYS = int(os.environ.get("FILACORE_TELEMETRY_DAYS", "30"))
+FLUSH_INTERVAL = 30
+FLUSH_THRESHOLD = 512
+
+log = logging.getLogger("telemetry")
+
+# Ein Datensatz auf Platte: uint32 Unix-Sekunden + float32 Wert = 8 Byte
+RECORD = struct.Struct("<If")
+
+# Werte aus dem print-Abschnitt, die aufgezeichnet werden
+PRINT_METRICS = {
+    "nozzle_temper": "nozzle_temper",
+    "bed_temper": "bed_temper",
+    "chamber_temper": "chamber_temper",
+    "mc_percent": "progress",
+    "progress": "progress",
+}
+
+
+class RingBuffer:
+    """Feste Anzahl Samples in zwei double-Arrays, ohne Allokation pro Sample."""
+
+    def __init__(self, size):
+        self.size = size
+        self.ts = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.head = 0
+        self.count = 0
+
+    def append(self, ts, value):
+        """Fügt ein Sample hinzu, gibt das verdrängte älteste Sample zurück (oder None)."""
+        evicted = None
+        if self.count == self.size:
+            evicted = (self.ts[self.head], self.values[self.head])
+        else:
+            self.count += 1
+        self.ts[self.head] = ts
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        return evicted
+
+    def samples(self):
+        start = (self.head - self.count) % self.size
+        for i in range(self.count):
+            j = (start + i) % self.size
+            yield self.ts[j], self.values[j]
+
+
+class Series:
+    def __init__(self, directory, metric):
+        self.directory = directory
+        self.metric = metric
+        self.ring = RingBuffer(RING_SIZE)
+        # Aus dem Ring verdrängt, aber noch nicht auf Platte
+        self.pending_ts = array("d")
+        self.pending_values = array("d")
+
+    def append(self, ts, value):
+        evicted = self.ring.append(ts, value)
+        if evicted is not None:
+            self.pending_ts.append(evicted[0])
+            self.pending_values.append(evicted[1])
+
+    def flush(self):
+        if not self.pending_ts:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        chunks = {}
+        for ts, value in zip(self.pending_ts, self.pending_values):
+            chunks.setdefault(_day(ts), bytearray()).extend(RECORD.pack(int(ts), value))
+        for day, data in chunks.items():
+            with open(self._path(day), "ab") as f:
+                f.write(data)
+        self.pending_ts = array("d")
+        self.pending_values = array("d")
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"{self.metric}-{day}.bin")
+
+    def disk_samples(self, start, end):
+        if not os.path.isdir(self.directory):
+            return
+        prefix = f"{self.metric}-"
+        days = sorted(
+            name[len(prefix):-4] for name in os.listdir(self.directory)
+            if name.startswith(prefix) and name.endswith(".bin")
+        )
+        for day in days:
+            if day < _day(start) or day > _day(end):
+                continue
+            yield from _read_range(self._path(day), start, end)
+
+    def memory_samples(self, start, end):
+        samples = [(ts, v) for ts, v in zip(self.pending_ts, self.pending_values) if start <= ts <= end]
+        samples.extend((ts, v) for ts, v in self.ring.samples() if start <= ts <= end)
+        return samples
+
+    def flush_ring(self):
+        # Nur beim Beenden: alles, was noch im Speicher liegt, auf Platte bringen
+        for ts, value in self.ring.samples():
+            self.pending_ts.append(ts)
+            self.pending_values.append(value)
+        self.ring = RingBuffer(RING_SIZE)
+        self.flush()
+
+
+class TelemetryRecorder:
+    """Zeichnet Temperaturen, Fortschritt und AMS-Feuchte aus dem MQTT-Stream auf."""
+
+    def __init__(self, root=TELEMETRY_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._series = {}
+        self._flusher = None
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def on_state_change(self, conn, delta):
+        self.record(conn.serial, extract_metrics(delta))
+
+    def record(self, serial, metrics, ts=None):
+        if not metrics:
+            return
+        ts = ts or time.time()
+        with self._lock:
+            for metric, value in metrics.items():
+                series = self._get_series(serial, metric)
+                series.append(ts, value)
+                if len(series.pending_ts) >= FLUSH_THRESHOLD:
+                    series.flush()
+
+    def _get_series(self, serial, metric):
+        key = (serial, metric)
+        series = self._series.get(key)
+        if series is None:
+            series = Series(os.path.join(self.root, _safe(serial)), metric)
+            self._series[key] = series
+        return series
+
+    def metrics(self, serial):
+        names = set()
+        with self._lock:
+            names.update(m for s, m in self._series if s == serial)
+        directory = os.path.join(self.root, _safe(serial))
+        if os.path.isdir(directory):
+            names.update(name.rsplit("-", 1)[0] for name in os.listdir(directory) if name.endswith(".bin"))
+        return sorted(names)
+
+    def query(self, serial, metric, start, end, buckets):
+        """Bucketed min/max/avg über [start, end]; leere Buckets werden ausgelassen."""
+        buckets = max(1, buckets)
+        width = (end - start) / buckets or 1
+        mins = [None] * buckets
+        maxs = [None] * buckets
+        sums = [0.0] * buckets
+        counts = [0] * buckets
+
+        # Speicherteil unter Lock kopieren, Plattenteil ohne Lock lesen
+        with self._lock:
+            series = self._series.get((serial, metric)) or Series(os.path.join(self.root, _safe(serial)), metric)
+            recent = series.memory_samples(start, end)
+        # Falls inzwischen geflusht wurde, nicht doppelt zählen
+        first_recent = int(recent[0][0]) if recent else None
+
+        def samples():
+            for ts, value in series.disk_samples(start, end):
+                if first_recent is not None and ts >= first_recent:
+                    break
+                yield ts, value
+            yield from recent
+
+        for ts, value in samples():
+            i = min(int((ts - start) / width), buckets - 1)
+            if counts[i] == 0:
+                mins[i] = maxs[i] = value
+            else:
+                mins[i] = min(mins[i], value)
+                maxs[i] = max(maxs[i], value)
+            sums[i] += value
+            counts[i] += 1
+
+        return [
+            {"t": round(start + (i + 0.5) * width, 3), "min": mins[i], "max": maxs[i],
+             "avg": round(sums[i] / counts[i], 3), "n": counts[i]}
+            for i in range(buckets) if counts[i]
+        ]
+
+    def flush(self):
+        with self._lock:
+            for series in self._series.values():
+                series.flush()
+        self._prune()
+
+    def close(self):
+        with self._lock:
+            for series in self._series.values():
+                series.flush_ring()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                log.error("Fehler beim Schreiben: %s", e)
+
+    def _prune(self):
+        if not os.path.isdir(self.root):
+            return
+        oldest = _day(time.time() - RETENTION_DAYS * 86400)
+        for serial in os.listdir(self.root):
+            directory = os.path.join(self.root, serial)
+            for name in os.listdir(directory):
+                if name.endswith(".bin") and name[-12:-4] < oldest:
+                    os.remove(os.path.join(directory, name))
+
+
+def extract_metrics(delta):
+    print_section = delta.get("print")
+    if not isinstance(print_section, dict):
+        return {}
+    metrics = {}
+    for field, metric in PRINT_METRICS.items():
+        value = print_section.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[metric] = float(value)
+    ams = print_section.get("ams")
+    if isinstance(ams, dict) and isinstance(ams.get("ams"), list):
+        for unit in ams["ams"]:
+            for field in ("humidity", "temp"):
+                value = _to_float(unit.get(field))
+                if value is not None:
+                    metrics[f"ams{unit.get('id')}_{field}"] = value
+    return metrics
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_range(path, start, end):
+    """Liest nur den Zeitbereich aus einer (zeitlich sortierten) Tagesdatei."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        n = size // RECORD.size
+        if n == 0:
+            return
+        # mmap statt read(): nur die Seiten im angefragten Bereich werden gelesen
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            i = bisect_left(_TimestampView(data, n), int(start))
+            while i < n:
+                ts, value = RECORD.unpack_from(data, i * RECORD.size)
+                if ts > end:
+                    break
+                yield ts, value
+                i += 1
+
+
+class _TimestampView:
+    def __init__(self, data, n):
+        self.data = data
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return struct.unpack_from("<I", self.data, i * RECORD.size)[0]
+
+
+def _day(ts):
+    return time.strftime("%Y%m%d", time.gmtime(ts))
+
+
+def _safe(name):
+    return "".join(c for c in str(name) if c.isalnum() or c in "-_") or "_"
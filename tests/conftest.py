@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import Store  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(str(tmp_path / "filacore.db"))
@@ -0,0 +1,106 @@
+import json
+import os
+import time
+
+import pytest
+
+import capture
+from capture import Capture, CaptureManager, read_capture
+
+
+class FakeConnection:
+    def __init__(self, serial):
+        self.serial = serial
+
+
+class FakeGateway:
+    def __init__(self):
+        self.raw_listeners = []
+
+    def add_raw_listener(self, fn):
+        self.raw_listeners.append(fn)
+
+    def remove_raw_listener(self, fn):
+        self.raw_listeners.remove(fn)
+
+    def emit(self, serial, payload):
+        for fn in list(self.raw_listeners):
+            fn(FakeConnection(serial), f"device/{serial}/report", json.dumps(payload).encode())
+
+
+def wait_for(check, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            raise AssertionError("Bedingung nicht erreicht")
+        time.sleep(0.01)
+
+
+@pytest.fixture(autouse=True)
+def fast_flush(monkeypatch):
+    monkeypatch.setattr(capture, "FLUSH_INTERVAL", 0.01)
+
+
+def test_segments_rotate_and_old_ones_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture, "SEGMENT_BYTES", 300)
+    monkeypatch.setattr(capture, "MAX_SEGMENTS", 3)
+    gateway = FakeGateway()
+    manager = CaptureManager(gateway, root=str(tmp_path))
+    cap = manager.start("SER1")
+
+    # Jede Runde schreibt mehr als SEGMENT_BYTES, die nächste beginnt ein neues Segment
+    for batch in range(6):
+        for i in range(5):
+            gateway.emit("SER1", {"print": {"batch": batch, "i": i, "pad": "x" * 40}})
+        gateway.emit("SER2", {"print": {"anderer": True}})
+        wait_for(lambda: cap.messages == 5 * (batch + 1))
+    manager.stop(cap.id)
+
+    assert not cap.running and not gateway.raw_listeners
+    assert [name[:4] for name in cap.segments()] == ["0004", "0005", "0006"]
+    records = list(read_capture(cap.directory))
+    assert [json.loads(r["payload"])["print"]["batch"] for r in records] == [3] * 5 + [4] * 5 + [5] * 5
+    assert {r["serial"] for r in records} == {"SER1"}
+    assert cap.to_dict()["nachrichten"] == 30
+
+
+def test_full_buffer_counts_dropped_messages(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture, "MAX_BUFFERED", 5)
+    monkeypatch.setattr(capture, "FLUSH_INTERVAL", 60)
+    cap = Capture(str(tmp_path))
+    cap.start()
+    for i in range(8):
+        cap.on_raw(FakeConnection("SER1"), "device/SER1/report", b'{"i": %d}' % i)
+    assert cap.dropped == 3
+    cap.stop()
+
+    info = cap.to_dict()
+    assert (info["nachrichten"], info["verworfen"], info["status"]) == (5, 3, "stopped")
+    assert [json.loads(r["payload"])["i"] for r in read_capture(cap.directory)] == [0, 1, 2, 3, 4]
+
+
+def test_duration_stops_capture(tmp_path):
+    # Wie /debug_mqtt_stream?dauer=…: captures.start(serial, dauer)
+    gateway = FakeGateway()
+    manager = CaptureManager(gateway, root=str(tmp_path))
+    cap = manager.start("SER1", duration=0.2)
+    assert cap.to_dict()["dauer"] == 0.2
+    gateway.emit("SER1", {"print": {"i": 1}})
+    wait_for(lambda: not cap.running)
+
+    assert not gateway.raw_listeners
+    assert cap.stopped - cap.started == pytest.approx(0.2, abs=0.5)
+    gateway.emit("SER1", {"print": {"i": 2}})
+    assert [r["payload"] for r in read_capture(cap.directory)] == ['{"print": {"i": 1}}']
+    assert manager.list()[0].to_dict()["status"] == "stopped"
+
+
+def test_segment_path_rejects_traversal(tmp_path):
+    manager = CaptureManager(FakeGateway(), root=str(tmp_path / "captures"))
+    cap = manager.start()
+    cap.on_raw(FakeConnection("SER1"), "t", b"{}")
+    manager.stop(cap.id)
+    [name] = cap.segments()
+    assert manager.segment_path(cap.id, name) == os.path.realpath(tmp_path / "captures" / cap.id / name)
+    assert manager.segment_path("..", name) is None
+    assert manager.segment_path(cap.id, "../" + name) is None
@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+import pytest
+
+import certs
+from certs import CertificateManager
+from gateway_ipc import GatewayClient, GatewayServer, RemoteService
+
+PRINTER = {"serial": "SER1", "name": "Test", "ip": "127.0.0.1"}
+# Kein gültiges Zertifikat, cert_info() liefert dann nur den Fingerprint
+CHAIN = [b"\x30\x00"]
+
+
+@pytest.fixture
+def handshake(monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def fake_chain(ip, port=certs.CERT_PORT, timeout=certs.CERT_TIMEOUT):
+        calls.append(ip)
+        release.wait(5)
+        return CHAIN
+
+    monkeypatch.setattr(certs, "fetch_peer_chain", fake_chain)
+    return calls, release
+
+
+def test_concurrent_fetches_share_one_handshake(tmp_path, handshake):
+    calls, release = handshake
+    manager = CertificateManager(str(tmp_path))
+    arrived = threading.Barrier(3)
+    results = []
+
+    def fetch():
+        arrived.wait(5)
+        results.append(manager.fetch(PRINTER))
+
+    # Wie Job und ensure()/provision_certs gleichzeitig
+    threads = [threading.Thread(target=fetch), threading.Thread(target=fetch)]
+    for t in threads:
+        t.start()
+    arrived.wait(5)
+    time.sleep(0.2)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert len(results) == 2 and results[0] == results[1]
+    assert os.path.exists(manager.cert_path(PRINTER))
+
+
+
+class FakeGateway:
+    def add_listener(self, fn):
+        pass
+
+
+def test_fetch_through_gateway(tmp_path, handshake):
+    # Mit mehreren Workern läuft der Abruf im Gateway-Prozess, Argumente gehen über pickle
+    calls, release = handshake
+    release.set()
+    manager = CertificateManager(str(tmp_path / "certs"))
+    server = GatewayServer(str(tmp_path / "gw.sock"), FakeGateway(), {"cert_manager": manager}, authkey=b"k")
+    server.start()
+    try:
+        remote = RemoteService(GatewayClient(server.path, authkey=b"k"), "cert_manager")
+        assert remote.fetch(PRINTER)["fingerprint"]
+    finally:
+        server.close()
+    assert calls == [PRINTER["ip"]] and os.path.exists(manager.cert_path(PRINTER))
@@ -0,0 +1,144 @@
+import pytest
+import requests
+
+from cloud_client import CircuitBreaker, CloudClient, CloudUnavailable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    """Spielt vorbereitete Antworten (oder Exceptions) der Reihe nach ab."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.calls += 1
+        res = self.responses.pop(0)
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(failures=3, backoff=5.0, max_backoff=20.0, clock=clock)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    assert breaker.failure() == 0.0
+    assert breaker.failure() == 0.0
+    assert breaker.state == "closed" and breaker.allow()
+    assert breaker.failure() == 5.0
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.retry_in() == 5.0
+
+
+def test_success_resets_error_count(breaker):
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    assert breaker.failure() == 0.0
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_probe_through(breaker, clock):
+    for _ in range(3):
+        breaker.failure()
+    clock.advance(4.9)
+    assert breaker.state == "open" and not breaker.allow()
+    clock.advance(0.1)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    # Solange der Probeaufruf läuft, bleibt es gesperrt
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_backoff_doubles_up_to_maximum(breaker, clock):
+    for _ in range(3):
+        breaker.failure()
+    delays = []
+    for _ in range(4):
+        clock.advance(breaker.retry_in())
+        assert breaker.allow()
+        delays.append(breaker.failure())
+    assert delays == [10.0, 20.0, 20.0, 20.0]
+    assert breaker.state == "open" and breaker.retry_in() == 20.0
+
+    clock.advance(20.0)
+    assert breaker.allow()
+    breaker.success()
+    # Nach dem Schließen beginnt die Sperrzeit wieder bei backoff
+    for _ in range(3):
+        breaker.failure()
+    assert breaker.retry_in() == 5.0
+
+
+def test_client_opens_breaker_and_recovers(breaker, clock):
+    session = FakeSession(
+        FakeResponse(500), requests.ConnectionError("weg"), FakeResponse(503),
+        FakeResponse(200, {"print": {"gcode_state": "IDLE"}}),
+    )
+    client = CloudClient(base_url="http://cloud.invalid", ttl=0, breaker=breaker, session=session)
+    for _ in range(3):
+        with pytest.raises(CloudUnavailable):
+            client.printer_state("SER1", "code")
+    assert breaker.state == "open"
+
+    # Offen: kein Abruf, sofort CloudUnavailable
+    with pytest.raises(CloudUnavailable, match="gesperrt"):
+        client.printer_state("SER1", "code")
+    assert session.calls == 3
+
+    clock.advance(5.0)
+    assert client.printer_state("SER1", "code") == (200, {"print": {"gcode_state": "IDLE"}})
+    assert session.calls == 4
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens_with_longer_backoff(breaker, clock):
+    session = FakeSession(*[FakeResponse(500)] * 3, ValueError("kaputt"))
+    client = CloudClient(base_url="http://cloud.invalid", ttl=0, breaker=breaker, session=session)
+    for _ in range(3):
+        with pytest.raises(CloudUnavailable):
+            client.printer_state("SER1", "code")
+    clock.advance(5.0)
+    # Auch ein unerwarteter Fehler beendet den Probeaufruf
+    with pytest.raises(ValueError):
+        client.printer_state("SER1", "code")
+    assert breaker.state == "open" and breaker.retry_in() == 10.0
+
+
+def test_client_errors_do_not_count(breaker):
+    session = FakeSession(*[FakeResponse(404)] * 4)
+    client = CloudClient(base_url="http://cloud.invalid", ttl=0, breaker=breaker, session=session)
+    for _ in range(4):
+        assert client.printer_state("SER1", "code") == (404, None)
+    assert breaker.state == "closed"
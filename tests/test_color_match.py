@@ -0,0 +1,76 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import color_match
+from color_match import SpoolColorIndex
+
+MATERIALS = ["PLA", "PETG", "ABS"]
+
+
+@pytest.fixture
+def spools(store):
+    rng = random.Random(42)
+    for i in range(300):
+        store.add_spool({
+            "fcid": f"S{i:04d}",
+            "material": rng.choice(MATERIALS),
+            "farbe": "#%06X" % rng.randrange(0x1000000),
+        })
+    return store
+
+
+def queries():
+    rng = random.Random(7)
+    result = [("#%06X" % rng.randrange(0x1000000), rng.choice(MATERIALS + [None])) for _ in range(50)]
+    # Ungültige Farbe und unbekanntes Material liefern leere Ergebnisse
+    return result + [("xyz", "PLA"), ("#FF0000", "NYLON")]
+
+
+@pytest.mark.parametrize("limit,max_delta", [(3, 30.0), (10, 100.0), (1, 5.0)])
+def test_numpy_and_python_agree(spools, monkeypatch, limit, max_delta):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(color_match, "NUMPY_MIN_SPOOLS", 1)
+    index = SpoolColorIndex(spools)
+    with_numpy = index.match_many(queries(), limit, max_delta)
+    assert index._np_lab is not None
+    monkeypatch.setattr(color_match, "np", None)
+    pure = SpoolColorIndex(spools).match_many(queries(), limit, max_delta)
+
+    assert len(with_numpy) == len(pure)
+    for a, b in zip(with_numpy, pure):
+        assert [fcid for fcid, _ in a] == [fcid for fcid, _ in b]
+        assert [d for _, d in a] == pytest.approx([d for _, d in b], abs=0.1)
+    assert any(with_numpy)
+    assert with_numpy[-2:] == [[], []]
+
+
+def test_material_filter(spools):
+    index = SpoolColorIndex(spools)
+    for fcid, _ in index.match_many([("#808080", "petg")], limit=20, max_delta=100.0)[0]:
+        assert spools.get_spool(fcid)["material"] == "PETG"
+
+
+def test_numpy_not_imported_up_front():
+    code = "import sys, color_match; print('numpy' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(color_match.__file__)))
+    assert out.stdout.strip() == "False"
+
+
+def test_small_index_stays_pure_python(spools, monkeypatch):
+    monkeypatch.setattr(color_match, "NUMPY_MIN_SPOOLS", 1000)
+    index = SpoolColorIndex(spools)
+    assert index.match_many([("#FF0000", None)], limit=3, max_delta=100.0)[0]
+    assert index._np_lab is None
+
+
+def test_without_numpy_falls_back(spools, monkeypatch):
+    monkeypatch.setattr(color_match, "NUMPY_MIN_SPOOLS", 1)
+    monkeypatch.setattr(color_match, "np", None)
+    index = SpoolColorIndex(spools)
+    assert index.match_many([("#FF0000", None)], limit=3, max_delta=100.0)[0]
+    assert index._np_lab is None
@@ -0,0 +1,126 @@
+import pytest
+
+from consumption import ConsumptionTracker
+
+
+class Conn:
+    serial = "SER1"
+
+
+def report(remain, tray="0", unit="0"):
+    return {"print": {"ams": {"ams": [{"id": unit, "tray": [{"id": tray, "remain": remain}]}]}}}
+
+
+@pytest.fixture
+def tracker(store):
+    store.add_spool({"fcid": "A1", "material": "PLA", "gewicht": 1000, "preis": 25.0})
+    tracker = ConsumptionTracker(store)
+    tracker.assign("SER1", 0, 0, "A1")
+    return tracker
+
+
+def usage(tracker):
+    return tracker.usage("A1")[0]
+
+
+def test_first_value_only_sets_rest(tracker):
+    tracker.on_state_change(Conn(), report(80))
+    entry = usage(tracker)
+    assert entry["rest_g"] == 800.0
+    assert entry["verbrauch_g"] == 0
+    assert entry["kosten_verbraucht"] == 0
+
+
+def test_falling_remain_is_consumption(tracker):
+    for remain in (80, 75, 70):
+        tracker.on_state_change(Conn(), report(remain))
+    entry = usage(tracker)
+    assert entry["rest_g"] == 700.0
+    assert entry["verbrauch_g"] == 100.0
+    # preis ist pro kg
+    assert entry["kosten_verbraucht"] == 2.5
+
+
+def test_refill_is_not_counted(tracker):
+    for remain in (30, 20, 100, 90):
+        tracker.on_state_change(Conn(), report(remain))
+    entry = usage(tracker)
+    assert entry["rest_g"] == 900.0
+    assert entry["verbrauch_g"] == 200.0
+
+
+def test_unknown_remain_and_unassigned_trays_are_ignored(tracker):
+    tracker.on_state_change(Conn(), report(80))
+    tracker.on_state_change(Conn(), report(-1))
+    tracker.on_state_change(Conn(), report(10, tray="3"))
+    tracker.on_state_change(Conn(), report(70))
+    assert usage(tracker)["verbrauch_g"] == 100.0
+
+
+def test_new_assignment_restarts_measurement(tracker, store):
+    store.add_spool({"fcid": "B2", "material": "PLA", "gewicht": 500, "preis": 20.0})
+    tracker.on_state_change(Conn(), report(80))
+    tracker.assign("SER1", 0, 0, "B2")
+    tracker.on_state_change(Conn(), report(60))
+    assert tracker.usage("B2")[0]["verbrauch_g"] == 0
+    tracker.on_state_change(Conn(), report(50))
+    assert tracker.usage("B2")[0]["verbrauch_g"] == 50.0
+
+
+@pytest.mark.parametrize("gewicht", [None, "", 0])
+def test_missing_weight_leaves_rest_unknown(tracker, store, gewicht):
+    spool = {"fcid": "C3", "material": "PLA", "preis": 20.0}
+    if gewicht is not None:
+        spool["gewicht"] = gewicht
+    store.add_spool(spool)
+    tracker.assign("SER1", 0, 0, "C3")
+    for remain in (80, 70):
+        tracker.on_state_change(Conn(), report(remain))
+    entry = tracker.usage("C3")[0]
+    assert (entry["gewicht"], entry["rest_g"], entry["verbrauch_g"], entry["kosten_verbraucht"]) == (None, None, 0, 0)
+    tracker.flush()
+    assert "rest_g" not in store.get_spool("C3")
+
+
+def test_flush_writes_and_keeps_counting(tracker, store):
+    tracker.on_state_change(Conn(), report(80))
+    tracker.on_state_change(Conn(), report(70))
+    tracker.flush()
+    assert store.get_spool("A1")["verbrauch_g"] == 100.0
+    tracker.on_state_change(Conn(), report(60))
+    tracker.flush()
+    spool = store.get_spool("A1")
+    assert (spool["verbrauch_g"], spool["rest_g"], spool["kosten_verbraucht"]) == (200.0, 600.0, 5.0)
+
+
+def test_failed_flush_keeps_pending(tracker, store, monkeypatch):
+    tracker.on_state_change(Conn(), report(80))
+    tracker.on_state_change(Conn(), report(70))
+
+    def fail(updates):
+        raise RuntimeError("Datenbank gesperrt")
+
+    with monkeypatch.context() as m:
+        m.setattr(store, "update_spools", fail)
+        with pytest.raises(RuntimeError):
+            tracker.flush()
+    assert usage(tracker)["verbrauch_g"] == 100.0
+    tracker.flush()
+    assert store.get_spool("A1")["verbrauch_g"] == 100.0
+
+
+def test_value_observed_during_flush_is_not_lost(tracker, store, monkeypatch):
+    tracker.on_state_change(Conn(), report(80))
+    tracker.on_state_change(Conn(), report(70))
+    update_spools = store.update_spools
+
+    def slow_update(updates):
+        # Report trifft ein, während der Block noch geschrieben wird
+        tracker.on_state_change(Conn(), report(60))
+        update_spools(updates)
+
+    monkeypatch.setattr(store, "update_spools", slow_update)
+    tracker.flush()
+    monkeypatch.undo()
+    tracker.flush()
+    assert store.get_spool("A1")["verbrauch_g"] == 200.0
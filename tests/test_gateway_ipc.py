@@ -0,0 +1,78 @@
+import pytest
+
+from gateway_ipc import GatewayClient, GatewayServer, GatewayUnavailable, RemoteConnection
+from jobs import JobBoard
+from mqtt_gateway import PrinterConnection
+
+KEY = b"richtiger-schluessel"
+PRINTER = {"serial": "SER1", "name": "Test", "ip": "127.0.0.1", "access_code": "12345678"}
+
+
+class FakeGateway:
+    def __init__(self, conn):
+        self.conn = conn
+        self.stopped = False
+
+    def add_listener(self, fn):
+        pass
+
+    def get(self, serial):
+        return self.conn if serial == self.conn.serial else None
+
+    def cert_path(self, printer):
+        return "/tmp/blcert.pem"
+
+    def stop_all(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def server(tmp_path):
+    conn = PrinterConnection(PRINTER, str(tmp_path / "blcert.pem"))
+    conn.state.apply({"print": {"nozzle_temper": 215}})
+    server = GatewayServer(str(tmp_path / "gw.sock"), FakeGateway(conn), {"jobs": JobBoard()}, authkey=KEY)
+    server.start()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(server):
+    return GatewayClient(server.path, authkey=KEY)
+
+
+def test_whitelisted_calls(client):
+    assert client.call("gateway", "cert_path", PRINTER) == "/tmp/blcert.pem"
+    assert client.call("gateway", "exists", "SER1") is True
+    remote = RemoteConnection(client, "SER1")
+    assert remote.running is False
+    assert remote.state.get("print", "nozzle_temper") == 215
+    assert client.call("jobs", "list") == []
+
+
+@pytest.mark.parametrize("target, name, args", [
+    ("gateway", "stop_all", ()),
+    ("gateway", "_connections", ()),
+    ("conn", "stop", ("SER1",)),
+    ("conn", "client", ("SER1",)),
+    ("state", "apply", ("SER1", {"print": {"nozzle_temper": 0}})),
+    ("state", "restore", ("SER1", {}, 0)),
+    ("command", "_commands", ()),
+    ("jobs", "_prune", ()),
+    ("store", "list_spools", ()),
+])
+def test_names_outside_whitelist_are_rejected(server, client, target, name, args):
+    with pytest.raises(AttributeError):
+        client.call(target, name, *args)
+    assert server.gateway.stopped is False
+    assert server.gateway.conn.state.get("print", "nozzle_temper") == 215
+    # Die Verbindung bleibt danach benutzbar
+    assert client.call("gateway", "exists", "SER1") is True
+
+
+@pytest.mark.parametrize("authkey", [b"falscher-schluessel", None])
+def test_wrong_key_is_refused(server, authkey):
+    with pytest.raises(GatewayUnavailable):
+        GatewayClient(server.path, authkey=authkey).call("gateway", "exists", "SER1")
+    # Der Server nimmt danach weiter Worker mit gültigem Schlüssel an
+    assert GatewayClient(server.path, authkey=KEY).call("gateway", "exists", "SER1") is True
@@ -0,0 +1,104 @@
+import zipfile
+
+import pytest
+
+import gcode_analysis
+from gcode_analysis import AnalysisError, _Scanner, analyze_file, estimate_weight
+
+
+def write(tmp_path, text, name="test.gcode"):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def lengths(result):
+    return {t["tool"]: t["laenge_mm"] for t in result["werkzeuge"]}
+
+
+def test_relative_extrusion_sums_all_moves(tmp_path):
+    path = write(tmp_path, "M83\nG1 X10 E1.5\nG1 X20 E2.5 ; Kommentar\nG1 E-0.8\nG1 E0.8\nG0 X0\n")
+    result = analyze_file(path)
+    assert result["quelle"] == "scan"
+    assert lengths(result) == {0: 4.0}
+
+
+def test_absolute_extrusion_uses_last_value_and_g92(tmp_path):
+    path = write(tmp_path, "M82\nG1 X1 E1\nG1 X2 E3\nG1 X3 E5\nG92 E0\nG1 X4 E2\nG1 X5 E4\n")
+    assert lengths(analyze_file(path)) == {0: 9.0}
+
+
+def test_switching_between_modes(tmp_path):
+    path = write(tmp_path, "M82\nG1 E10\nM83\nG1 E1\nG1 E1\nM82\nG92 E0\nG1 E5\n")
+    assert lengths(analyze_file(path)) == {0: 17.0}
+
+
+def test_tool_changes_split_extrusion(tmp_path):
+    path = write(tmp_path, "M83\nT0\nG1 E10\nT1\nG1 E5\nT255\nG1 E7\nT0 ; zurück\nG1 E1\n")
+    # T255 (entladen) ist kein AMS-Tray, die Menge bleibt beim vorigen Werkzeug
+    assert lengths(analyze_file(path)) == {0: 11.0, 1: 12.0}
+
+
+def test_ignores_comments_and_other_commands(tmp_path):
+    path = write(tmp_path, "M83\n;G1 E100\nG1 X1 ; E50\nM104 S200 E9\nG1 E2\n")
+    assert lengths(analyze_file(path)) == {0: 2.0}
+
+
+def test_first_line_counts(tmp_path):
+    path = write(tmp_path, "G1 E3\nG1 E4\n")
+    # Ohne M82/M83 gilt absolut
+    assert lengths(analyze_file(path)) == {0: 4.0}
+
+
+def test_feed_handles_lines_split_across_blocks():
+    text = b"M83\nG1 X1 E1.25\nT1\nG1 E2.5\nG1 E0.25\n"
+    whole = _Scanner()
+    whole.scan(text)
+    for size in (1, 3, 7):
+        scanner = _Scanner()
+        for i in range(0, len(text), size):
+            scanner.feed(text[i:i + size])
+        scanner.finish()
+        assert scanner.extruded == whole.extruded == {0: 1.25, 1: 2.75}
+
+
+def test_small_window_gives_same_result(tmp_path, monkeypatch):
+    text = "M83\n" + "".join(f"T{i % 2}\nG1 X{i} E0.5\n" for i in range(200))
+    path = write(tmp_path, text)
+    expected = lengths(analyze_file(path))
+    monkeypatch.setattr(gcode_analysis, "WINDOW_BYTES", 64)
+    assert lengths(analyze_file(path)) == expected == {0: 50.0, 1: 50.0}
+
+
+def test_slicer_header_is_used(tmp_path):
+    header = ("; filament used [mm] = 1000.0, 250.0\n; filament used [g] = 3.0, 0.75\n"
+              "; filament_type = PLA;PETG\n; filament_density = 1.24,1.27\n")
+    path = write(tmp_path, header + "M83\nG1 E1\n")
+    result = analyze_file(path)
+    assert result["quelle"] == "slicer"
+    assert [(t["material"], t["laenge_mm"], t["gewicht_g"]) for t in result["werkzeuge"]] == [
+        ("PLA", 1000.0, 3.0), ("PETG", 250.0, 0.75)]
+    assert analyze_file(path, full_scan=True)["quelle"] == "scan"
+
+
+def test_3mf_plate(tmp_path):
+    path = tmp_path / "druck.3mf"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("Metadata/plate_1.gcode", "M83\nG1 E1\n")
+        archive.writestr("Metadata/plate_2.gcode", "M83\nG1 E2\nG1 E2\n")
+    assert lengths(analyze_file(str(path))) == {0: 1.0}
+    assert lengths(analyze_file(str(path), plate=2)) == {0: 4.0}
+    with pytest.raises(AnalysisError):
+        analyze_file(str(path), plate=3)
+
+
+def test_empty_file(tmp_path):
+    with pytest.raises(AnalysisError):
+        analyze_file(write(tmp_path, ""))
+
+
+def test_estimate_weight_from_material_density():
+    entry = {"volumen_cm3": 10.0, "gewicht_g": None, "material": "PETG HF"}
+    assert estimate_weight(entry) == 12.7
+    assert estimate_weight(entry, material="unbekannt") == 12.4
+    assert estimate_weight(dict(entry, gewicht_g=5.0)) == 5.0
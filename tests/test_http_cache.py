@@ -0,0 +1,99 @@
+import gzip
+import json
+import os
+
+import pytest
+from flask import Flask
+
+import http_cache
+from http_cache import MIN_COMPRESS_SIZE, FileCache, VersionedCache, json_payload
+
+app = Flask(__name__)
+
+BIG = {"spulen": ["PLA Basic Rot"] * (MIN_COMPRESS_SIZE // 10)}
+
+
+def respond(payload, **headers):
+    with app.test_request_context(headers=headers):
+        return payload.response()
+
+
+class FakeBrotli:
+    @staticmethod
+    def compress(data):
+        return b"br:" + data
+
+
+def test_etag_and_not_modified():
+    payload = json_payload(BIG)
+    first = respond(payload)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert etag == f'"{payload.etag}"'
+
+    cached = respond(payload, **{"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.get_data() == b""
+    assert cached.headers["ETag"] == etag
+    assert respond(json_payload(dict(BIG, neu=1)), **{"If-None-Match": etag}).status_code == 200
+
+
+def test_gzip_when_accepted(monkeypatch):
+    monkeypatch.setattr(http_cache, "brotli", None)
+    payload = json_payload(BIG)
+    resp = respond(payload, **{"Accept-Encoding": "gzip, br"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(resp.get_data())) == BIG
+    assert "Content-Encoding" not in respond(payload).headers
+
+
+def test_brotli_preferred_when_available(monkeypatch):
+    monkeypatch.setattr(http_cache, "brotli", FakeBrotli)
+    payload = json_payload(BIG)
+    resp = respond(payload, **{"Accept-Encoding": "gzip, br"})
+    assert resp.headers["Content-Encoding"] == "br"
+    assert resp.get_data() == b"br:" + payload.body
+    assert respond(payload, **{"Accept-Encoding": "gzip"}).headers["Content-Encoding"] == "gzip"
+
+
+def test_small_bodies_stay_uncompressed():
+    resp = respond(json_payload({"ok": True}), **{"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in resp.headers
+    assert resp.get_json() == {"ok": True}
+
+
+def test_file_cache_reloads_on_change(tmp_path):
+    path = tmp_path / "druckprofile.json"
+    path.write_text(json.dumps({"a": 1}))
+    cache = FileCache()
+    data, payload = cache.json(str(path))
+    assert data == {"a": 1}
+    assert cache.json(str(path))[1] is payload
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    path.write_text(json.dumps({"a": 22}))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    data, changed = cache.json(str(path))
+    assert data == {"a": 22} and changed.etag != payload.etag
+    assert cache.misses == 2
+
+
+def test_versioned_cache_follows_table_version(store):
+    cache = VersionedCache(store.list_printers)
+    empty = cache.get(store.versions["printers"])
+    assert cache.get(store.versions["printers"]) is empty
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    store.add_printer({"serial": "S1", "name": "X1"})
+    payload = cache.get(store.versions["printers"])
+    assert payload is not empty
+    assert [p["serial"] for p in json.loads(payload.body)] == ["S1"]
+    assert cache.misses == 2
+
+
+@pytest.mark.parametrize("name, mimetype", [("filacore.html", "text/html; charset=utf-8"),
+                                            ("daten.bin", "application/octet-stream")])
+def test_static_mimetype(tmp_path, name, mimetype):
+    path = tmp_path / name
+    path.write_bytes(b"x")
+    assert FileCache().static(str(path)).mimetype == mimetype
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+from gateway_ipc import GatewayClient, GatewayServer, RemoteService
+from jobs import JobBoard, JobRunner
+
+KEY = b"test-key"
+
+
+def wait_for(check, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            raise AssertionError("Bedingung nicht erreicht")
+        time.sleep(0.01)
+
+
+def until_cancelled(job, started):
+    started.set()
+    while True:
+        job.check_cancelled()
+        time.sleep(0.01)
+
+
+class FakeGateway:
+    def add_listener(self, fn):
+        pass
+
+
+@pytest.fixture
+def runner():
+    return JobRunner(workers=1)
+
+
+def test_cancel_before_start(runner):
+    release, calls = threading.Event(), []
+    blocker = runner.submit("blocker", lambda job: (release.wait(5), 200))
+    queued = runner.submit("queued", lambda job: (calls.append(job.id), 200))
+    assert runner.cancel(queued.id).status == "cancelled"
+    release.set()
+    assert blocker.done.wait(5) and queued.done.wait(5)
+    time.sleep(0.05)
+    assert calls == []
+    assert queued.status == "cancelled" and queued.started is None
+
+
+def test_cancel_while_running(runner):
+    started = threading.Event()
+    job = runner.submit("lang", until_cancelled, started)
+    assert started.wait(5)
+    runner.cancel(job.id)
+    assert job.done.wait(5)
+    assert job.status == "cancelled" and job.started is not None
+
+
+def test_cancel_races_with_start():
+    # Abbruch direkt beim Start: ein als cancelled gemeldeter Job darf danach nicht doch noch laufen
+    for _ in range(300):
+        runner = JobRunner(workers=1)
+        job = runner.submit("kurz", lambda job: ({}, 200))
+        status = runner.cancel(job.id).status
+        runner._pool.shutdown(wait=True)
+        if status == "cancelled":
+            assert job.status == "cancelled" and job.result is None
+        else:
+            assert job.status == "done" and job.started is not None
+
+
+@pytest.fixture
+def board_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "CANCEL_POLL_INTERVAL", 0.02)
+    server = GatewayServer(str(tmp_path / "gw.sock"), FakeGateway(), {"jobs": JobBoard()}, authkey=KEY)
+    server.start()
+    yield lambda: RemoteService(GatewayClient(server.path, authkey=KEY), "jobs")
+    server.close()
+
+
+def test_job_visible_and_cancellable_from_other_worker(board_client):
+    owner, other = JobRunner(workers=1, board=board_client()), JobRunner(workers=1, board=board_client())
+    started = threading.Event()
+    job = owner.submit("lang", until_cancelled, started, params={"printer": "X1"})
+    assert started.wait(5)
+
+    wait_for(lambda: other.get(job.id).status == "running")
+    assert other.get(job.id).to_dict()["params"] == {"printer": "X1"}
+    assert [r.id for r in other.list()] == [job.id]
+
+    # Abbruch über den anderen Worker, der ausführende holt ihn über das Board ab
+    assert other.cancel(job.id).id == job.id
+    assert job.done.wait(5)
+    assert job.status == "cancelled"
+    wait_for(lambda: other.get(job.id).status == "cancelled")
+
+
+def test_finished_job_result_on_other_worker(board_client):
+    owner, other = JobRunner(workers=1, board=board_client()), JobRunner(workers=1, board=board_client())
+    job = owner.submit("kurz", lambda job: ({"ok": True}, 201))
+    wait_for(lambda: other.get(job.id).status == "done")
+    data = other.get(job.id).to_dict()
+    assert data["status"] == "done" and data["result"] == {"ok": True} and data["status_code"] == 201
+    assert other.cancel("unbekannt") is None
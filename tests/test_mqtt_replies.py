@@ -0,0 +1,67 @@
+import pytest
+
+from mqtt_gateway import CommandError, PendingCommand, PrinterConnection
+
+PRINTER = {"serial": "SER1", "name": "Test", "ip": "127.0.0.1", "access_code": "12345678"}
+
+
+@pytest.fixture
+def conn(tmp_path):
+    return PrinterConnection(PRINTER, str(tmp_path / "blcert.pem"))
+
+
+def pending(conn, command="ams_filament_setting", section="print"):
+    cmd = PendingCommand(section, command, {section: {"command": command}}, timeout=1, retries=0)
+    conn._pending[cmd.key] = cmd
+    return cmd
+
+
+def test_reply_matches_sequence_id(conn):
+    first, second = pending(conn), pending(conn)
+    rest = conn._resolve_replies(
+        {"print": {"command": "ams_filament_setting", "sequence_id": second.sequence_id, "result": "success"}})
+    assert rest == {}
+    assert second.answered.is_set() and second.error is None
+    assert second.reply["sequence_id"] == second.sequence_id
+    assert not first.answered.is_set()
+
+
+def test_numeric_sequence_id_matches(conn):
+    cmd = pending(conn)
+    conn._resolve_replies({"print": {"command": "ams_filament_setting", "sequence_id": int(cmd.sequence_id)}})
+    assert cmd.answered.is_set()
+
+
+def test_same_sequence_id_other_command_is_ignored(conn):
+    cmd = pending(conn)
+    conn._resolve_replies({"print": {"command": "extrusion_cali_sel", "sequence_id": cmd.sequence_id}})
+    assert not cmd.answered.is_set()
+
+
+def test_failed_result_becomes_command_error(conn):
+    cmd = pending(conn)
+    conn._resolve_replies({"print": {"command": "ams_filament_setting", "sequence_id": cmd.sequence_id,
+                                     "result": "fail", "reason": "slot busy"}})
+    assert cmd.answered.is_set()
+    assert isinstance(cmd.error, CommandError)
+    assert str(cmd.error) == "slot busy"
+
+
+def test_first_reply_wins(conn):
+    cmd = pending(conn)
+    reply = {"command": "ams_filament_setting", "sequence_id": cmd.sequence_id, "result": "success"}
+    conn._resolve_replies({"print": reply})
+    conn._resolve_replies({"print": dict(reply, result="fail")})
+    assert cmd.error is None
+    assert cmd.reply["result"] == "success"
+
+
+def test_state_sections_pass_through(conn):
+    pending(conn)
+    payload = {
+        "print": {"command": "push_status", "gcode_state": "RUNNING"},
+        "info": {"module": []},
+        "system": {"command": "unknown", "sequence_id": "999999"},
+    }
+    rest = conn._resolve_replies(payload)
+    assert rest == {"print": payload["print"], "info": payload["info"]}
@@ -0,0 +1,139 @@
+import random
+import time
+from collections import defaultdict
+
+import pytest
+
+from print_history import PrintHistory
+from printer_state import PrinterState
+
+
+class FakeConnection:
+    def __init__(self, serial):
+        self.serial = serial
+        self.state = PrinterState()
+
+    def report(self, history, print_delta):
+        delta = self.state.apply({"print": print_delta})
+        history.on_state_change(self, delta)
+
+
+class FakeConsumption:
+    def __init__(self, assignments):
+        self.assignments = assignments
+
+    def assignment(self, serial, ams_id, tray_id):
+        return self.assignments.get((serial, ams_id, tray_id))
+
+
+def ams(remains, tray_now=None):
+    section = {"ams": [{"id": "0", "tray": [{"id": str(t), "remain": r, "tray_type": "PLA"}
+                                             for t, r in enumerate(remains)]}]}
+    if tray_now is not None:
+        section["tray_now"] = str(tray_now)
+    return {"ams": section}
+
+
+def all_jobs(store):
+    jobs, cursor = [], None
+    while True:
+        page = store.list_print_jobs(limit=100, cursor=cursor)
+        jobs.extend(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return jobs
+
+
+def test_job_records_usage_and_cost(store):
+    store.add_spool({"fcid": "A1", "material": "PETG", "farbe": "#00FF00", "gewicht": 1000, "preis": 25.0})
+    history = PrintHistory(store, FakeConsumption({("SER1", 0, 1): "A1"}))
+    conn = FakeConnection("SER1")
+    conn.report(history, dict(ams([90, 80]), gcode_state="IDLE"))
+    conn.report(history, dict(ams([90, 80], tray_now=1), gcode_state="RUNNING", subtask_name="Halter"))
+    assert history.running("SER1")["name"] == "Halter"
+    conn.report(history, ams([90, 68]))
+    conn.report(history, {"gcode_state": "FINISH"})
+
+    assert history.running("SER1") is None
+    [job] = all_jobs(store)
+    assert job["status"] == "finish" and job["vollstaendig"] is True
+    assert [(s["tray_id"], s["fcid"], s["material"], s["gewicht_g"], s["kosten"]) for s in job["spulen"]] == [
+        (1, "A1", "PETG", 120.0, 3.0)]
+    assert (job["gewicht_g"], job["kosten"]) == (120.0, 3.0)
+
+
+def test_spool_without_weight_has_unknown_usage(store):
+    store.add_spool({"fcid": "A1", "material": "PLA", "gewicht": 500, "preis": 20.0})
+    store.add_spool({"fcid": "B2", "material": "PETG", "preis": 30.0})
+    history = PrintHistory(store, FakeConsumption({("SER1", 0, 0): "A1", ("SER1", 0, 1): "B2"}))
+    conn = FakeConnection("SER1")
+    conn.report(history, dict(ams([50, 50]), gcode_state="IDLE"))
+    conn.report(history, dict(ams([50, 50]), gcode_state="RUNNING"))
+    conn.report(history, ams([40, 30]))
+    conn.report(history, {"gcode_state": "FINISH"})
+
+    [job] = all_jobs(store)
+    assert [(s["fcid"], s["gewicht_g"], s["kosten"]) for s in job["spulen"]] == [("A1", 50.0, 1.0), ("B2", None, None)]
+    assert (job["gewicht_g"], job["kosten"]) == (50.0, 1.0)
+    stats = {s["gruppe"]: s for s in store.print_job_stats("material")}
+    assert (stats["PLA"]["gewicht_g"], stats["PETG"]["gewicht_g"]) == (50.0, 0)
+
+
+def test_totals_match_raw_jobs(store):
+    rng = random.Random(7)
+    base = time.mktime((2026, 3, 1, 12, 0, 0, 0, 0, -1))
+    for i in range(300):
+        spools = [{"material": rng.choice(["PLA", "PETG", "ASA", ""]), "gewicht_g": round(rng.uniform(0, 80), 1),
+                   "kosten": round(rng.uniform(0, 3), 2)} for _ in range(rng.randint(0, 3))]
+        store.add_print_job({
+            "serial": rng.choice(["S1", "S2", "S3"]), "name": f"job{i}",
+            "status": rng.choice(["finish", "finish", "failed", "cancelled"]),
+            "finished": base + rng.randint(0, 9) * 86400 + rng.randint(-3600, 3600),
+            "dauer": round(rng.uniform(60, 7200), 1),
+            "gewicht_g": round(sum(s["gewicht_g"] for s in spools), 1),
+            "kosten": round(sum(s["kosten"] for s in spools), 2),
+            "spulen": spools,
+        })
+
+    jobs = all_jobs(store)
+    assert len(jobs) == 300
+
+    def expected(key, since=None, until=None, serial=None):
+        totals = defaultdict(lambda: defaultdict(float))
+        for job in jobs:
+            day = time.strftime("%Y-%m-%d", time.localtime(job["finished"]))
+            if (since and day < since) or (until and day > until) or (serial and job["serial"] != serial):
+                continue
+            if key == "material":
+                materials = defaultdict(lambda: [0.0, 0.0])
+                for s in job["spulen"]:
+                    materials[s["material"]][0] += s["gewicht_g"]
+                    materials[s["material"]][1] += s["kosten"]
+                for material, (grams, cost) in materials.items():
+                    entry = totals[material]
+                    entry["auftraege"] += 1
+                    entry["gewicht_g"] += grams
+                    entry["kosten"] += cost
+                continue
+            entry = totals[day if key == "tag" else job["serial"]]
+            entry["auftraege"] += 1
+            entry["erfolgreich"] += job["status"] == "finish"
+            entry["dauer"] += job["dauer"]
+            entry["gewicht_g"] += job["gewicht_g"]
+            entry["kosten"] += job["kosten"]
+        return totals
+
+    def check(group, **filters):
+        stats = store.print_job_stats(group, **filters)
+        want = expected(group, **filters)
+        assert [s["gruppe"] for s in stats] == sorted(want)
+        for s in stats:
+            for field, value in want[s["gruppe"]].items():
+                assert s[field] == pytest.approx(value, abs=0.051), (group, s["gruppe"], field)
+
+    check("tag")
+    check("serial")
+    check("material")
+    check("tag", since="2026-03-03", until="2026-03-06")
+    check("material", serial="S2")
+    assert sum(s["auftraege"] for s in store.print_job_stats("serial")) == 300
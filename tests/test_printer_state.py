@@ -0,0 +1,86 @@
+from printer_state import PrinterState, merge_report
+
+
+def ams(*trays, unit="0"):
+    return {"print": {"ams": {"ams": [{"id": unit, "tray": list(trays)}]}}}
+
+
+def test_first_report_fills_state():
+    state = PrinterState()
+    assert state.empty
+    changed = state.apply({"print": {"gcode_state": "IDLE", "nozzle_temper": 25}})
+    assert changed == {"print": {"gcode_state": "IDLE", "nozzle_temper": 25}}
+    assert not state.empty
+    assert state.version == 1
+
+
+def test_delta_returns_only_changed_fields():
+    state = PrinterState()
+    state.apply({"print": {"gcode_state": "IDLE", "nozzle_temper": 25, "bed_temper": 20}})
+    changed = state.apply({"print": {"gcode_state": "RUNNING", "nozzle_temper": 25}})
+    assert changed == {"print": {"gcode_state": "RUNNING"}}
+    assert state.get("print", "bed_temper") == 20
+    assert state.version == 2
+
+
+def test_unchanged_report_keeps_version():
+    state = PrinterState()
+    state.apply({"print": {"gcode_state": "IDLE"}})
+    json_before = state.snapshot_json()
+    assert state.apply({"print": {"gcode_state": "IDLE"}}) == {}
+    assert state.version == 1
+    assert state.snapshot_json() is json_before
+
+
+def test_keyed_list_merges_by_id():
+    state = PrinterState()
+    state.apply(ams({"id": "0", "remain": 80, "tray_type": "PLA"}, {"id": "1", "remain": 50, "tray_type": "PETG"}))
+    changed = state.apply(ams({"id": "1", "remain": 45}))
+    assert changed == ams({"id": "1", "remain": 45})
+    trays = state.get("print", "ams", "ams")[0]["tray"]
+    assert trays == [
+        {"id": "0", "remain": 80, "tray_type": "PLA"},
+        {"id": "1", "remain": 45, "tray_type": "PETG"},
+    ]
+
+
+def test_keyed_list_appends_new_ids():
+    state = PrinterState()
+    state.apply(ams({"id": "0", "remain": 80}))
+    changed = state.apply(ams({"id": "2", "remain": 10}))
+    assert changed == ams({"id": "2", "remain": 10})
+    assert [t["id"] for t in state.get("print", "ams", "ams")[0]["tray"]] == ["0", "2"]
+
+
+def test_id_only_entry_clears_slot():
+    state = PrinterState()
+    state.apply(ams({"id": "0", "remain": 80, "tray_type": "PLA"}))
+    changed = state.apply(ams({"id": "0"}))
+    assert changed == ams({"id": "0"})
+    assert state.get("print", "ams", "ams")[0]["tray"] == [{"id": "0"}]
+    # Erneut leer: keine Änderung
+    assert state.apply(ams({"id": "0"})) == {}
+
+
+def test_plain_list_is_replaced():
+    target = {"hms": [{"attr": 1}]}
+    assert merge_report(target, {"hms": []}) == {"hms": []}
+    assert target == {"hms": []}
+
+
+def test_state_does_not_share_report_objects():
+    report = {"print": {"ams": {"ams": [{"id": "0", "tray": [{"id": "0", "remain": 1}]}]}}}
+    state = PrinterState()
+    state.apply(report)
+    report["print"]["ams"]["ams"][0]["tray"][0]["remain"] = 99
+    assert state.get("print", "ams", "ams")[0]["tray"][0]["remain"] == 1
+
+
+def test_restore_only_before_first_report():
+    state = PrinterState()
+    assert state.restore({"print": {"gcode_state": "FINISH"}}, 1000.0)
+    assert state.restored
+    state.apply({"print": {"gcode_state": "IDLE"}})
+    assert not state.restored
+    assert not state.restore({"print": {"gcode_state": "FINISH"}}, 1000.0)
+    assert state.get("print", "gcode_state") == "IDLE"
@@ -0,0 +1,171 @@
+import json
+import sqlite3
+
+import pytest
+
+from storage import SCHEMA_VERSION, SPOOL_COLUMNS, DuplicateError, Store
+
+
+def spool(fcid, material="PLA", hersteller="Acme", preis=20.0, **fields):
+    return dict({"fcid": fcid, "material": material, "hersteller": hersteller, "druckprofil": "GFL99",
+                 "farbe": "#FF0000", "preis": preis, "temp_min": 190, "temp_max": 220}, **fields)
+
+
+def all_pages(fetch, limit):
+    items, cursor, pages = [], None, 0
+    while True:
+        page = fetch(limit=limit, cursor=cursor)
+        items.extend(page["items"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items, pages
+
+
+def test_new_database_gets_schema(store):
+    conn = store._conn()
+    tables = {r["name"] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"spools", "printers", "meta"} <= tables
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def test_migration_is_idempotent(tmp_path):
+    path = str(tmp_path / "filacore.db")
+    Store(path).add_spool(spool("A1"))
+    store = Store(path)
+    assert [s["fcid"] for s in store.list_spools()] == ["A1"]
+    assert store._conn().execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def test_import_json_runs_once(tmp_path, store):
+    spools_file, printers_file = tmp_path / "spools.json", tmp_path / "printers.json"
+    spools_file.write_text(json.dumps([spool("A1"), {"material": "ohne FCID"}]))
+    printers_file.write_text(json.dumps([{"serial": "S1", "name": "X1", "active": True}, {"serial": "S2"}]))
+    store.import_json(str(spools_file), str(printers_file))
+    spools_file.write_text(json.dumps([spool("A1"), spool("B2")]))
+    store.import_json(str(spools_file), str(printers_file))
+
+    assert [s["fcid"] for s in store.list_spools()] == ["A1"]
+    assert [p["serial"] for p in store.list_printers()] == ["S1"]
+    assert store.active_printer()["serial"] == "S1"
+
+
+def test_duplicate_spool(store):
+    store.add_spool(spool("A1"))
+    with pytest.raises(DuplicateError):
+        store.add_spool(spool("A1", material="PETG"))
+    assert store.get_spool("A1")["material"] == "PLA"
+
+
+def test_update_spool_merges_fields(store):
+    store.add_spool(spool("A1"))
+    assert store.update_spool("A1", {"preis": 30.0})["preis"] == 30.0
+    assert store.get_spool("A1")["material"] == "PLA"
+    assert store.update_spool("FEHLT", {"preis": 1.0}) is None
+
+
+def test_only_one_active_printer(store):
+    for serial, name in (("S1", "A"), ("S2", "B")):
+        store.add_printer({"serial": serial, "name": name, "ip": "192.168.1.2"})
+    store.set_active_printer("S1")
+    store.set_active_printer("S2")
+    assert [p["active"] for p in store.list_printers()] == [False, True]
+    assert store.set_active_printer("S9") is None
+    assert store.active_printer()["serial"] == "S2"
+
+
+def test_duplicate_printer_name_or_serial(store):
+    store.add_printer({"serial": "S1", "name": "A"})
+    with pytest.raises(DuplicateError, match="Name"):
+        store.add_printer({"serial": "S2", "name": "A"})
+    with pytest.raises(DuplicateError, match="Serial"):
+        store.add_printer({"serial": "S1", "name": "B"})
+
+
+def test_versions_bump_only_on_changes(store):
+    store.add_spool(spool("A1"))
+    store.add_printer({"serial": "S1", "name": "A"})
+    spools, printers = store.versions["spools"], store.versions["printers"]
+
+    store.update_spools({"FEHLT": {"rest_g": 1.0}})
+    assert not store.delete_spool("FEHLT")
+    assert not store.delete_printer("S9")
+    assert (store.versions["spools"], store.versions["printers"]) == (spools, printers)
+
+    store.update_spools({"A1": {"rest_g": 500.0}, "FEHLT": {"rest_g": 1.0}})
+    assert store.versions["spools"] == spools + 1
+    assert store.delete_printer("S1")
+    assert store.versions["printers"] == printers + 1
+
+
+def test_migrates_old_database(tmp_path):
+    path = str(tmp_path / "alt.db")
+    # Stand vor den abgeleiteten Spalten: nur fcid + JSON
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE spools (fcid TEXT PRIMARY KEY, data TEXT NOT NULL)")
+    conn.execute("INSERT INTO spools VALUES (?, ?)", ("A1", json.dumps(spool("A1", material="PETG", preis=25))))
+    conn.execute("PRAGMA user_version=1")
+    conn.commit()
+    conn.close()
+
+    store = Store(path)
+    conn = store._conn()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(spools)")}
+    assert set(SPOOL_COLUMNS) <= columns
+    row = conn.execute("SELECT material, preis, temp_max FROM spools WHERE fcid = 'A1'").fetchone()
+    assert (row["material"], row["preis"], row["temp_max"]) == ("PETG", 25, 220)
+    # Filter und Suche greifen auf die nachgetragenen Spalten bzw. den Index zu
+    assert [s["fcid"] for s in store.query_spools(filters={"material": ["petg"]})["items"]] == ["A1"]
+    assert [s["fcid"] for s in store.query_spools(search="acm")["items"]] == ["A1"]
+
+
+def test_query_spools_pages_in_insert_order(store):
+    for i in range(23):
+        store.add_spool(spool(f"S{i:02d}"))
+    items, pages = all_pages(store.query_spools, 5)
+    assert [s["fcid"] for s in items] == [f"S{i:02d}" for i in range(23)]
+    assert pages == 5
+
+
+@pytest.mark.parametrize("desc", [False, True])
+def test_query_spools_keyset_with_duplicate_sort_values(store, desc):
+    # Viele gleiche Preise: die rowid entscheidet, keine Zeile doppelt oder verloren
+    for i in range(20):
+        store.add_spool(spool(f"S{i:02d}", preis=float(i % 3)))
+    items, _ = all_pages(lambda **kw: store.query_spools(sort="preis", desc=desc, **kw), 4)
+    expected = sorted(store.list_spools(), key=lambda s: s["preis"], reverse=desc)
+    assert [s["preis"] for s in items] == [s["preis"] for s in expected]
+    assert sorted(s["fcid"] for s in items) == [f"S{i:02d}" for i in range(20)]
+
+
+def test_query_spools_cursor_survives_inserts(store):
+    for i in range(6):
+        store.add_spool(spool(f"S{i}"))
+    first = store.query_spools(limit=3)
+    store.add_spool(spool("NEU"))
+    second = store.query_spools(limit=3, cursor=first["next_cursor"])
+    assert [s["fcid"] for s in second["items"]] == ["S3", "S4", "S5"]
+    assert second["total"] == 7
+
+
+def test_query_spools_rejects_bad_input(store):
+    with pytest.raises(ValueError):
+        store.query_spools(sort="data")
+    with pytest.raises(ValueError):
+        store.query_spools(cursor="kaputt")
+
+
+def test_list_print_jobs_newest_first(store):
+    for i in range(7):
+        store.add_print_job({"serial": "A" if i % 2 else "B", "name": f"job{i}", "status": "finish",
+                             "finished": 1_700_000_000 + i, "dauer": 60, "gewicht_g": 1.0, "kosten": 0.1})
+    items, pages = all_pages(store.list_print_jobs, 3)
+    assert [j["name"] for j in items] == [f"job{i}" for i in reversed(range(7))]
+    assert pages == 3
+
+    only_a, _ = all_pages(lambda **kw: store.list_print_jobs(serial="A", **kw), 2)
+    assert [j["name"] for j in only_a] == ["job5", "job3", "job1"]
+
+    with pytest.raises(ValueError):
+        store.list_print_jobs(cursor="x")
@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+
+import telemetry
+from telemetry import RECORD, RingBuffer, Series, TelemetryRecorder, _day, extract_metrics
+
+# Zehn Sekunden vor Mitternacht (UTC) und innerhalb von RETENTION_DAYS
+T0 = int(time.time()) // 86400 * 86400 - 10
+
+
+def test_ring_buffer_wraps_around():
+    ring = RingBuffer(3)
+    assert [ring.append(T0 + i, float(i)) for i in range(3)] == [None, None, None]
+    assert ring.append(T0 + 3, 3.0) == (T0, 0.0)
+    assert ring.append(T0 + 4, 4.0) == (T0 + 1, 1.0)
+    assert list(ring.samples()) == [(T0 + 2, 2.0), (T0 + 3, 3.0), (T0 + 4, 4.0)]
+    assert ring.count == 3 and ring.head == 2
+
+
+def test_evicted_samples_round_trip_through_day_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "RING_SIZE", 4)
+    series = Series(str(tmp_path), "nozzle_temper")
+    for i in range(24):
+        series.append(T0 + i, 200.0 + i / 2)
+    assert len(series.pending_ts) == 20
+    series.flush()
+    assert not series.pending_ts
+
+    # Über Mitternacht: zwei Tagesdateien mit je 8 Byte pro Sample
+    sizes = {name: os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path)}
+    assert sizes == {f"nozzle_temper-{_day(T0)}.bin": 10 * RECORD.size,
+                     f"nozzle_temper-{_day(T0 + 10)}.bin": 10 * RECORD.size}
+    on_disk = list(series.disk_samples(T0, T0 + 100))
+    assert on_disk == [(T0 + i, 200.0 + i / 2) for i in range(20)]
+    # Teilbereich über die Tagesgrenze
+    assert [ts for ts, _ in series.disk_samples(T0 + 8, T0 + 12)] == [T0 + 8, T0 + 9, T0 + 10, T0 + 11, T0 + 12]
+    assert series.memory_samples(T0, T0 + 100) == [(T0 + i, 200.0 + i / 2) for i in range(20, 24)]
+
+
+def test_query_combines_disk_and_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "RING_SIZE", 5)
+    recorder = TelemetryRecorder(str(tmp_path))
+    for i in range(20):
+        recorder.record("SER/1", {"bed_temper": float(i)}, ts=T0 + i)
+    recorder.flush()
+
+    buckets = recorder.query("SER/1", "bed_temper", T0, T0 + 20, 2)
+    assert [(b["min"], b["max"], b["n"]) for b in buckets] == [(0.0, 9.0, 10), (10.0, 19.0, 10)]
+    assert buckets[0]["avg"] == 4.5
+    assert recorder.metrics("SER/1") == ["bed_temper"]
+    assert os.listdir(tmp_path) == ["SER1"]
+
+
+def test_close_writes_ring_for_next_start(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "RING_SIZE", 8)
+    recorder = TelemetryRecorder(str(tmp_path))
+    for i in range(12):
+        recorder.record("SER1", {"progress": float(i * 5)}, ts=T0 + i)
+    recorder.close()
+
+    restarted = TelemetryRecorder(str(tmp_path))
+    assert restarted.metrics("SER1") == ["progress"]
+    buckets = restarted.query("SER1", "progress", T0, T0 + 12, 12)
+    assert [b["avg"] for b in buckets] == [float(i * 5) for i in range(12)]
+
+
+def test_values_are_stored_as_float32(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "RING_SIZE", 1)
+    series = Series(str(tmp_path), "chamber_temper")
+    series.append(T0, 35.1)
+    series.append(T0 + 1, 0.0)
+    series.flush()
+    [(ts, value)] = series.disk_samples(T0, T0)
+    assert ts == T0 and value == pytest.approx(35.1, abs=1e-5)
+
+
+def test_extract_metrics():
+    delta = {"print": {"nozzle_temper": 215, "mc_percent": 40, "gcode_state": "RUNNING", "bed_temper": True,
+                       "ams": {"ams": [{"id": "0", "humidity": "3", "temp": "24.5"}, {"id": "1", "humidity": "x"}]}}}
+    assert extract_metrics(delta) == {"nozzle_temper": 215.0, "progress": 40.0, "ams0_humidity": 3.0,
+                                      "ams0_temp": 24.5}
+    assert extract_metrics({"info": {}}) == {}
@@ -0,0 +1,199 @@
+"""End-to-End-Benchmark gegen simulierte Drucker.
+
+Startet N Simulatoren (tools/printer_sim.py) und FilaCore mit temporärer
+Datenbank in einem Prozess, treibt die wichtigsten Endpunkte parallel an und
+gibt pro Endpunkt p50/p99-Latenz, Requests/s und Fehler aus.
+
+    python tools/benchmark.py --printers 3 --duration 20 --clients 8
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests  # noqa: E402
+
+from printer_sim import start_simulators  # noqa: E402
+
+# Anteil der Endpunkte an der Last
+MIX = [
+    ("read_mqtt_state", 40),
+    ("get_printers", 20),
+    ("filamente", 20),
+    ("set_filament_mqtt", 10),
+    ("save_delete_filament", 10),
+]
+
+
+def start_app(workdir, port):
+    """FilaCore mit eigener Datenbank/Zertifikatsordner starten, liefert das app-Modul."""
+    os.environ["FILACORE_DB"] = os.path.join(workdir, "filacore.db")
+    os.environ["FILACORE_CERT_DIR"] = os.path.join(workdir, "printers")
+    os.environ["FILACORE_TELEMETRY_DIR"] = os.path.join(workdir, "telemetry")
+    os.environ["FILACORE_SNAPSHOT"] = os.path.join(workdir, "filacore_state.json")
+    import app as filacore
+    from werkzeug.serving import make_server
+
+    # Request-Logs würden die Messung verfälschen; werkzeug setzt seinen Logger selbst auf INFO
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    server = make_server("127.0.0.1", port, filacore.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return filacore, server
+
+
+def setup(base_url, printers, timeout=30):
+    session = requests.Session()
+    for printer in printers:
+        r = session.post(f"{base_url}/add_printer", json=printer)
+        r.raise_for_status()
+    r = session.post(f"{base_url}/provision_certs", json={})
+    r.raise_for_status()
+    session.post(f"{base_url}/set_active_printer", json={"serial": printers[0]["serial"]}).raise_for_status()
+
+    spool = {"material": "PLA", "druckprofil": "GFL99", "farbe": "#FF8800", "hersteller": "Bench",
+             "preis": "20", "tempMin": "190", "tempMax": "230", "gewicht": 1000}
+    fcid = session.post(f"{base_url}/api/save_filament", json=spool).json()["fcid"]
+
+    # Auf den ersten Report warten, damit die Messung nicht den Verbindungsaufbau enthält
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if session.get(f"{base_url}/read_mqtt_state").status_code == 200:
+            return fcid, spool
+        time.sleep(0.5)
+    raise RuntimeError("Kein Zustand vom Simulator empfangen")
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, name, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def run_request(session, base_url, name, fcid, spool):
+    if name == "read_mqtt_state":
+        return [session.get(f"{base_url}/read_mqtt_state")]
+    if name == "get_printers":
+        return [session.get(f"{base_url}/get_printers")]
+    if name == "filamente":
+        return [session.get(f"{base_url}/api/filamente")]
+    if name == "set_filament_mqtt":
+        return [session.post(f"{base_url}/set_filament_mqtt",
+                             json={"ams_id": 0, "slot": random.randint(1, 4), "fcid": fcid})]
+    if name == "save_delete_filament":
+        saved = session.post(f"{base_url}/api/save_filament", json=dict(spool, hersteller="Temp"))
+        responses = [saved]
+        if saved.ok:
+            responses.append(session.post(f"{base_url}/api/delete_filament", json={"fcid": saved.json()["fcid"]}))
+        return responses
+    raise ValueError(name)
+
+
+def worker(base_url, fcid, spool, stats, stop):
+    session = requests.Session()
+    names = [name for name, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    while not stop.is_set():
+        name = random.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            ok = all(r.ok for r in run_request(session, base_url, name, fcid, spool))
+        except requests.RequestException:
+            ok = False
+        stats.add(name, time.perf_counter() - started, ok)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def report(stats, duration):
+    rows = []
+    total = 0
+    for name, _ in MIX:
+        values = sorted(stats.latencies.get(name, []))
+        total += len(values)
+        rows.append({
+            "endpoint": name,
+            "requests": len(values),
+            "req_s": round(len(values) / duration, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "errors": stats.errors.get(name, 0),
+        })
+    return {"duration_s": duration, "total_req_s": round(total / duration, 1), "endpoints": rows}
+
+
+def print_table(result):
+    print(f"{'Endpunkt':<22}{'Requests':>10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'Fehler':>8}")
+    for row in result["endpoints"]:
+        print(f"{row['endpoint']:<22}{row['requests']:>10}{row['req_s']:>10}"
+              f"{row['p50_ms']:>10}{row['p99_ms']:>10}{row['errors']:>8}")
+    print(f"Gesamt: {result['total_req_s']} req/s über {result['duration_s']}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--printers", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=8, help="parallele HTTP-Clients")
+    parser.add_argument("--duration", type=float, default=20, help="Messdauer in Sekunden")
+    parser.add_argument("--port", type=int, default=5055, help="Port für FilaCore")
+    parser.add_argument("--sim-port", type=int, default=18883, help="erster Simulator-Port")
+    parser.add_argument("--interval", type=float, default=1.0, help="Sekunden zwischen Delta-Reports")
+    parser.add_argument("--json", action="store_true", help="Ergebnis als JSON ausgeben")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="filacore-bench-")
+    printers, _ = start_simulators(args.printers, args.sim_port, interval=args.interval, cert_dir=workdir)
+    filacore, server = start_app(workdir, args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    fcid, spool = setup(base_url, printers)
+
+    stats = Stats()
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker, args=(base_url, fcid, spool, stats, stop), daemon=True)
+               for _ in range(args.clients)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join(timeout=15)
+    result = report(stats, round(time.time() - started, 2))
+
+    server.shutdown()
+    filacore.gateway.stop_all()
+
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(result)
+    if any(row["errors"] for row in result["endpoints"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
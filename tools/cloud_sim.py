@@ -0,0 +1,90 @@
+"""Lokaler Ersatz für die Bambu-Cloud (``POST /v1/printer/state``) zum Testen des Cloud-Clients.
+
+Verzögerung und Fehlerquote sind einstellbar, damit Timeouts, Circuit Breaker
+und der Rückfall auf den MQTT-Zustand nachgestellt werden können. FilaCore
+mit ``FILACORE_CLOUD_URL=http://127.0.0.1:18080`` starten.
+
+    python tools/cloud_sim.py --port 18080 --delay 0.2 --fail-rate 0.3
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CloudHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-Alive, wie die echte API
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._reply(400, {"error": "invalid json"})
+        with server.lock:
+            server.requests += 1
+        if self.path != "/v1/printer/state":
+            return self._reply(404, {"error": "not found"})
+        if server.delay:
+            time.sleep(server.delay)
+        if random.random() < server.fail_rate:
+            return self._reply(503, {"error": "unavailable"})
+        if not payload.get("serial") or not payload.get("access_code"):
+            return self._reply(400, {"error": "serial and access_code required"})
+        self._reply(200, {
+            "serial": payload["serial"],
+            "online": True,
+            "print": {"gcode_state": "RUNNING", "mc_percent": random.randint(0, 100)},
+            "ts": time.time(),
+        })
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client hat nach seinem Timeout aufgelegt
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_cloud(port, host="127.0.0.1", delay=0.0, fail_rate=0.0):
+    """Startet den Ersatz in einem Hintergrund-Thread; delay/fail_rate lassen sich am Server ändern."""
+    server = ThreadingHTTPServer((host, port), CloudHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.fail_rate = fail_rate
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--delay", type=float, default=0.0, help="Sekunden bis zur Antwort")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Anteil der Antworten mit 503")
+    args = parser.parse_args()
+
+    server = start_cloud(args.port, args.host, args.delay, args.fail_rate)
+    print(f"Cloud-Ersatz auf http://{args.host}:{args.port}, Strg+C beendet.", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Lokaler Bambu-Drucker-Simulator für Tests und Benchmarks.
+
+Jeder simulierte Drucker ist ein minimaler MQTT-3.1.1-Broker über TLS (selbst
+signiertes Zertifikat), der wie ein A1 auf ``device/{serial}/request`` hört und
+auf ``device/{serial}/report`` volle und Delta-Reports sendet.
+
+    python tools/printer_sim.py --count 3 --base-port 18883
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK = 1, 2, 3, 4, 8, 9
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+TRAY_TYPES = [("PLA", "GFA00", "FF0000FF"), ("PETG", "GFG00", "00FF00FF"),
+              ("PLA", "GFL99", "0000FFFF"), ("TPU", "GFU01", "FFFFFFFF")]
+
+
+def make_self_signed_cert(directory):
+    cert = os.path.join(directory, "sim_cert.pem")
+    key = os.path.join(directory, "sim_key.pem")
+    if not os.path.exists(cert):
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+             "-days", "30", "-subj", "/CN=FilaCore-Simulator"],
+            check=True, capture_output=True,
+        )
+    return cert, key
+
+
+def _encode_length(n):
+    out = bytearray()
+    while True:
+        byte = n % 128
+        n //= 128
+        if n:
+            byte |= 0x80
+        out.append(byte)
+        if not n:
+            return bytes(out)
+
+
+def _packet(ptype, body, flags=0):
+    return bytes([(ptype << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _string(data, pos):
+    n = int.from_bytes(data[pos:pos + 2], "big")
+    return data[pos + 2:pos + 2 + n], pos + 2 + n
+
+
+def publish_packet(topic, payload):
+    t = topic.encode()
+    return _packet(PUBLISH, len(t).to_bytes(2, "big") + t + payload)
+
+
+class SimulatedPrinter:
+    def __init__(self, index, access_code="12345678", interval=1.0, printing=True):
+        self.serial = f"SIM{index:05d}"
+        self.access_code = access_code
+        self.interval = interval
+        self.report_topic = f"device/{self.serial}/report"
+        self.request_topic = f"device/{self.serial}/request"
+        self.clients = set()
+        self.sequence = 0
+        self.commands_acked = 0
+        self.state = self._initial_state(printing)
+
+    def _initial_state(self, printing):
+        trays = []
+        for i, (tray_type, idx, color) in enumerate(TRAY_TYPES):
+            trays.append({"id": str(i), "tray_type": tray_type, "tray_info_idx": idx, "tray_color": color,
+                          "remain": random.randint(40, 100), "nozzle_temp_min": "190", "nozzle_temp_max": "240"})
+        return {
+            "command": "push_status",
+            "gcode_state": "RUNNING" if printing else "IDLE",
+            "subtask_name": "benchmark_cube" if printing else "",
+            "mc_percent": 0,
+            "mc_remaining_time": 90,
+            "nozzle_temper": 215.0,
+            "nozzle_target_temper": 215,
+            "bed_temper": 60.0,
+            "bed_target_temper": 60,
+            "chamber_temper": 28,
+            "wifi_signal": "-45dBm",
+            "ams": {"ams": [{"id": "0", "humidity": "4", "temp": "26.1", "tray": trays}], "tray_now": "0"},
+        }
+
+    def full_report(self):
+        return {"print": dict(self.state, sequence_id=str(self._next_seq()))}
+
+    def delta_report(self):
+        delta = {
+            "command": "push_status",
+            "sequence_id": str(self._next_seq()),
+            "nozzle_temper": round(215 + random.uniform(-0.8, 0.8), 1),
+            "bed_temper": round(60 + random.uniform(-0.3, 0.3), 1),
+        }
+        if self.state["gcode_state"] == "RUNNING":
+            if random.random() < 0.2:
+                self.state["mc_percent"] = min(100, self.state["mc_percent"] + 1)
+                self.state["mc_remaining_time"] = max(0, self.state["mc_remaining_time"] - 1)
+                delta["mc_percent"] = self.state["mc_percent"]
+                delta["mc_remaining_time"] = self.state["mc_remaining_time"]
+            if random.random() < 0.05:
+                tray = self.state["ams"]["ams"][0]["tray"][int(self.state["ams"]["tray_now"])]
+                tray["remain"] = max(0, tray["remain"] - 1)
+                delta["ams"] = {"ams": [{"id": "0", "tray": [{"id": tray["id"], "remain": tray["remain"]}]}]}
+            if self.state["mc_percent"] >= 100:
+                self.state["gcode_state"] = delta["gcode_state"] = "FINISH"
+        self.state.update({k: v for k, v in delta.items() if k in ("nozzle_temper", "bed_temper")})
+        return {"print": delta}
+
+    def handle_request(self, payload):
+        """Antworten auf eine Nachricht an device/{serial}/request."""
+        if "pushing" in payload and payload["pushing"].get("command") == "pushall":
+            return [self.full_report()]
+        cmd = payload.get("print", {})
+        if cmd.get("command") == "ams_filament_setting":
+            ams = next((a for a in self.state["ams"]["ams"] if int(a["id"]) == int(cmd.get("ams_id", 0))), None)
+            if ams is None:
+                return [{"print": dict(cmd, result="fail", reason="ams not found")}]
+            tray = next((t for t in ams["tray"] if int(t["id"]) == int(cmd.get("tray_id", 0))), None)
+            if tray is None:
+                return [{"print": dict(cmd, result="fail", reason="tray not found")}]
+            tray.update(tray_type=cmd.get("tray_type"), tray_info_idx=cmd.get("tray_info_idx"),
+                        tray_color=cmd.get("tray_color"), remain=100)
+            self.commands_acked += 1
+            ack = {"print": dict(cmd, result="success")}
+            delta = {"print": {"command": "push_status", "sequence_id": str(self._next_seq()),
+                               "ams": {"ams": [{"id": ams["id"], "tray": [dict(tray)]}]}}}
+            return [ack, delta]
+        return []
+
+    def _next_seq(self):
+        self.sequence += 1
+        return self.sequence
+
+    def broadcast(self, report):
+        self.broadcast_raw(json.dumps(report).encode())
+
+    def broadcast_raw(self, payload):
+        packet = publish_packet(self.report_topic, payload)
+        for writer in list(self.clients):
+            try:
+                writer.write(packet)
+            except Exception:
+                self.clients.discard(writer)
+
+    async def run_reports(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.clients:
+                self.broadcast(self.delta_report())
+
+    async def handle_client(self, reader, writer):
+        subscribed = False
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                ptype = header[0] >> 4
+                qos = (header[0] >> 1) & 0x03
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b""
+
+                if ptype == CONNECT:
+                    ok = self._check_login(body)
+                    writer.write(_packet(CONNACK, bytes([0, 0 if ok else 5])))
+                    if not ok:
+                        break
+                elif ptype == SUBSCRIBE:
+                    packet_id = body[:2]
+                    topics = []
+                    pos = 2
+                    while pos < len(body):
+                        topic, pos = _string(body, pos)
+                        pos += 1
+                        topics.append(topic.decode())
+                    writer.write(_packet(SUBACK, packet_id + bytes([0] * len(topics)), flags=0))
+                    if self.report_topic in topics and not subscribed:
+                        subscribed = True
+                        self.clients.add(writer)
+                elif ptype == PUBLISH:
+                    topic, pos = _string(body, 0)
+                    if qos:
+                        writer.write(_packet(PUBACK, body[pos:pos + 2]))
+                        pos += 2
+                    if topic.decode() == self.request_topic:
+                        for report in self.handle_request(json.loads(body[pos:])):
+                            self.broadcast(report)
+                elif ptype == PINGREQ:
+                    writer.write(_packet(PINGRESP, b""))
+                elif ptype == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    def _check_login(self, body):
+        _, pos = _string(body, 0)
+        flags = body[pos + 1]
+        pos += 4
+        _, pos = _string(body, pos)
+        username = password = None
+        if flags & 0x80:
+            username, pos = _string(body, pos)
+        if flags & 0x40:
+            password, pos = _string(body, pos)
+        return username == b"bblp" and password == self.access_code.encode()
+
+
+async def _serve(printers, host, base_port, cert, key, ready):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    for i, printer in enumerate(printers):
+        await asyncio.start_server(printer.handle_client, host, base_port + i, ssl=ctx)
+        asyncio.ensure_future(printer.run_reports())
+    ready.set()
+    await asyncio.Event().wait()
+
+
+def start_simulators(count, base_port=18883, host="127.0.0.1", interval=1.0, cert_dir=None):
+    """Startet count Simulatoren in einem Hintergrund-Thread, liefert die Druckereinträge."""
+    printers = [SimulatedPrinter(i, interval=interval) for i in range(count)]
+    return serve_printers(printers, base_port, host, cert_dir), printers
+
+
+def serve_printers(printers, base_port=18883, host="127.0.0.1", cert_dir=None):
+    """Stellt fertige SimulatedPrinter-Objekte ab base_port bereit, liefert die Druckereinträge."""
+    cert, key = make_self_signed_cert(cert_dir or tempfile.mkdtemp(prefix="filacore-sim-"))
+    ready = threading.Event()
+    thread = threading.Thread(
+        target=lambda: asyncio.run(_serve(printers, host, base_port, cert, key, ready)), daemon=True)
+    thread.start()
+    if not ready.wait(10):
+        raise RuntimeError("Simulatoren konnten nicht gestartet werden")
+    return [
+        {"serial": p.serial, "access_code": p.access_code, "ip": host, "port": base_port + i,
+         "name": f"Simulator {i}"}
+        for i, p in enumerate(printers)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--base-port", type=int, default=18883)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--interval", type=float, default=1.0, help="Sekunden zwischen Delta-Reports")
+    args = parser.parse_args()
+
+    entries, _ = start_simulators(args.count, args.base_port, args.host, args.interval)
+    json.dump(entries, sys.stdout, indent=2)
+    print("\nSimulatoren laufen, Strg+C beendet.", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
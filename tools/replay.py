@@ -0,0 +1,150 @@
+"""MQTT-Mitschnitt (captures/<id>/) erneut abspielen.
+
+Ohne --serve läuft der Mitschnitt offline durch dieselbe Verarbeitung wie im
+Betrieb (PrinterConnection.feed -> PrinterState -> Listener) und meldet
+Durchsatz und Endzustand. Mit --serve wird jeder Drucker aus dem Mitschnitt
+als simulierter TLS-MQTT-Drucker bereitgestellt, so dass eine laufende
+FilaCore-Instanz die Nachrichten wie von echten Druckern empfängt.
+
+    python tools/replay.py captures/20260101-120000-ab12cd --speed 10
+    python tools/replay.py captures/20260101-120000-ab12cd --serve 18883 --speed 4 --loop
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from capture import read_capture, replay  # noqa: E402
+from mqtt_gateway import PrinterConnection  # noqa: E402
+from printer_sim import SimulatedPrinter, serve_printers  # noqa: E402
+from printer_state import merge_report  # noqa: E402
+from telemetry import TelemetryRecorder, extract_metrics  # noqa: E402
+
+
+def capture_serials(path):
+    serials = []
+    for record in read_capture(path):
+        if record["serial"] not in serials:
+            serials.append(record["serial"])
+    return serials
+
+
+def replay_offline(path, speed, serial=None, telemetry_dir=None, dump_state=False):
+    recorder = TelemetryRecorder(telemetry_dir) if telemetry_dir else None
+    connections = {}
+    changes = {}
+    current = {}
+
+    def on_change(conn, delta):
+        changes[conn.serial] = changes.get(conn.serial, 0) + 1
+        if recorder is not None:
+            recorder.record(conn.serial, extract_metrics(delta), ts=current["ts"])
+
+    def feed(record):
+        conn = connections.get(record["serial"])
+        if conn is None:
+            printer = {"serial": record["serial"], "name": record["serial"], "ip": "replay", "access_code": ""}
+            conn = connections[record["serial"]] = PrinterConnection(printer, "", on_change=on_change)
+        current["ts"] = record["ts"]
+        conn.feed(record["payload"])
+
+    started = time.perf_counter()
+    count = replay(read_capture(path, serial), feed, speed)
+    elapsed = time.perf_counter() - started
+    if recorder is not None:
+        recorder.close()
+
+    print(f"{count} Nachrichten in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.0f}/s)")
+    for serial_no, conn in connections.items():
+        print(f"  {serial_no}: {conn.reports_received} Reports, {changes.get(serial_no, 0)} Änderungen, "
+              f"Status {conn.state.get('print', 'gcode_state')}, Fortschritt {conn.state.get('print', 'mc_percent')}")
+    if dump_state:
+        json.dump({s: c.state.snapshot() for s, c in connections.items()}, sys.stdout, indent=2)
+        print()
+
+
+class ReplayPrinter(SimulatedPrinter):
+    """Simulierter Drucker, der statt erfundener Werte einen Mitschnitt sendet."""
+
+    def __init__(self, path, serial, speed, loop, access_code):
+        super().__init__(0, access_code=access_code)
+        self.path = path
+        self.serial = serial
+        self.report_topic = f"device/{serial}/report"
+        self.request_topic = f"device/{serial}/request"
+        self.speed = speed
+        self.loop = loop
+        # Bisher abgespielter Gesamtzustand, damit pushall beantwortet werden kann
+        self.state = {}
+
+    def handle_request(self, payload):
+        if "pushing" in payload:
+            return [self.state] if self.state else []
+        cmd = payload.get("print", {})
+        if cmd.get("command") and cmd.get("sequence_id"):
+            return [{"print": dict(cmd, result="success")}]
+        return []
+
+    async def run_reports(self):
+        while True:
+            while not self.clients:
+                await asyncio.sleep(0.2)
+            first_ts = started = None
+            for record in read_capture(self.path, self.serial):
+                if self.speed > 0:
+                    if first_ts is None:
+                        first_ts, started = record["ts"], time.monotonic()
+                    delay = started + (record["ts"] - first_ts) / self.speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    await asyncio.sleep(0)
+                try:
+                    merge_report(self.state, json.loads(record["payload"]))
+                except (ValueError, TypeError, AttributeError):
+                    pass
+                self.broadcast_raw(record["payload"].encode())
+            if not self.loop:
+                return
+
+
+def replay_serve(path, speed, base_port, access_code, loop, serial=None):
+    serials = [serial] if serial else capture_serials(path)
+    printers = [ReplayPrinter(path, s, speed, loop, access_code) for s in serials]
+    entries = serve_printers(printers, base_port, cert_dir=tempfile.mkdtemp(prefix="filacore-replay-"))
+    json.dump(entries, sys.stdout, indent=2)
+    print("\nMitschnitt wird abgespielt, sobald FilaCore verbunden ist. Strg+C beendet.", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="Mitschnitt-Ordner oder einzelnes .ndjson.gz-Segment")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = Echtzeit, 10 = zehnfach, 0 = ohne Pausen")
+    parser.add_argument("--serial", help="nur diesen Drucker abspielen")
+    parser.add_argument("--telemetry", metavar="DIR", help="offline: Telemetrie in diesen Ordner schreiben")
+    parser.add_argument("--state", action="store_true", help="offline: Endzustand als JSON ausgeben")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="als simulierte Drucker ab PORT bereitstellen")
+    parser.add_argument("--access-code", default="12345678")
+    parser.add_argument("--loop", action="store_true", help="mit --serve: Mitschnitt endlos wiederholen")
+    args = parser.parse_args()
+
+    if args.serve:
+        replay_serve(args.path, args.speed, args.serve, args.access_code, args.loop, args.serial)
+    else:
+        replay_offline(args.path, args.speed, args.serial, args.telemetry, args.state)
+
+
+if __name__ == "__main__":
+    main()
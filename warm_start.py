@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import threading
+import time
+
+SNAPSHOT_FILE = os.environ.get(
+    "FILACORE_SNAPSHOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "filacore_state.json"))
+SNAPSHOT_INTERVAL = int(os.environ.get("FILACORE_SNAPSHOT_INTERVAL", "60"))
+# Ältere Zustände sind nach einem Neustart nicht mehr hilfreich
+MAX_SNAPSHOT_AGE = 7 * 24 * 3600
+SNAPSHOT_FORMAT = 1
+
+log = logging.getLogger("warm_start")
+
+
+class StateSnapshot:
+    """Sichert Druckerzustände, Zertifikatsdaten und laufende Druckaufträge für den nächsten Start.
+
+    Geschrieben wird alle SNAPSHOT_INTERVAL Sekunden und beim Beenden, jeweils
+    atomar über eine temporäre Datei. Spulen und Tray-Zuordnungen liegen ohnehin
+    in SQLite und sind sofort nach dem Start verfügbar.
+    """
+
+    def __init__(self, gateway, cert_manager, print_history, path=SNAPSHOT_FILE, interval=SNAPSHOT_INTERVAL):
+        self.gateway = gateway
+        self.cert_manager = cert_manager
+        self.print_history = print_history
+        self.path = path
+        self.interval = interval
+        self.saved_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """Liest den letzten Snapshot und verteilt ihn; liefert die Anzahl übernommener Drucker."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            log.warning("Snapshot %s unlesbar, Start ohne gespeicherten Zustand: %s", self.path, e)
+            return 0
+        if data.get("format") != SNAPSHOT_FORMAT or time.time() - data.get("saved", 0) > MAX_SNAPSHOT_AGE:
+            return 0
+
+        states = data.get("printers", {})
+        self.gateway.restore_states(states)
+        self.cert_manager.restore_info(data.get("certs", {}))
+        self.print_history.restore_jobs(data.get("jobs", {}))
+        log.info("Warmstart: Zustand von %d Drucker(n) vom %s übernommen",
+                 len(states), time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(data["saved"])))
+        return len(states)
+
+    def save(self):
+        data = {
+            "format": SNAPSHOT_FORMAT,
+            "saved": time.time(),
+            "printers": self.gateway.saved_states(),
+            "certs": self.cert_manager.saved_info(),
+            "jobs": self.print_history.saved_jobs(),
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self.saved_at = data["saved"]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="warm-start", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        try:
+            self.save()
+        except OSError as e:
+            log.error("Snapshot nicht gespeichert: %s", e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                log.error("Snapshot nicht gespeichert: %s", e)